@@ -249,7 +249,14 @@ def optimize(ir_module, level=0, reporter=None):
 
 
 def ir_to_stream(
-    ir_module, march, output_stream, reporter=None, debug=False, opt="speed"
+    ir_module,
+    march,
+    output_stream,
+    reporter=None,
+    debug=False,
+    opt="speed",
+    jobs=None,
+    regalloc="coloring",
 ):
     """Translate IR module to output stream."""
     march = get_arch(march)
@@ -257,11 +264,13 @@ def ir_to_stream(
     if not reporter:  # pragma: no cover
         reporter = DummyReportGenerator()
 
-    code_generator = CodeGenerator(march, reporter, optimize_for=opt)
+    code_generator = CodeGenerator(
+        march, reporter, optimize_for=opt, regalloc=regalloc
+    )
     verify_module(ir_module)
 
     # Code generation:
-    code_generator.generate(ir_module, output_stream, debug=debug)
+    code_generator.generate(ir_module, output_stream, debug=debug, jobs=jobs)
 
 
 def ir_to_assembly(ir_modules, march, add_binary=False):
@@ -274,7 +283,14 @@ def ir_to_assembly(ir_modules, march, add_binary=False):
 
 
 def ir_to_object(
-    ir_modules, march, reporter=None, debug=False, opt="speed", outstream=None
+    ir_modules,
+    march,
+    reporter=None,
+    debug=False,
+    opt="speed",
+    outstream=None,
+    jobs=None,
+    regalloc="coloring",
 ):
     """Translate IR-modules into code for the given architecture.
 
@@ -286,6 +302,13 @@ def ir_to_object(
         debug (bool): include debugging information
         opt (str): optimization goal. Can be 'speed', 'size' or 'co2'.
         outstream: instruction stream to write instructions to
+        jobs (int): amount of processes to use for generating the
+            functions in parallel. The object file is identical to the
+            one produced by a serial build. Functions are generated
+            serially when the reporter collects instructions.
+        regalloc (str): register allocator to use. Can be 'coloring'
+            or 'linear'. The linear scan allocator is faster, but
+            produces less efficient code.
 
     Returns:
         ObjectFile: An object file
@@ -303,11 +326,14 @@ def ir_to_object(
     if debug:
         obj.debug_info = DebugInfo()
 
-    # Construct the various instruction streams:
+    # Construct the various instruction streams. Instructions are only
+    # kept when they are reported, otherwise they are released after
+    # they are encoded into the object:
     binary_output_stream = BinaryOutputStream(obj)
     sub_streams = [binary_output_stream]
     instruction_list = []
-    sub_streams.append(FunctionOutputStream(instruction_list.append))
+    if reporter.collects_instructions:
+        sub_streams.append(FunctionOutputStream(instruction_list.append))
     if outstream:
         sub_streams.append(outstream)
     output_stream = MasterOutputStream(sub_streams)
@@ -320,10 +346,13 @@ def ir_to_object(
             reporter=reporter,
             debug=debug,
             opt=opt,
+            jobs=jobs,
+            regalloc=regalloc,
         )
 
     reporter.message("All modules generated!")
-    reporter.dump_instructions(instruction_list, march)
+    if reporter.collects_instructions:
+        reporter.dump_instructions(instruction_list, march)
     return obj
 
 
@@ -44,6 +44,10 @@ class VirtualMachineArchitecture(MachineArchitecture):
 class Architecture(MachineArchitecture):
     """Base class for all targets"""
 
+    # Maximum distance in bytes from an instruction to a literal which it
+    # loads from a literal pool, or None when there is no such limit:
+    literal_pool_range = None
+
     def __init__(self, options=None):
         """Create a new machine instance.
 
@@ -128,6 +132,14 @@ class Architecture(MachineArchitecture):
         """Generate any instructions here if needed between two blocks"""
         return []
 
+    def gen_literal_pool(self, frame, constants):  # pragma: no cover
+        """Generate a literal pool with the given constants within a
+        function, and a jump over the pool.
+
+        This must be implemented when the literal_pool_range is set.
+        """
+        raise NotImplementedError("Implement this")
+
     @abc.abstractmethod
     def determine_arg_locations(self, arg_types):  # pragma: no cover
         """Determine argument location for a given function"""
@@ -50,6 +50,8 @@ class ArmArch(Architecture):
     def __init__(self, options=None):
         super().__init__(options=options)
         if self.has_option("thumb"):
+            # Literals are loaded at most 1020 bytes ahead:
+            self.literal_pool_range = 1020
             self.assembler = ThumbAssembler()
             self.isa = thumb_isa + data_isa
             # We use r7 as frame pointer (in case of thumb ;)):
@@ -66,6 +68,9 @@ class ArmArch(Architecture):
                 )
             ]
         else:
+            # Literals are loaded at most 4095 bytes ahead, rounded down to
+            # whole words:
+            self.literal_pool_range = 4092
             self.isa = arm_isa + data_isa
             self.assembler = ArmAssembler()
             self.fp = R11
@@ -350,13 +355,28 @@ class ArmArch(Architecture):
 
     def litpool(self, frame):
         """Generate instruction for the current literals"""
+        constants = frame.constants
+        frame.constants = []
+        yield from self.gen_literals(constants)
+
+    def gen_literal_pool(self, frame, constants):
+        """Generate a literal pool within a function, and jump over it"""
+        pool_end = frame.new_name("pool_end")
+        if self.has_option("thumb"):
+            yield thumb_instructions.B(pool_end)
+        else:
+            yield arm_instructions.B(pool_end)
+        yield from self.gen_literals(constants)
+        yield Label(pool_end)
+
+    def gen_literals(self, constants):
+        """Generate the data of the given literals"""
         # Align at 4 bytes
-        if frame.constants:
+        if constants:
             yield Alignment(4)
 
         # Add constant literals:
-        while frame.constants:
-            label, value = frame.constants.pop(0)
+        for label, value in constants:
             yield Label(label)
             if isinstance(value, int):
                 yield Dd(value)
@@ -0,0 +1,378 @@
+"""Decoding of instructions with tables.
+
+The fixed patterns of an instruction determine which bits of its tokens
+are fixed, and the values of those bits. The decoder of an isa groups the
+instructions by their tokens and the masks of their fixed bits. Within a
+group, the instruction is found by looking up the fixed bits in a
+dictionary. The first byte of the data selects the groups which can
+match, so only a few lookups are needed for each instruction.
+
+Instructions are decoded when they are encoded by their patterns, and all
+their operands are set by a pattern. A decoded instruction is encoded
+again, and only used when this gives the same data. Instructions with
+operands which are not part of the patterns, such as labels, are not
+decoded.
+"""
+
+import itertools
+import logging
+import struct
+
+from .arch_info import Endianness
+from .encoding import (
+    Constructor,
+    FixedPattern,
+    Instruction,
+    Operand,
+    Transform,
+    VariablePattern,
+    find_field,
+    get_token_classes,
+    struct_codes,
+    uses_generic_encoding,
+)
+from .registers import Register
+
+logger = logging.getLogger("decoder")
+
+
+class DecodeForm:
+    """An instruction class, with a choice of class for each of its
+    constructor operands, which can be decoded from its tokens.
+    """
+
+    def __init__(self, cls, choices, tokens, masks, values, fields):
+        self.cls = cls
+        self.choices = choices
+        self.tokens = tokens
+        self.masks = masks
+        self.values = values
+        self.fields = fields
+
+        # The operands of the parts, where constructor operands are given
+        # by the index of the part:
+        self.parts = []
+        numbers = itertools.count(1)
+        for constructor in (cls,) + choices:
+            operands = []
+            if constructor.syntax:
+                for prop in constructor.syntax.formal_arguments:
+                    if prop.is_constructor:
+                        operands.append(next(numbers))
+                    else:
+                        operands.append(prop)
+            self.parts.append((constructor, operands))
+
+    def __repr__(self):
+        return f"DecodeForm({self.cls.__name__}, {self.choices})"
+
+    @property
+    def layout(self):
+        """The sizes in bytes and byte orders of the tokens"""
+        return tuple(
+            (
+                token_cls.Info.size // 8,
+                (
+                    "little"
+                    if token_cls.Info.endianness == Endianness.LITTLE
+                    else "big"
+                ),
+            )
+            for token_cls in self.tokens
+        )
+
+    def decode(self, words, data):
+        """Create the instruction from the values of its tokens.
+
+        Returns None when the values do not give an instruction which is
+        encoded as the given data.
+        """
+        values = [{} for _ in self.parts]
+        for part, prop, index, pieces, convert in self.fields:
+            word = words[index]
+            value = 0
+            for b, e, s in pieces:
+                value |= ((word >> b) & ((1 << (e - b)) - 1)) << s
+            values[part][prop] = convert(value)
+
+        # Create the constructor operands before the instruction:
+        objects = [None] * len(self.parts)
+        for part in range(len(self.parts) - 1, -1, -1):
+            constructor, operands = self.parts[part]
+            part_values = values[part]
+            args = [
+                (
+                    objects[operand]
+                    if isinstance(operand, int)
+                    else part_values[operand]
+                )
+                for operand in operands
+            ]
+            objects[part] = constructor(*args)
+
+        instruction = objects[0]
+        if instruction.encode() != data:
+            return None
+        return instruction
+
+
+def constructor_props(cls):
+    """Get the operands of a constructor, which are constructors"""
+    if not cls.syntax:
+        return []
+    return [p for p in cls.syntax.formal_arguments if p.is_constructor]
+
+
+def make_forms(cls):
+    """Get the ways in which an instruction class can be decoded"""
+    if not getattr(cls, "tokens", None):
+        return []
+    if not getattr(cls.encode, "encodes_patterns", False):
+        return []
+    if not uses_generic_encoding(cls, Instruction):
+        return []
+
+    options = []
+    for prop in constructor_props(cls):
+        if isinstance(prop._cls, tuple):
+            options.append(prop._cls)
+        else:
+            options.append((prop._cls,))
+
+    forms = []
+    for choices in itertools.product(*options):
+        form = make_form(cls, choices)
+        if form is not None:
+            forms.append(form)
+    return forms
+
+
+def make_form(cls, choices):
+    """Determine the fixed bits and operand fields of an instruction with
+    the given classes of its constructor operands.
+
+    Returns None when the instruction cannot be decoded.
+    """
+    for constructor in choices:
+        if not issubclass(constructor, Constructor):
+            return None
+        if not uses_generic_encoding(constructor, Constructor):
+            return None
+        if constructor_props(constructor):
+            return None
+
+    shape = (cls,) + choices
+    tokens = get_token_classes(shape)
+    if not tokens:
+        return None
+
+    chosen = dict(zip(constructor_props(cls), choices))
+    masks = [0] * len(tokens)
+    values = [0] * len(tokens)
+    variable_masks = [0] * len(tokens)
+    fields = []
+    for part, constructor in enumerate(shape):
+        # Operands which must be set by the patterns:
+        needed = set()
+        if constructor.syntax:
+            for prop in constructor.syntax.formal_arguments:
+                if not prop.is_constructor:
+                    needed.add(prop)
+
+        for pattern in constructor.dict_to_patterns(constructor.patterns):
+            location = find_field(tokens, pattern.field)
+            if location is None:
+                return None
+            index, field = location
+
+            if type(pattern) is FixedPattern:
+                value = pattern.value
+            elif type(pattern) is VariablePattern:
+                prop = pattern.prop
+                if isinstance(prop, Operand) and prop.is_constructor:
+                    # The choice of constructor can determine a value:
+                    if not prop._value_map or prop not in chosen:
+                        return None
+                    value = prop._value_map[chosen[prop]]
+                else:
+                    convert = make_converter(prop, field)
+                    if convert is None:
+                        return None
+                    source = prop.source
+                    needed.discard(source)
+                    fields.append(
+                        (part, source, index, field._pieces, convert)
+                    )
+                    for b, e, _ in field._pieces:
+                        variable_masks[index] |= ((1 << (e - b)) - 1) << b
+                    continue
+            else:
+                return None
+
+            if not isinstance(value, int):
+                return None
+            if not field._wraps:
+                bits = field._bitsize
+                if not -(1 << bits) <= value < (1 << bits):
+                    return None
+            for b, e, s in field._pieces:
+                mask = ((1 << (e - b)) - 1) << b
+                bits = ((value >> s) << b) & mask
+                if (values[index] ^ bits) & masks[index] & mask:
+                    return None  # Conflicting fixed patterns
+                masks[index] |= mask
+                values[index] |= bits
+
+        if needed:
+            return None  # Operands which are not set by the patterns
+
+    # Bits which are set by operands are not fixed:
+    masks = tuple(m & ~v for m, v in zip(masks, variable_masks))
+    values = tuple(v & m for v, m in zip(values, masks))
+    if not any(masks):
+        return None
+    return DecodeForm(cls, choices, tokens, masks, values, fields)
+
+
+def make_converter(prop, field):
+    """Create a function which converts the value of a field into the
+    value of an operand.
+    """
+    if isinstance(prop, Operand):
+        if prop._cls is int:
+            if field._signed:
+                bits = field._bitsize
+                sign = 1 << (bits - 1)
+                return lambda value: (value ^ sign) - sign
+            return int
+        if isinstance(prop._cls, type) and issubclass(prop._cls, Register):
+            try:
+                registers = prop._cls.all_registers()
+            except NotImplementedError:
+                return None
+            registers = {r.num: r for r in registers}
+            return registers.__getitem__
+        return None
+
+    # Transforms are decoded when they can be reversed:
+    wrapped = prop
+    while isinstance(wrapped, Transform):
+        if type(wrapped).backwards is Transform.backwards:
+            return None
+        wrapped = wrapped._wrapped
+    if make_converter(wrapped, field) is None:
+        return None
+    return prop.from_value
+
+
+class DecodeGroup:
+    """Instructions with the same tokens and fixed bits"""
+
+    def __init__(self, layout, masks):
+        self.masks = masks
+        self.size = sum(size for size, _ in layout)
+        self.forms = {}
+        self.fixed_bits = sum(bin(mask).count("1") for mask in masks)
+
+        byteorders = {byteorder for _, byteorder in layout}
+        if len(byteorders) == 1 and all(s in struct_codes for s, _ in layout):
+            order = ">" if "big" in byteorders else "<"
+            codes = "".join(struct_codes[size] for size, _ in layout)
+            self.unpack = struct.Struct(order + codes).unpack_from
+        else:
+            self.unpack = self.unpack_tokens
+        self._layout = layout
+
+        # The mask of the fixed bits of the first byte:
+        size, byteorder = layout[0]
+        self._first_shift = 0 if byteorder == "little" else (size - 1) * 8
+        self.first_mask = (masks[0] >> self._first_shift) & 0xFF
+
+    def unpack_tokens(self, data, offset):
+        """Get the values of tokens which cannot be unpacked at once"""
+        words = []
+        for size, byteorder in self._layout:
+            words.append(
+                int.from_bytes(data[offset : offset + size], byteorder)
+            )
+            offset += size
+        return words
+
+    def add_form(self, form):
+        """Add an instruction with the fixed bits of this group"""
+        self.forms.setdefault(form.values, []).append(form)
+
+    def first_values(self):
+        """Get the values of the fixed bits of the first byte"""
+        return {
+            (values[0] >> self._first_shift) & 0xFF for values in self.forms
+        }
+
+    def decode(self, data, offset):
+        """Decode an instruction of this group at the given offset"""
+        end = offset + self.size
+        if end > len(data):
+            return None
+        words = self.unpack(data, offset)
+        key = tuple(w & m for w, m in zip(words, self.masks))
+        forms = self.forms.get(key)
+        if forms:
+            encoded = data[offset:end]
+            for form in forms:
+                try:
+                    instruction = form.decode(words, encoded)
+                except (KeyError, ValueError, TypeError, AssertionError):
+                    continue
+                if instruction is not None:
+                    return instruction
+        return None
+
+
+class Decoder:
+    """Decode instructions of an instruction set with tables.
+
+    The groups of instructions with the most fixed bits are tried first.
+    """
+
+    def __init__(self, instructions):
+        groups = {}
+        for cls in instructions:
+            for form in make_forms(cls):
+                key = (form.layout, form.masks)
+                if key not in groups:
+                    groups[key] = DecodeGroup(*key)
+                groups[key].add_form(form)
+        groups = sorted(groups.values(), key=lambda g: -g.fixed_bits)
+        self.groups = groups
+        logger.debug("Created decoder with %s groups", len(groups))
+
+        # The size of the smallest instruction:
+        self.min_size = min((g.size for g in groups), default=1)
+
+        # The groups which can match, for each value of the first byte:
+        self._first_byte = [[] for _ in range(256)]
+        for group in groups:
+            first_values = group.first_values()
+            for byte, candidates in enumerate(self._first_byte):
+                if byte & group.first_mask in first_values:
+                    candidates.append(group)
+
+    def decode(self, data, offset=0):
+        """Decode the instruction at the given offset in the data.
+
+        Returns None when the data is not a known instruction.
+        """
+        return self.match(data, offset)[0]
+
+    def match(self, data, offset):
+        """Decode the instruction at the given offset in the data, and
+        get its size in bytes.
+
+        When the data is not a known instruction, None is returned with
+        the size of the smallest instruction.
+        """
+        for group in self._first_byte[data[offset]]:
+            instruction = group.decode(data, offset)
+            if instruction is not None:
+                return instruction, group.size
+        return None, min(self.min_size, len(data) - offset)
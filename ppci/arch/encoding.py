@@ -1,9 +1,18 @@
-"""This module deals with encoding and decoding of instructions"""
+"""This module deals with encoding and decoding of instructions
+
+Most instructions are encoded by setting the fields of their tokens
+according to their patterns. Because the tokens and patterns of an
+instruction class are fixed, an encode method is generated for each such
+class when it is first used. The generated method shifts the values of the
+fields directly into integers, and packs those with a precompiled struct.
+"""
 
 import abc
+import struct
 
+from .arch_info import Endianness
 from .registers import Register
-from .token import TokenSequence
+from .token import Token, TokenSequence
 
 
 class Operand(property):
@@ -276,6 +285,13 @@ class InsMeta(type):
         if hasattr(cls, "isa"):
             cls.isa.add_instruction(cls)
 
+        # Instructions which are encoded with their patterns get an encode
+        # method which is generated for the class when it is first used:
+        if "encode" not in attrs and getattr(
+            cls.encode, "encodes_patterns", False
+        ):
+            cls.encode = lazy_encoder(cls)
+
     def __add__(cls, other):
         assert isinstance(other, InsMeta)
         tokens = cls.tokens + other.tokens
@@ -295,6 +311,306 @@ class InsMeta(type):
         return InsMeta(name, (Instruction,), members)
 
 
+def pattern_encoder(function):
+    """Mark a function as an encode method which uses the patterns"""
+    function.encodes_patterns = True
+    return function
+
+
+def lazy_encoder(cls):
+    """Create an encode method for an instruction class, which replaces
+    itself by a method generated for the class.
+    """
+
+    @pattern_encoder
+    def encode(self):
+        encoder = make_encoder(cls)
+        cls.encode = encoder
+        return encoder(self)
+
+    return encode
+
+
+def make_encoder(cls):
+    """Create an encode method for an instruction class.
+
+    Instructions with constructors as operands are encoded by a method
+    generated for the types of the constructors. The generic encode method
+    is used for instructions which cannot be encoded by a generated method.
+    """
+    if not uses_generic_encoding(cls, Instruction):
+        return Instruction.encode
+
+    if cls.syntax:
+        props = [p for p in cls.syntax.formal_arguments if p.is_constructor]
+    else:
+        props = []
+
+    if not props:
+        return generate_encoder([("self", cls)]) or Instruction.encode
+
+    # Select the encoder for the types of the constructors:
+    encoders = {}
+
+    def specialize(key):
+        shape = [("self", cls)]
+        for prop, constructor in zip(props, key):
+            shape.append((f"self._{prop._name}", constructor))
+        encoder = None
+        if all(
+            uses_generic_encoding(constructor, Constructor)
+            and not (
+                constructor.syntax
+                and any(
+                    p.is_constructor
+                    for p in constructor.syntax.formal_arguments
+                )
+            )
+            for constructor in key
+        ):
+            encoder = generate_encoder(shape)
+        encoder = encoder or Instruction.encode
+        encoders[key] = encoder
+        return encoder
+
+    types = ", ".join(f"type(self._{prop._name})" for prop in props)
+    source = f"""def encode_{cls.__name__}(self):
+    if self.__class__ is not cls:
+        return generic_encode(self)
+    key = ({types},)
+    encoder = encoders.get(key)
+    if encoder is None:
+        encoder = specialize(key)
+    return encoder(self)
+"""
+    namespace = {"encoders": encoders, "specialize": specialize}
+    return pattern_encoder(compile_function(source, cls, namespace))
+
+
+def uses_generic_encoding(cls, base):
+    """Test if the given class uses the default methods to fill its
+    tokens.
+    """
+    methods = [
+        "dict_to_patterns",
+        "set_patterns",
+        "set_user_patterns",
+        "properties",
+        "non_leaves",
+    ]
+    if base is Instruction:
+        methods.extend(["get_tokens", "set_all_patterns"])
+    return all(getattr(cls, m) is getattr(base, m) for m in methods)
+
+
+def is_plain_token(token_cls):
+    """Test if the fields of a token class are set in the default way"""
+    return (
+        issubclass(token_cls, Token)
+        and token_cls.__init__ is Token.__init__
+        and token_cls.__setitem__ is Token.__setitem__
+        and token_cls.encode is Token.encode
+        and token_cls.pack.__func__ is Token.pack.__func__
+        and token_cls.Info.size is not None
+        and token_cls.Info.size % 8 == 0
+    )
+
+
+def fit_field(value, bits):
+    """Wrap a negative value around to the given amount of bits, in the
+    same way as the tokens do.
+    """
+    limit = 1 << bits
+    if value >= limit:
+        raise ValueError(f"value {value} cannot be fit into {bits} bits")
+    if value < 0:
+        value = limit + value
+    assert (value >= 0) and (value < limit)
+    return value
+
+
+struct_codes = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
+
+def get_token_classes(constructors):
+    """Get the token classes of the given parts of an instruction, in the
+    order in which they are encoded.
+
+    Returns None when one of the tokens is not a plain token.
+    """
+    tokens = []
+    precodes = []
+    for constructor in constructors:
+        for token_cls in getattr(constructor, "tokens", ()):
+            if not is_plain_token(token_cls):
+                return None
+            if token_cls.Info.precode:
+                precodes.append(token_cls)
+            else:
+                tokens.append(token_cls)
+    return precodes + tokens
+
+
+def find_field(tokens, name):
+    """Find the first token class with the given field, like a token
+    sequence does.
+
+    Returns the index of the token and the field, or None when the field
+    does not store its value in known bit ranges of the token.
+    """
+    # Fields are looked up on the token objects:
+    if name in ("bit_value", "mask"):
+        return None
+    for token_cls in tokens:
+        if hasattr(token_cls, name):
+            break
+    else:
+        return None
+    field = getattr(token_cls, name)
+    pieces = getattr(field, "_pieces", None)
+    if pieces is None:
+        return None
+    if any(e > token_cls.Info.size for _, e, _ in pieces):
+        return None
+    return tokens.index(token_cls), field
+
+
+def generate_encoder(shape):
+    """Generate an encode method for an instruction, given the expressions
+    and classes of its constructors.
+
+    The generated method is equivalent to filling the tokens of the
+    instruction with the values of its patterns. Returns None when the
+    instruction cannot be encoded in this way.
+    """
+    tokens = get_token_classes([constructor for _, constructor in shape])
+    if tokens is None:
+        return None
+
+    # Determine the pieces of the tokens which are written by each pattern:
+    namespace = {"fit_field": fit_field}
+    writes = []
+    for expr, constructor in shape:
+        for pattern in constructor.dict_to_patterns(constructor.patterns):
+            location = find_field(tokens, pattern.field)
+            if location is None:
+                return None
+            index, field = location
+
+            if type(pattern) is FixedPattern:
+                value = pattern.value
+                if not isinstance(value, int):
+                    return None
+                if not field._wraps:
+                    bits = field._bitsize
+                    if not -(1 << bits) <= value < (1 << bits):
+                        return None
+                    value %= 1 << bits
+            elif type(pattern) is VariablePattern:
+                value = value_expression(pattern.prop, expr, namespace)
+            else:
+                return None
+            writes.append((index, field, value))
+
+    # The fields of a token can be or-ed together when the fields do not
+    # overlap. Otherwise, each field is cleared before it is set:
+    masks = [[] for _ in tokens]
+    for index, field, _ in writes:
+        for b, e, _ in field._pieces:
+            masks[index].append(((1 << (e - b)) - 1) << b)
+    disjoint = []
+    for token_masks in masks:
+        combined = 0
+        for mask in token_masks:
+            if combined & mask:
+                disjoint.append(False)
+                break
+            combined |= mask
+        else:
+            disjoint.append(True)
+
+    words = [0] * len(tokens)
+    lines = []
+    for index, field, value in writes:
+        word = f"w{index}"
+        if isinstance(value, int):
+            if disjoint[index]:
+                for b, e, s in field._pieces:
+                    words[index] |= ((value >> s) & ((1 << (e - b)) - 1)) << b
+                continue
+            value = f"{value}"
+        else:
+            lines.append(f"v = {value}")
+            value = "v"
+            if not field._wraps:
+                bits = field._bitsize
+                lines.append(f"if not 0 <= v < {1 << bits}:")
+                lines.append(f"    v = fit_field(v, {bits})")
+
+        for b, e, s in field._pieces:
+            if field._wraps:
+                part = f"(({value} >> {s}) & {(1 << (e - b)) - 1:#x}) << {b}"
+            else:
+                part = f"{value} << {b}"
+            if disjoint[index]:
+                lines.append(f"{word} |= {part}")
+            else:
+                mask = (1 << tokens[index].Info.size) - 1
+                mask ^= ((1 << (e - b)) - 1) << b
+                lines.append(f"{word} = ({word} & {mask:#x}) | ({part})")
+
+    # Pack the tokens with a single struct when possible:
+    byteorders = [
+        "little" if token_cls.Info.endianness == Endianness.LITTLE else "big"
+        for token_cls in tokens
+    ]
+    sizes = [token_cls.Info.size // 8 for token_cls in tokens]
+    if len(set(byteorders)) <= 1 and all(s in struct_codes for s in sizes):
+        order = ">" if "big" in byteorders else "<"
+        codes = "".join(struct_codes[size] for size in sizes)
+        namespace["pack"] = struct.Struct(order + codes).pack
+        names = ", ".join(f"w{index}" for index in range(len(tokens)))
+        result = f"pack({names})"
+    else:
+        result = " + ".join(
+            f"w{index}.to_bytes({size}, {byteorder!r})"
+            for index, (size, byteorder) in enumerate(zip(sizes, byteorders))
+        )
+
+    # Subclasses with other patterns can call this method with super:
+    cls = shape[0][1]
+    body = ["if self.__class__ is not cls:", "    return generic_encode(self)"]
+    body.extend(f"w{index} = {word:#x}" for index, word in enumerate(words))
+    body.extend(lines)
+    body.append(f"return {result}")
+    source = f"def encode_{cls.__name__}(self):\n" + "".join(
+        f"    {line}\n" for line in body
+    )
+    return pattern_encoder(compile_function(source, cls, namespace))
+
+
+def value_expression(prop, expr, namespace):
+    """Get an expression for the numeric value of a property"""
+    if isinstance(prop, Operand) and not prop._value_map:
+        if prop._cls is int:
+            return f"{expr}._{prop._name}"
+        if isinstance(prop._cls, type) and issubclass(prop._cls, Register):
+            return f"{expr}._{prop._name}.num"
+    name = f"prop{len(namespace)}"
+    namespace[name] = prop
+    return f"{name}.get_value({expr})"
+
+
+def compile_function(source, cls, namespace):
+    """Compile the source of an encode method, and return the method"""
+    namespace["cls"] = cls
+    namespace["generic_encode"] = Instruction.encode
+    code = compile(source, f"<encoder of {cls.__qualname__}>", "exec")
+    exec(code, namespace)
+    (name,) = [n for n in namespace if n.startswith("encode_")]
+    return namespace[name]
+
+
 class Instruction(Constructor, metaclass=InsMeta):
     """Base instruction class.
 
@@ -385,6 +701,12 @@ class Instruction(Constructor, metaclass=InsMeta):
                 if p.__get__(o) is old:
                     p.__set__(o, new)
 
+    def replace_label(self, old, new):
+        """Replace a reference to a label with another label"""
+        for p, o in self.leaves:
+            if p._cls is str and p.__get__(o) == old:
+                p.__set__(o, new)
+
     def get_tokens(self):
         precodes = []
         tokens = []
@@ -414,6 +736,7 @@ class Instruction(Constructor, metaclass=InsMeta):
         return positions
 
     # Interface methods:
+    @pattern_encoder
     def encode(self):
         """Encode the instruction into binary form.
 
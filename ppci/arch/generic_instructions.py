@@ -53,6 +53,46 @@ class RelocationHolder(Instruction):
         return bytes()
 
 
+class EncodedInstruction(Instruction):
+    """An instruction which was encoded already.
+
+    This instruction carries the binary encoding, the textual
+    representation, symbols and relocations of some other instruction.
+    It can be send across process boundaries, and emitting it into an
+    output stream has the same effect as emitting the original
+    instruction.
+    """
+
+    def __init__(self, text, data, relocations=(), symbols=()):
+        super().__init__()
+        self.text = text
+        self.data = data
+        self._relocations = list(relocations)
+        self._symbols = list(symbols)
+
+    @classmethod
+    def from_instruction(cls, instruction):
+        """Create an encoded copy of the given instruction."""
+        return cls(
+            str(instruction),
+            instruction.encode(),
+            relocations=instruction.relocations(),
+            symbols=instruction.symbols(),
+        )
+
+    def __repr__(self):
+        return self.text
+
+    def relocations(self):
+        return list(self._relocations)
+
+    def symbols(self):
+        return list(self._symbols)
+
+    def encode(self):
+        return self.data
+
+
 class Nop(Instruction):
     """Instruction that does nothing and has zero size"""
 
@@ -6,6 +6,7 @@ These can be used to define an instruction set.
 from collections import namedtuple
 
 from ..utils.tree import Tree, from_string
+from .decoding import Decoder
 from .encoding import Relocation
 
 Pattern = namedtuple(
@@ -31,6 +32,11 @@ class Isa:
         self.patterns = []
         self.peepholes = []
 
+        # Cycles after which the result of an instruction can be used:
+        self.latencies = {}
+
+        self._decoder = None
+
     def __add__(self, other):
         assert isinstance(other, Isa)
         isa3 = Isa()
@@ -38,13 +44,25 @@ class Isa:
         isa3.patterns = self.patterns + other.patterns
         isa3.relocation_map = self.relocation_map.copy()
         isa3.relocation_map.update(other.relocation_map)
+        isa3.latencies = self.latencies.copy()
+        isa3.latencies.update(other.latencies)
         return isa3
 
     def add_instruction(self, instruction):
         """Register an instruction into this ISA"""
         self.instructions.append(instruction)
+        self._decoder = None
         return instruction
 
+    def get_decoder(self):
+        """Get the decoder for the instructions of this isa.
+
+        The decode tables are created when they are first used.
+        """
+        if self._decoder is None:
+            self._decoder = Decoder(self.instructions)
+        return self._decoder
+
     def register_relocation(self, relocation):
         """Register a relocation into this isa"""
         assert issubclass(relocation, Relocation)
@@ -56,6 +74,19 @@ class Isa:
         """Add a pattern to this isa"""
         self.patterns.append(pattern)
 
+    def set_latency(self, cycles, *instructions):
+        """Set the result latency of the given instructions.
+
+        Instructions without a latency produce their result in the next
+        cycle. The latencies are used by the instruction scheduler.
+        """
+        for instruction in instructions:
+            self.latencies[instruction] = cycles
+
+    def get_latency(self, instruction):
+        """Get the result latency of an instruction"""
+        return self.latencies.get(type(instruction), 1)
+
     def peephole(self, function):
         """Add a peephole optimization function"""
         self.peepholes.append(function)
@@ -280,6 +280,13 @@ Sbi = type_b("sbi", 0x3C, rd_write=False)
 Shi = type_b("shi", 0x3D, rd_write=False)
 Swi = type_b("swi", 0x3E, rd_write=False)
 
+# Result latencies of the five stage pipeline:
+isa.set_latency(2, Lbu, Lhu, Lw, Lbui, Lhui, Lwi)
+isa.set_latency(3, Mul, Mulh, Mulhu, Mulhsu, Muli)
+isa.set_latency(34, Idiv, Idivu)
+isa.set_latency(4, Fadd, Frsub, Fmul)
+isa.set_latency(28, Fdiv, Fsqrt)
+
 
 def label_imm():
     pass
@@ -333,6 +333,11 @@ Swa = store("swa", 0b110011)
 Xor = regregreg("xor", 0b111000, 0b0000101)
 Xori = regregimm("xori", 0b101011)
 
+# Result latencies of a simple in-order pipeline:
+orbis32.set_latency(2, Lbs, Lbz, Lhs, Lhz, Lwa, Lws, Lwz)
+orbis32.set_latency(3, Mul, Mulu)
+orbis32.set_latency(34, Div, Divu)
+
 
 # Helpers:
 def mov(dst, src):
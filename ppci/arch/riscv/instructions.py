@@ -680,6 +680,11 @@ Divu = make_mext("divu", 0b101)
 Rem = make_mext("rem", 0b110)
 Remu = make_mext("remu", 0b111)
 
+# Result latencies of a simple in-order pipeline:
+isa.set_latency(2, Lb, Lh, Lw, Lbu, Lhu)
+isa.set_latency(3, Mul)
+isa.set_latency(34, Div, Divu, Rem, Remu)
+
 # Instruction selection patterns:
 
 
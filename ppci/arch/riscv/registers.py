@@ -7,6 +7,10 @@ from ..registers import Register, RegisterClass
 class RiscvRegister(Register):
     bitsize = 32
 
+    @classmethod
+    def from_num(cls, num):
+        return num2regmap[num]
+
     def __repr__(self):
         if self.is_colored:
             return get_register(self.color).name
@@ -22,6 +26,10 @@ class RiscvProgramCounterRegister(Register):
 class RiscvFRegister(Register):
     bitsize = 32
 
+    @classmethod
+    def from_num(cls, num):
+        return num2fregmap[num]
+
 
 class RiscvCsrRegister(Register):
     bitsize = 32
@@ -187,6 +195,7 @@ fregisters = [
 
 RiscvFRegister.registers = fregisters
 num2regmap = {r.num: r for r in registers}
+num2fregmap = {r.num: r for r in fregisters}
 
 gdb_registers = registers + [PC]
 RiscvCsrRegister.registers = [MSTATUS, MIE, MTVEC, MEPC, MCAUSE, MHARTID, FRM]
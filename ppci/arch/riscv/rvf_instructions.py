@@ -190,6 +190,11 @@ class FSw(RiscvInstruction):
     }
 
 
+rvfisa.set_latency(2, FLw)
+rvfisa.set_latency(4, FAdd, FSub, FMul)
+rvfisa.set_latency(20, FDiv)
+
+
 def make_fcmp(mnemonic, func3, invert):
     """Factory function for immediate value instructions"""
     rd = Operand("rd", RiscvRegister, write=True)
@@ -56,6 +56,9 @@ FMul = make_fregfregfreg("fmul", 0b111, 0b0001000)
 FDiv = make_fregfregfreg("fdiv", 0b111, 0b0001100)
 FSgnjn = make_fregfregfreg("fsgnjn", 0b001, 0b0010000)
 
+rvfxisa.set_latency(4, FAdd, FSub, FMul)
+rvfxisa.set_latency(20, FDiv)
+
 
 def negf(dst, src):
     """Move src into dst register"""
@@ -32,12 +32,21 @@ def u8(x):
 
 
 class _p2(property):
-    def __init__(self, getter, setter, bitsize, signed):
+    def __init__(
+        self, getter, setter, bitsize, signed, pieces=None, wraps=False
+    ):
         if bitsize < 1:
             raise TypeError("Cannot create field with less than 1 bit")
         self._bitsize = bitsize
         self._signed = signed
         self._mask = (1 << bitsize) - 1
+
+        # The bit ranges in which the value of the field is stored, as
+        # tuples of the first bit, the end bit and the shift of the value.
+        # Values which do not fit are wrapped around when wraps is set, and
+        # are an error otherwise.
+        self._pieces = pieces
+        self._wraps = wraps
         super().__init__(getter, setter)
 
     def __add__(self, other):
@@ -53,7 +62,7 @@ def bit_range(b, e, signed=False):
     def setter(s, v):
         s[b:e] = v
 
-    return _p2(getter, setter, e - b, signed)
+    return _p2(getter, setter, e - b, signed, pieces=((b, e, 0),))
 
 
 def bit(b):
@@ -78,7 +87,16 @@ def bit_concat(*partials):
 
     bitsize = sum(at._bitsize for at in partials)
     signed = partials[0]._signed
-    return _p2(getter, setter, bitsize, signed)
+
+    pieces = []
+    shift = 0
+    for at in reversed(partials):
+        if at._pieces is None:
+            pieces = None
+            break
+        pieces.extend((b, e, shift + s) for b, e, s in at._pieces)
+        shift += at._bitsize
+    return _p2(getter, setter, bitsize, signed, pieces=pieces, wraps=True)
 
 
 class TokenMeta(type):
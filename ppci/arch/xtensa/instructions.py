@@ -638,6 +638,10 @@ class L32r(XtensaCoreInstruction):
         return [Ri16Relocation(self.label)]
 
 
+# Result latencies of the five stage pipeline:
+core_isa.set_latency(2, L8ui, L16si, L16ui, L32i, L32in, L32r)
+
+
 class Mov(XtensaMacroInstruction):
     """Move (actually a macro)"""
 
@@ -1097,6 +1101,23 @@ def pattern_fprel(context, tree):
     return d
 
 
+@core_isa.pattern(
+    "reg",
+    "FPRELU32",
+    size=6,
+    cycles=2,
+    energy=2,
+    condition=lambda t: t.value.offset in range(-2048, 2048),
+)
+def pattern_fprel_large(context, tree):
+    offset = context.new_reg(AddressRegister)
+    context.emit(Movi(offset, tree.value.offset))
+    d = context.new_reg(AddressRegister)
+    fp = a15
+    context.emit(Add(d, fp, offset))
+    return d
+
+
 @core_isa.pattern("reg", "SUBI32(reg,reg)", size=3, cycles=1, energy=1)
 @core_isa.pattern("reg", "SUBU32(reg,reg)", size=3, cycles=1, energy=1)
 def pattern_sub_i32(context, tree, c0, c1):
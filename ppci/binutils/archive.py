@@ -1,8 +1,19 @@
-"""Grouping of multiple object files into a single archive."""
+"""Grouping of multiple object files into a single archive.
 
+Archives are saved in a binary format, which starts with a table of the
+offset and size of each member, followed by an index of the global
+symbols defined by the members. The members are object files in the
+binary object file format, which are only loaded when they are used.
+Archives saved to a text file are stored as json, which can be loaded as
+well. The symbol index of archives without one is built when it is used.
+"""
+
+import io
 import json
 import logging
+import struct
 
+from ..common import get_file
 from . import objectfile
 
 
@@ -16,36 +27,175 @@ def get_archive(filename):
     if isinstance(filename, Archive):
         return filename
 
-    return Archive.load(filename)
+    f = get_file(filename, "rb")
+    lib = Archive.load(f)
+    f.close()
+    return lib
+
+
+ARCHIVE_MAGIC = b"\x7fPPCIARC"
+ARCHIVE_VERSION = 2
+
+archive_header = struct.Struct("<8sII")  # magic, version, number of members
+member_record = struct.Struct("<QQ")  # offset, size
+# The symbol index consists of the symbol names, separated by zero bytes,
+# followed by the index of the defining member of each symbol:
+index_header = struct.Struct("<II")  # names size, number of symbols
+
+
+def is_binary_archive(data):
+    """Test if the data is an archive in the binary format"""
+    return data[: len(ARCHIVE_MAGIC)] == ARCHIVE_MAGIC
 
 
 class Archive:
-    """The archive. Holder of object files. Similar to GNU ar."""
+    """The archive. Holder of object files. Similar to GNU ar.
+
+    The members of a loaded archive are kept as binary data until they
+    are used.
+    """
 
     logger = logging.getLogger("ar")
 
-    def __init__(self, objs):
-        self.objs = objs
+    def __init__(self, objs, symbol_index=None):
+        self._members = list(objs)
+        self._symbol_index = symbol_index
 
     def __iter__(self):
-        return iter(self.objs)
+        for index in range(len(self._members)):
+            yield self.get_member(index)
+
+    @property
+    def objs(self):
+        """All object files in this archive"""
+        return list(self)
+
+    @property
+    def symbol_index(self):
+        """A mapping from the names of the global symbols defined in this
+        archive to the index of the member which defines them.
+
+        When several members define a symbol, the first one is used.
+        """
+        if self._symbol_index is None:
+            self.logger.debug("Building symbol index")
+            symbol_index = {}
+            for index, obj in enumerate(self):
+                for name in obj.get_defined_symbols():
+                    symbol_index.setdefault(name, index)
+            self._symbol_index = symbol_index
+        return self._symbol_index
+
+    def find_symbol(self, name):
+        """Get the object file which defines the given global symbol, or
+        None if it is not defined in this archive.
+        """
+        index = self.symbol_index.get(name)
+        if index is not None:
+            return self.get_member(index)
+
+    def get_member(self, index):
+        """Get the object file at the given index, loading it when needed"""
+        member = self._members[index]
+        if not isinstance(member, objectfile.ObjectFile):
+            self.logger.debug("Loading archive member %s", index)
+            member = objectfile.ObjectFile.from_bytes(member)
+            self._members[index] = member
+        return member
+
+    def to_bytes(self):
+        """Serialize this archive into the binary format."""
+        members = [
+            (
+                member.to_bytes()
+                if isinstance(member, objectfile.ObjectFile)
+                else member
+            )
+            for member in self._members
+        ]
+        names = "\0".join(self.symbol_index).encode("utf-8")
+        symbol_index = struct.pack(
+            f"<{len(self.symbol_index)}I", *self.symbol_index.values()
+        )
+        parts = [
+            archive_header.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, len(members))
+        ]
+        offset = (
+            archive_header.size
+            + len(members) * member_record.size
+            + index_header.size
+            + len(names)
+            + len(symbol_index)
+        )
+        for member in members:
+            parts.append(member_record.pack(offset, len(member)))
+            offset += len(member)
+        parts.append(index_header.pack(len(names), len(self.symbol_index)))
+        parts.append(names)
+        parts.append(symbol_index)
+        parts.extend(members)
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Create an archive from data in the binary format, without
+        loading the members.
+        """
+        data = memoryview(data)
+        magic, version, count = archive_header.unpack_from(data)
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError("Not a binary archive")
+        if version != ARCHIVE_VERSION:
+            raise ValueError(f"Unsupported archive version {version}")
+        members = []
+        for index in range(count):
+            offset, size = member_record.unpack_from(
+                data, archive_header.size + index * member_record.size
+            )
+            members.append(data[offset : offset + size])
+
+        offset = archive_header.size + count * member_record.size
+        names_size, n_symbols = index_header.unpack_from(data, offset)
+        offset += index_header.size
+        names = str(data[offset : offset + names_size], "utf-8")
+        names = names.split("\0") if n_symbols else []
+        offset += names_size
+        if len(names) != n_symbols:
+            raise ValueError("Corrupt archive symbol index")
+        indices = struct.unpack_from(f"<{n_symbols}I", data, offset)
+        return cls(members, dict(zip(names, indices)))
 
     def save(self, output_file):
-        """Save archive to file."""
+        """Save archive to file.
+
+        The archive is saved as json when the file is a text file, and in
+        the binary format otherwise.
+        """
         self.logger.debug("Saving archive")
-        # Create funky json.
-        objs = [obj.serialize() for obj in self.objs]
+        if isinstance(output_file, io.TextIOBase):
+            # Create funky json.
+            objs = [obj.serialize() for obj in self]
 
-        d = {"objects": objs}
+            d = {"objects": objs}
 
-        # Save to file:
-        json.dump(d, output_file, indent=2, sort_keys=True)
-        print(file=output_file)
+            # Save to file:
+            json.dump(d, output_file, indent=2, sort_keys=True)
+            print(file=output_file)
+        else:
+            output_file.write(self.to_bytes())
 
     @classmethod
     def load(cls, f):
-        """Load archive from disk."""
+        """Load archive from disk, in either the json or the binary
+        format.
+        """
         cls.logger.debug("Loading archive")
-        d = json.load(f)
+        if isinstance(f, io.TextIOBase):
+            d = json.load(f)
+        else:
+            data = f.read()
+            if is_binary_archive(data):
+                return cls.from_bytes(data)
+            d = json.loads(data)
         objs = list(map(objectfile.deserialize, d["objects"]))
         return cls(objs)
@@ -4,32 +4,36 @@ from ..arch.data_instructions import DByte
 
 
 class Disassembler:
-    """Base disassembler for some architecture"""
+    """Base disassembler for some architecture.
+
+    Instructions are decoded with the decode tables of the instruction
+    set of the architecture. Data which is not a known instruction is
+    emitted as bytes.
+    """
 
     def __init__(self, arch):
         self.arch = arch
 
     def disasm(self, data, outs, address=0):
         """Disassemble data into an instruction stream"""
-        # TODO: implement this!
-
-        # The trial and error method, will be slow as a snail:
-        # for instruction in self.arch.isa.instructions:
-        #    for size in instruction.sizes():
-        #        part = data[:size]
-        #        try:
-        #            print(instruction, part, size)
-        #            i = instruction.decode(part)
-        #            print(i)
-        #        except ValueError:
-        #            pass
-
-        # For now, all is bytes!
-        for byte in data:
-            ins = DByte(byte)
-            ins.address = address
-            outs.emit(ins)
-            address += len(ins.encode())
+        decoder = self.arch.isa.get_decoder()
+        data = memoryview(data)
+        offset = 0
+        while offset < len(data):
+            instruction, size = decoder.match(data, offset)
+            if instruction is None:
+                # Emit the bytes of the smallest instruction as data:
+                for byte in data[offset : offset + size]:
+                    self.emit(outs, DByte(byte), address + offset)
+                    offset += 1
+            else:
+                self.emit(outs, instruction, address + offset)
+                offset += size
+
+    @staticmethod
+    def emit(outs, instruction, address):
+        instruction.address = address
+        outs.emit(instruction)
 
     def take_one(self):
         pass
@@ -1,7 +1,9 @@
 """Linker utility."""
 
 import logging
-from collections import defaultdict
+from bisect import bisect_left
+from collections import defaultdict, deque
+from itertools import accumulate
 
 from ..common import CompilerError
 from .archive import get_archive
@@ -384,30 +386,31 @@ class Linker:
         """Try to fetch extra code from libraries to resolve symbols.
 
         Note that this can be a rabbit hole, since libraries can have undefined
-        symbols as well.
+        symbols as well. The undefined symbols are kept in a worklist, and
+        are looked up in the symbol index of the libraries. Object files
+        which are not used are not loaded from the libraries.
         """
-        undefined_symbols = self.get_undefined_symbols()
-        if not undefined_symbols:
+        worklist = deque(self.get_undefined_symbols())
+        if not worklist:
             self.logger.debug(
                 "No undefined symbols, no need to check libraries"
             )
             return
 
-        # Keep adding objects while we have undefined symbols.
-        reloop = True
-        while reloop:
-            reloop = False
+        while worklist:
+            name = worklist.popleft()
+            if self.dst.get_symbol(name).defined:
+                continue
+
             for library in libraries:
-                self.logger.debug("scanning library for symbols %s", library)
-                for obj in library:
-                    has_sym = any(map(obj.has_symbol, undefined_symbols))
-                    if has_sym:
-                        self.logger.debug(
-                            "Using object file %s from library", obj
-                        )
-                        self.inject_object(obj, False)
-                        undefined_symbols = self.get_undefined_symbols()
-                        reloop = True
+                obj = library.find_symbol(name)
+                if obj is not None:
+                    self.logger.debug(
+                        "Using object file %s from library for %s", obj, name
+                    )
+                    self.inject_object(obj, False)
+                    worklist.extend(obj.get_undefined_symbols())
+                    break
 
     def get_undefined_symbols(self):
         """Get a list of currently undefined symbols."""
@@ -449,6 +452,22 @@ class Linker:
 
         self.logger.debug("Doing linker relaxations")
 
+        # Shrinking code brings more jumps within range, so repeat until
+        # nothing can be relaxed anymore:
+        rounds = 0
+        while self.relax():
+            rounds += 1
+
+        if rounds:
+            self.logger.debug("Relaxed code in %s rounds", rounds)
+        else:
+            self.logger.debug("No linker relaxations found")
+
+    def relax(self):
+        """Shrink all relocations which can shrink at once.
+
+        Returns whether any relocation was shrunk.
+        """
         # TODO: general note. Alignment must still be taken into account.
         # A wrong situation occurs, when reducing the image by small amount
         # of bytes. Locations that were aligned before, might become unaligned.
@@ -492,8 +511,7 @@ class Linker:
                 lst.append((hole, relocation, reloc, new_relocs))
 
         if not lst:
-            self.logger.debug("No linker relaxations found")
-            return
+            return False
 
         s = ", ".join(str(x) for x in lst)
         self.logger.debug("Relaxable relocations: %s", s)
@@ -501,12 +519,13 @@ class Linker:
         # Define a map with the byte holes:
         holes_map = defaultdict(list)  # section name to list of holes.
 
-        # Remove old relocations by new ones.
+        # Replace old relocations by new ones.
+        superseded = set()
+        new_relocations = []
         for hole, relocation, _, new_relocs in lst:
-            # Remove old relocation which is superceeded:
-            self.dst.relocations.remove(relocation)
+            # Old relocations which are superseded are removed below:
+            superseded.add(id(relocation))
 
-            # Inject new relocations:
             for new_reloc in new_relocs:
                 # TODO: maybe deal with somewhat shifted new relocations?
 
@@ -518,12 +537,20 @@ class Linker:
                     relocation.offset,
                     relocation.addend,
                 )
-                self.dst.add_relocation(new_relocation)
+                new_relocations.append(new_relocation)
 
             # Register hole:
             assert relocation.section
             holes_map[relocation.section].append(hole)
 
+        self.dst.relocations = [
+            relocation
+            for relocation in self.dst.relocations
+            if id(relocation) not in superseded
+        ]
+        for new_relocation in new_relocations:
+            self.dst.add_relocation(new_relocation)
+
         for holes in holes_map.values():
             holes.sort(key=lambda x: x[0])
 
@@ -535,6 +562,7 @@ class Linker:
         # Code has been patched here. Now update all relocations, symbols and
         # section addresses.
         self._apply_relaxation_holes(holes_map)
+        return True
 
     def _apply_relaxation_holes(self, hole_map):
         """Punch holes in the destination object file.
@@ -543,23 +571,26 @@ class Linker:
         and relocation offsets.
         """
 
-        def count_holes(offset, holes):
+        # Offsets of the holes per section, and the total size of the
+        # holes up to and including each hole:
+        hole_offsets = {}
+        hole_sizes = {}
+        for name, holes in hole_map.items():
+            hole_offsets[name] = [hole_offset for hole_offset, _ in holes]
+            hole_sizes[name] = list(accumulate(size for _, size in holes))
+
+        def count_holes(offset, section):
             """Count how much holes we have until the given offset."""
-            diff = 0
-            for hole_offset, hole_size in holes:
-                if hole_offset < offset:
-                    diff += hole_size
-                else:
-                    break
-            return diff
+            index = bisect_left(hole_offsets[section], offset)
+            return hole_sizes[section][index - 1] if index else 0
 
         # Update symbols which are located in sections.
         for symbol in self.dst.symbols:
-            # Ignore global section-less symbols.
-            if symbol.section is None:
+            # Ignore global section-less symbols, and symbols in sections
+            # without holes.
+            if symbol.section not in hole_map:
                 continue
-            holes = hole_map[symbol.section]
-            delta = count_holes(symbol.value, holes)
+            delta = count_holes(symbol.value, symbol.section)
             self.logger.debug(
                 "symbol changing %s (id=%s) at %08x with -%08x",
                 symbol.name,
@@ -572,8 +603,9 @@ class Linker:
         # Update relocations (which are always located in a section)
         for relocation in self.dst.relocations:
             assert relocation.section
-            holes = hole_map[relocation.section]
-            delta = count_holes(relocation.offset, holes)
+            if relocation.section not in hole_map:
+                continue
+            delta = count_holes(relocation.offset, relocation.section)
             self.logger.debug(
                 "relocation changing %s at offset %08x with -%08x",
                 relocation.symbol_id,
@@ -582,18 +614,21 @@ class Linker:
             )
             relocation.offset -= delta
 
-        # Update section data:
+        # Update section data, by copying the data between the holes:
         for section in self.dst.sections:
-            # Loop over holes in reverse, since earlier holes influence later
-            # holes.
-            holes = hole_map[section.name]
-            for hole_offset, hole_size in reversed(holes):
-                for _ in range(hole_size):
-                    section.data.pop(hole_offset)
+            if section.name not in hole_map:
+                continue
+            parts = []
+            begin = 0
+            for hole_offset, hole_size in hole_map[section.name]:
+                parts.append(section.data[begin:hole_offset])
+                begin = hole_offset + hole_size
+            parts.append(section.data[begin:])
+            section.data = bytearray().join(parts)
 
         # Calculate total change per section
         section_changes = {
-            name: sum(h[1] for h in holes) for name, holes in hole_map.items()
+            name: sizes[-1] for name, sizes in hole_sizes.items()
         }
 
         # Update layout of section in images
@@ -601,7 +636,7 @@ class Linker:
             delta = 0
             for section in image.sections:
                 self.logger.debug(
-                    "sectororchanging %s at %08x with -%08x to %08x",
+                    "section changing %s at %08x with -%08x",
                     section.name,
                     section.address,
                     delta,
@@ -610,7 +645,7 @@ class Linker:
                 # requirements of sections.
                 # Idea: re-do the layout phase?
                 section.address -= delta
-                delta += section_changes[section.name]
+                delta += section_changes.get(section.name, 0)
 
     def do_relocations(self):
         """Perform the correct relocation as listed"""
@@ -14,9 +14,14 @@ The hierarchy is as follows:
 - debug data have an offset into a section and contain data.
 - sections cannot overlap
 
+Object files are saved in a compact binary format, or in the older json
+format when they are saved to a text file. Both formats can be loaded.
+
 """
 
+import io
 import json
+import struct
 
 from ..common import CompilerError, get_file, make_num
 from ..utils.binary_txt import asc2bin, bin2asc
@@ -26,7 +31,7 @@ from . import debuginfo
 def get_object(obj):
     """Try hard to load an object"""
     if not isinstance(obj, ObjectFile):
-        f = get_file(obj)
+        f = get_file(obj, "rb")
         obj = ObjectFile.load(f)
         f.close()
     return obj
@@ -228,13 +233,28 @@ class ObjectFile:
         self.relocations = []
         self.images = []
         self.image_map = {}
-        self.debug_info = None
+        self._debug_info = None
+        self._debug_data = None  # Debug information as binary json
         self.arch = arch
         self.entry_symbol_id = None  # object file entry point
 
     def __repr__(self):
         return f"CodeObject of {self.byte_size} bytes"
 
+    @property
+    def debug_info(self):
+        """The debug information, which is decoded when it is used."""
+        if self._debug_data is not None:
+            debug = json.loads(str(self._debug_data, "utf-8"))
+            self._debug_info = debuginfo.deserialize(debug)
+            self._debug_data = None
+        return self._debug_info
+
+    @debug_info.setter
+    def debug_info(self, debug_info):
+        self._debug_info = debug_info
+        self._debug_data = None
+
     @property
     def is_executable(self):
         """Test if this object file is executable by checking the
@@ -362,15 +382,38 @@ class ObjectFile:
         """Serialize the object into a dictionary structure for json."""
         return serialize(self)
 
+    def to_bytes(self):
+        """Serialize the object into the binary object file format."""
+        return binary_serialize(self)
+
+    @staticmethod
+    def from_bytes(data):
+        """Create an object file from data in the binary format."""
+        return binary_deserialize(data)
+
     def save(self, output_file):
-        """Save object file to a file like object"""
-        json.dump(self.serialize(), output_file, indent=2, sort_keys=True)
-        print(file=output_file)
+        """Save object file to a file like object.
+
+        The object is saved as json when the file is a text file, and in
+        the binary format otherwise.
+        """
+        if isinstance(output_file, io.TextIOBase):
+            json.dump(self.serialize(), output_file, indent=2, sort_keys=True)
+            print(file=output_file)
+        else:
+            output_file.write(self.to_bytes())
 
     @staticmethod
     def load(input_file):
-        """Load object file from file"""
-        return deserialize(json.load(input_file))
+        """Load object file from file, in either the json or the binary
+        format.
+        """
+        if isinstance(input_file, io.TextIOBase):
+            return deserialize(json.load(input_file))
+        data = input_file.read()
+        if is_binary_object(data):
+            return binary_deserialize(data)
+        return deserialize(json.loads(data))
 
 
 def print_object(obj):
@@ -500,3 +543,239 @@ def deserialize(data):
     if "debug" in data:
         obj.debug_info = debuginfo.deserialize(data["debug"])
     return obj
+
+
+# The binary format starts with a magic number and a version, followed by
+# a table of all names, separated by zero bytes. Names are referred to by
+# their index in this table. Then follow the sections with their raw data,
+# and the symbols, relocations and images as records. The debug
+# information is stored as compact json at the end, which is only decoded
+# when it is used.
+OBJECT_MAGIC = b"\x7fPPCIOBJ"
+BINARY_VERSION = 1
+NO_NAME = 0xFFFFFFFF  # Name index of absent names
+
+binary_header = struct.Struct("<8sII")  # magic, version, names size
+# arch, entry symbol, has entry, number of sections, symbols, relocations,
+# images and size of the debug information:
+object_header = struct.Struct("<IqBIIIII")
+# name, address, alignment, data size:
+section_record = struct.Struct("<IQII")
+# id, name, binding, type, section, defined, value, size:
+symbol_record = struct.Struct("<qIIIIBqq")
+# type, symbol id, section, offset, addend:
+relocation_record = struct.Struct("<IqIqq")
+# name, address, number of sections:
+image_record = struct.Struct("<IQI")
+name_record = struct.Struct("<I")
+
+
+def is_binary_object(data):
+    """Test if the data is an object file in the binary format"""
+    return data[: len(OBJECT_MAGIC)] == OBJECT_MAGIC
+
+
+class NameTable:
+    """The names of an object file, each stored once"""
+
+    def __init__(self):
+        self.names = []
+        self.indices = {}
+
+    def add(self, name):
+        """Get the index of a name, adding it when it is new"""
+        if name is None:
+            return NO_NAME
+        index = self.indices.get(name)
+        if index is None:
+            index = len(self.names)
+            self.indices[name] = index
+            self.names.append(name)
+        return index
+
+    def to_bytes(self):
+        return "\0".join(self.names).encode("utf-8")
+
+
+def binary_serialize(obj):
+    """Serialize an object file into the binary format"""
+    names = NameTable()
+    name = names.add
+    parts = []
+    for section in obj.sections:
+        parts.append(
+            section_record.pack(
+                name(section.name),
+                section.address,
+                section.alignment,
+                len(section.data),
+            )
+        )
+        parts.append(section.data)
+
+    for symbol in obj.symbols:
+        parts.append(
+            symbol_record.pack(
+                symbol.id,
+                name(symbol.name),
+                name(symbol.binding),
+                name(symbol.typ),
+                name(symbol.section),
+                symbol.defined,
+                0 if symbol.undefined else symbol.value,
+                symbol.size,
+            )
+        )
+
+    for reloc in obj.relocations:
+        parts.append(
+            relocation_record.pack(
+                name(reloc.reloc_type),
+                reloc.symbol_id,
+                name(reloc.section),
+                reloc.offset,
+                reloc.addend,
+            )
+        )
+
+    for image in obj.images:
+        parts.append(
+            image_record.pack(
+                name(image.name), image.address, len(image.sections)
+            )
+        )
+        for section in image.sections:
+            parts.append(name_record.pack(name(section.name)))
+
+    if obj._debug_data is not None:
+        debug = obj._debug_data
+    elif obj.debug_info:
+        debug = json.dumps(
+            debuginfo.serialize(obj.debug_info), separators=(",", ":")
+        ).encode("utf-8")
+    else:
+        debug = b""
+    parts.append(debug)
+
+    header = object_header.pack(
+        name(obj.arch.make_id_str()),
+        obj.entry_symbol_id or 0,
+        obj.entry_symbol_id is not None,
+        len(obj.sections),
+        len(obj.symbols),
+        len(obj.relocations),
+        len(obj.images),
+        len(debug),
+    )
+    name_data = names.to_bytes()
+    return b"".join(
+        [
+            binary_header.pack(OBJECT_MAGIC, BINARY_VERSION, len(name_data)),
+            name_data,
+            header,
+        ]
+        + parts
+    )
+
+
+def binary_deserialize(data):
+    """Create an object file from data in the binary format"""
+    from ..api import get_arch
+
+    data = memoryview(data)
+    magic, version, names_size = binary_header.unpack_from(data)
+    if magic != OBJECT_MAGIC:
+        raise ValueError("Not a binary object file")
+    if version != BINARY_VERSION:
+        raise ValueError(f"Unsupported object file version {version}")
+    offset = binary_header.size
+    names = str(data[offset : offset + names_size], "utf-8").split("\0")
+    offset += names_size
+
+    def name(index):
+        return None if index == NO_NAME else names[index]
+
+    (
+        arch,
+        entry_symbol_id,
+        has_entry,
+        n_sections,
+        n_symbols,
+        n_relocations,
+        n_images,
+        debug_size,
+    ) = object_header.unpack_from(data, offset)
+    offset += object_header.size
+
+    obj = ObjectFile(get_arch(names[arch]))
+    if has_entry:
+        obj.entry_symbol_id = entry_symbol_id
+
+    for _ in range(n_sections):
+        section_name, address, alignment, size = section_record.unpack_from(
+            data, offset
+        )
+        offset += section_record.size
+        section = Section(names[section_name])
+        section.address = address
+        section.alignment = alignment
+        section.data = bytearray(data[offset : offset + size])
+        offset += size
+        obj.add_section(section)
+
+    end = offset + n_symbols * symbol_record.size
+    for (
+        symbol_id,
+        symbol_name,
+        binding,
+        typ,
+        section,
+        defined,
+        value,
+        size,
+    ) in symbol_record.iter_unpack(data[offset:end]):
+        obj.add_symbol(
+            symbol_id,
+            names[symbol_name],
+            names[binding],
+            value if defined else None,
+            name(section),
+            name(typ),
+            size,
+        )
+    offset = end
+
+    end = offset + n_relocations * relocation_record.size
+    for (
+        reloc_type,
+        symbol_id,
+        section,
+        reloc_offset,
+        addend,
+    ) in relocation_record.iter_unpack(data[offset:end]):
+        obj.add_relocation(
+            RelocationEntry(
+                names[reloc_type],
+                symbol_id,
+                names[section],
+                reloc_offset,
+                addend,
+            )
+        )
+    offset = end
+
+    for _ in range(n_images):
+        image_name, address, n_image_sections = image_record.unpack_from(
+            data, offset
+        )
+        offset += image_record.size
+        image = Image(names[image_name], address)
+        obj.add_image(image)
+        for _ in range(n_image_sections):
+            (section_name,) = name_record.unpack_from(data, offset)
+            offset += name_record.size
+            image.add_section(obj.get_section(names[section_name]))
+
+    if debug_size:
+        obj._debug_data = bytes(data[offset : offset + debug_size])
+    return obj
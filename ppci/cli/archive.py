@@ -18,16 +18,16 @@ parser = argparse.ArgumentParser(
 subparsers = parser.add_subparsers(dest="command", required=True)
 create_parser = subparsers.add_parser("create", help="create new archive")
 create_parser.add_argument(
-    "archive", type=argparse.FileType("w"), help="Archive filename."
+    "archive", type=argparse.FileType("wb"), help="Archive filename."
 )
 create_parser.add_argument(
-    "obj", type=argparse.FileType("r"), nargs="*", help="the object to link"
+    "obj", type=argparse.FileType("rb"), nargs="*", help="the object to link"
 )
 display_parser = subparsers.add_parser(
     "display", help="display contents of an archive."
 )
 display_parser.add_argument(
-    "archive", type=argparse.FileType("r"), help="Archive filename."
+    "archive", type=argparse.FileType("rb"), help="Archive filename."
 )
 
 
@@ -38,6 +38,19 @@ compile_parser.add_argument(
 compile_parser.add_argument(
     "-O", help="optimize code", default="0", choices=api.OPT_LEVELS
 )
+compile_parser.add_argument(
+    "--jobs",
+    "-j",
+    help="Amount of processes to use for code generation",
+    type=int,
+    default=None,
+)
+compile_parser.add_argument(
+    "--regalloc",
+    help="Register allocator to use",
+    choices=["coloring", "linear"],
+    default="coloring",
+)
 compile_parser.add_argument(
     "--instrument-functions",
     help="Instrument given functions",
@@ -69,7 +82,14 @@ def do_compile(ir_modules, march, reporter, args):
         with open(args.output, "w") as output:
             stream = TextOutputStream(printer=march.asm_printer, f=output)
             for ir_module in ir_modules:
-                api.ir_to_stream(ir_module, march, stream, reporter=reporter)
+                api.ir_to_stream(
+                    ir_module,
+                    march,
+                    stream,
+                    reporter=reporter,
+                    jobs=args.jobs,
+                    regalloc=args.regalloc,
+                )
     elif args.wasm:  # Output web-assembly code
         assert len(ir_modules) == 1
         ir_module = ir_modules[0]
@@ -81,9 +101,14 @@ def do_compile(ir_modules, march, reporter, args):
             api.ir_to_python(ir_modules, output, reporter=reporter)
     else:  # Full object output
         obj = api.ir_to_object(
-            ir_modules, march, reporter=reporter, debug=args.g
+            ir_modules,
+            march,
+            reporter=reporter,
+            debug=args.g,
+            jobs=args.jobs,
+            regalloc=args.regalloc,
         )
-        with open(args.output, "w") as output:
+        with open(args.output, "wb") as output:
             obj.save(output)
 
         # TODO: link objects together?
@@ -25,10 +25,13 @@ from ..arch.generic_instructions import (
 )
 from ..binutils.debuginfo import DebugDb, DebugLocation, DebugType
 from ..binutils.outstream import FunctionOutputStream, MasterOutputStream
-from ..irutils import Verifier, split_block
+from ..irutils import Verifier
 from .instructionscheduler import InstructionScheduler
 from .instructionselector import InstructionSelector1
 from .irdag import SelectionGraphBuilder
+from .linearscan import LinearScanRegisterAllocator
+from .literalpool import LiteralPoolPlacer
+from .parallel import can_generate_parallel, generate_functions
 from .peephole import PeepHoleStream
 from .registerallocator import GraphColoringRegisterAllocator
 
@@ -37,11 +40,21 @@ class CodeGenerator:
     """Machine code generator"""
 
     logger = logging.getLogger("codegen")
+    register_allocators = {
+        "coloring": GraphColoringRegisterAllocator,
+        "linear": LinearScanRegisterAllocator,
+    }
 
-    def __init__(self, arch, reporter, optimize_for="size"):
+    def __init__(
+        self, arch, reporter, optimize_for="size", regalloc="coloring"
+    ):
         assert isinstance(arch, Architecture), arch
+        if regalloc not in self.register_allocators:
+            raise ValueError(f"Unknown register allocator {regalloc}")
         self.arch = arch
         self.reporter = reporter
+        self.optimize_for = optimize_for
+        self.regalloc = regalloc
         self.verifier = Verifier()
         self.sgraph_builder = SelectionGraphBuilder(arch)
         weights_map = {
@@ -51,20 +64,40 @@ class CodeGenerator:
             "awesome": (13, 13, 13),
         }
         selection_weights = weights_map.get(optimize_for, (1, 1, 1))
+
+        # Schedule instructions for speed when the latencies are known:
+        if optimize_for == "speed" and arch.isa.latencies:
+            self.instruction_scheduler = InstructionScheduler(arch)
+        else:
+            self.instruction_scheduler = None
+
         self.instruction_selector = InstructionSelector1(
-            arch, self.sgraph_builder, reporter, weights=selection_weights
+            arch,
+            self.sgraph_builder,
+            reporter,
+            weights=selection_weights,
+            scheduler=self.instruction_scheduler,
         )
-        self.instruction_scheduler = InstructionScheduler()
-        self.register_allocator = GraphColoringRegisterAllocator(
+        self.register_allocator = self.register_allocators[regalloc](
             arch, self.instruction_selector, reporter
         )
 
-    def generate(self, ircode: ir.Module, output_stream, debug=False):
-        """Generate machine code from ir-code into output stream"""
+    def generate(
+        self, ircode: ir.Module, output_stream, debug=False, jobs=None
+    ):
+        """Generate machine code from ir-code into output stream
+
+        When jobs is larger than one, the functions are generated
+        in parallel by this amount of worker processes.
+        """
         assert isinstance(ircode, ir.Module)
-        if ircode.debug_db:
+        if ircode.debug_db and debug:
             self.debug_db = ircode.debug_db
         else:
+            # Without debug information, the mappings from selection
+            # nodes and instructions are not needed. Do not add them to
+            # the debug database of the module, since they keep the
+            # code of all functions alive:
             self.debug_db = DebugDb()
 
         self.logger.info(
@@ -87,8 +120,22 @@ class CodeGenerator:
         # Munch program into a bunch of frames. One frame per function.
         # Each frame has a flat list of abstract instructions.
         output_stream.select_section("code")
-        for function in ircode.functions:
-            self.generate_function(function, output_stream, debug=debug)
+        if (
+            jobs
+            and jobs > 1
+            and len(ircode.functions) > 1
+            and can_generate_parallel(
+                ircode, debug=debug, reporter=self.reporter
+            )
+        ):
+            self.logger.info("Generating functions using %s jobs", jobs)
+            generate_functions(self, ircode, output_stream, jobs)
+        else:
+            for function in ircode.functions:
+                self.generate_function(function, output_stream, debug=debug)
+
+        # Keep the instruction selection tables for a next run:
+        self.instruction_selector.save_tables()
 
         # Output debug type data:
         if debug:
@@ -151,19 +198,6 @@ class CodeGenerator:
         self.reporter.heading(3, f"Log for {ir_function}")
         self.reporter.dump_ir(ir_function)
 
-        # Split too large basic blocks in smaller chunks (for literal pools):
-        # TODO: fix arbitrary number of 500. This works for arm and thumb..
-        split_block_nr = 1
-        for block in ir_function:
-            max_block_len = 200
-            while len(block) > max_block_len:
-                self.logger.debug("%s too large, splitting up", str(block))
-                newname = f"{ir_function.name}_splitted_block_{split_block_nr}"
-                split_block_nr += 1
-                _, block = split_block(
-                    block, pos=max_block_len, newname=newname
-                )
-
         self._mark_global(output_stream, ir_function)
         output_stream.emit(SetSymbolType(ir_function.name, "func"))
 
@@ -190,9 +224,10 @@ class CodeGenerator:
 
         # Add label and return and stack adjustment:
         instruction_list = []
-        output_stream = MasterOutputStream(
-            [FunctionOutputStream(instruction_list.append), output_stream]
-        )
+        if self.reporter.collects_instructions:
+            output_stream = MasterOutputStream(
+                [FunctionOutputStream(instruction_list.append), output_stream]
+            )
         peep_hole_stream = PeepHoleStream(output_stream)
         self.emit_frame_to_stream(frame, peep_hole_stream, debug=debug)
         peep_hole_stream.flush()
@@ -207,24 +242,16 @@ class CodeGenerator:
             dd = DebugData(d)
             output_stream.emit(dd)
 
-        self.reporter.dump_instructions(instruction_list, self.arch)
+        if self.reporter.collects_instructions:
+            self.reporter.dump_instructions(instruction_list, self.arch)
 
     def select_and_schedule(self, ir_function, frame):
         """Perform instruction selection and scheduling"""
         self.logger.debug("Selecting instructions")
 
-        tree_method = True
-        if tree_method:
-            self.instruction_selector.select(ir_function, frame)
-        else:  # pragma: no cover
-            raise NotImplementedError("TODO")
-            # Build a graph:
-            # self.sgraph_builder.build(ir_function, function_info)
-            # reporter.message('Selection graph')
-            # reporter.dump_sgraph(sgraph)
-
-            # Schedule instructions:
-            # self.instruction_scheduler.schedule(sgraph, frame)
+        # The selector schedules the code of the trees it selects, using
+        # the instruction scheduler if there is one:
+        self.instruction_selector.select(ir_function, frame)
 
     def emit_frame_to_stream(self, frame, output_stream, debug=False):
         """
@@ -239,8 +266,19 @@ class CodeGenerator:
 
         debug_data = []
 
+        # Place literal pools within the function if the target needs it:
+        if self.arch.literal_pool_range:
+            pool = LiteralPoolPlacer(self.arch, frame)
+            place = pool.place
+        else:
+            pool = None
+
+            def place(instruction):
+                return (instruction,)
+
         # Prefix code:
-        output_stream.emit_all(self.arch.gen_prologue(frame))
+        for instruction in self.arch.gen_prologue(frame):
+            output_stream.emit_all(place(instruction))
 
         for instruction in frame.instructions:
             assert isinstance(instruction, Instruction), str(instruction)
@@ -262,22 +300,32 @@ class CodeGenerator:
                 if isinstance(instruction, RegisterUseDef):
                     pass
                 elif isinstance(instruction, ArtificialInstruction):
-                    output_stream.emit(instruction)
+                    output_stream.emit_all(place(instruction))
                 elif isinstance(instruction, InlineAssembly):
+                    # Pass the assembled code through the pool placer, so
+                    # that its size is taken into account:
                     self._generate_inline_assembly(
                         instruction.template,
                         instruction.output_registers,
                         instruction.input_registers,
-                        output_stream,
+                        FunctionOutputStream(
+                            lambda i: output_stream.emit_all(place(i))
+                        ),
                     )
                 else:  # pragma: no cover
                     raise NotImplementedError(str(instruction))
             else:
                 # Real instructions:
                 assert all(r.is_colored for r in instruction.registers)
-                output_stream.emit(instruction)
+                output_stream.emit_all(place(instruction))
 
         # Postfix code, like register restore and stack adjust:
+        if pool:
+            # Leave out the final pool to determine the epilogue size:
+            frame.constants = []
+            epilogue = list(self.arch.gen_epilogue(frame))
+            output_stream.emit_all(pool.finish(epilogue))
+            self.logger.debug("Placed %s literal pools", pool.n_pools)
         output_stream.emit_all(self.arch.gen_epilogue(frame))
 
         # Last but not least, emit debug infos:
@@ -285,7 +333,7 @@ class CodeGenerator:
             output_stream.emit(dd)
 
         # Check if we know what variables are live
-        for tmp in frame.ig.temp_map:
+        for tmp in frame.cfg.registers:
             if self.debug_db.contains(tmp):
                 self.debug_db.get(tmp)
                 # print(tmp, di)
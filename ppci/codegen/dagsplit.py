@@ -7,6 +7,7 @@ The selection dag is splitted into trees by this module.
 import logging
 
 from .. import ir
+from ..utils.collections import OrderedSet
 from ..utils.tree import Tree
 
 
@@ -23,11 +24,18 @@ class DagSplitter:
     def __init__(self, arch):
         self.arch = arch
 
+        # Trees without side effects, which only depend on their inputs,
+        # and trees which only load from memory:
+        self.pure_trees = set()
+        self.load_trees = set()
+
     def split_into_trees(self, sgraph, ir_function, function_info, debug_db):
         """Split a forest of trees into a sorted series of trees for each
         block.
         """
         self.debug_db = debug_db
+        self.pure_trees = set()
+        self.load_trees = set()
         forest = []
         self.assign_vregs(sgraph, function_info)
 
@@ -47,7 +55,7 @@ class DagSplitter:
     def split_group_into_trees(self, sgraph, function_info, group):
         nodes = sgraph.get_group(group)
         # Get rid of ENTRY and EXIT:
-        nodes = set(
+        nodes = OrderedSet(
             filter(lambda x: x.name.op not in ["ENTRY", "EXIT"], nodes)
         )
 
@@ -128,6 +136,10 @@ class DagSplitter:
                         print(node)
                     tree = Tree(self.make_op("MOV", typ), tree, value=vreg)
                     trees.append(tree)
+                    if not node.volatile:
+                        self.pure_trees.add(tree)
+                    elif node.name.op == "LDR" and not node.volatile_access:
+                        self.load_trees.add(tree)
                     tree = Tree(self.make_op("REG", typ), value=vreg)
                 elif node.volatile:
                     trees.append(tree)
@@ -150,33 +162,50 @@ class DagSplitter:
 
 def topological_sort_modified(nodes, start):
     """Modified topological sort, start at the end and work back"""
-    unmarked = set(nodes)
+    unmarked = OrderedSet(nodes)
     marked = set()
     temp_marked = set()
     L = []
 
+    def dependencies(n):
+        # 1 satisfy control dependencies:
+        for inp in n.control_inputs:
+            yield inp.node
+
+        # 2 memory dependencies:
+        for inp in n.memory_inputs:
+            yield inp.node
+
+        # 3 data dependencies:
+        for inp in n.data_inputs:
+            yield inp.node
+
     def visit(n):
+        # Depth first search using a stack, since the chains of
+        # dependencies in a large block are too deep for recursion:
         if n not in nodes:
             return
         assert n not in temp_marked, "DAG has cycles"
-        if n in unmarked:
-            temp_marked.add(n)
-
-            # 1 satisfy control dependencies:
-            for inp in n.control_inputs:
-                visit(inp.node)
-
-            # 2 memory dependencies:
-            for inp in n.memory_inputs:
-                visit(inp.node)
-
-            # 3 data dependencies:
-            for inp in n.data_inputs:
-                visit(inp.node)
-            temp_marked.remove(n)
-            marked.add(n)
-            unmarked.remove(n)
-            L.append(n)
+        if n not in unmarked:
+            return
+        temp_marked.add(n)
+        stack = [(n, dependencies(n))]
+        while stack:
+            n, todo = stack[-1]
+            for m in todo:
+                if m not in nodes:
+                    continue
+                assert m not in temp_marked, "DAG has cycles"
+                if m in unmarked:
+                    temp_marked.add(m)
+                    stack.append((m, dependencies(m)))
+                    break
+            else:
+                stack.pop()
+                temp_marked.remove(n)
+                marked.add(n)
+                unmarked.remove(n)
+                L.append(n)
 
     # Start to visit with pre-knowledge of the last node!
     visit(start)
@@ -1,7 +1,15 @@
+"""Control flow graph of machine instructions.
+
+Liveness is calculated using bit vectors. All registers in the flow graph
+are numbered densely, and a set of registers is represented by a python
+integer, where bit n is set when register n is in the set.
+"""
+
 import logging
-from collections import defaultdict
+from collections import deque
 
 from ..graph.digraph import DiGraph, DiNode
+from ..utils.collections import OrderedSet
 
 
 class FlowGraphNode(DiNode):
@@ -10,24 +18,67 @@ class FlowGraphNode(DiNode):
 
     def __init__(self, g, ins):
         super().__init__(g)
-        self.gen = set()
-        self.kill = set()
-        self.live_in = set()
-        self.live_out = set()
-        self.instructions = []
+        self.live_in_mask = 0
+        self.live_out_mask = 0
+        self.set_instructions([ins])
 
-        # Start with the instruction itself..
-        self.add_instruction(ins)
+    def set_instructions(self, instructions):
+        """Replace the instructions of this node"""
+        self.gen_mask = 0
+        self.kill_mask = 0
+        self.instructions = []
+        self._ins_gen = []
+        self._ins_kill = []
+        for ins in instructions:
+            self.add_instruction(ins)
 
     def add_instruction(self, ins):
         """Bundle the instruction into the current node."""
-        ins.gen = set(ins.used_registers)
-        ins.kill = set(ins.defined_registers)
+        gen = self.graph.to_mask(ins.used_registers)
+        kill = self.graph.to_mask(ins.defined_registers)
+        self.graph._instruction_nodes[ins] = self
         self.instructions.append(ins)
+        self._ins_gen.append(gen)
+        self._ins_kill.append(kill)
 
         # Combine gen and kill effects of the node and the new instruction:
-        self.gen = self.gen | (ins.gen - self.kill)
-        self.kill = self.kill | ins.kill
+        self.gen_mask |= gen & ~self.kill_mask
+        self.kill_mask |= kill
+
+    @property
+    def gen(self):
+        return self.graph.to_set(self.gen_mask)
+
+    @property
+    def kill(self):
+        return self.graph.to_set(self.kill_mask)
+
+    @property
+    def live_in(self):
+        return self.graph.to_set(self.live_in_mask)
+
+    @property
+    def live_out(self):
+        return self.graph.to_set(self.live_out_mask)
+
+    def instruction_liveness(self):
+        """Get the liveness of the instructions in this node.
+
+        Returns a list of tuples with the instruction, its gen, kill,
+        live in and live out masks, in instruction order.
+        """
+        liveness = []
+        live = self.live_out_mask
+        for ins, gen, kill in zip(
+            reversed(self.instructions),
+            reversed(self._ins_gen),
+            reversed(self._ins_kill),
+        ):
+            live_out = live
+            live = gen | (live_out & ~kill)
+            liveness.append((ins, gen, kill, live, live_out))
+        liveness.reverse()
+        return liveness
 
     def __repr__(self):
         r = f"CFG-node({len(self.instructions)})"
@@ -36,9 +87,9 @@ class FlowGraphNode(DiNode):
     @property
     def longrepr(self):
         r = str(self)
-        if self.gen:
+        if self.gen_mask:
             r += " gen:" + ", ".join(str(u) for u in self.gen)
-        if self.kill:
+        if self.kill_mask:
             r += " kill:" + ", ".join(str(d) for d in self.kill)
         r += f" live_out={self.live_out}, live_in={self.live_in}"
         r += f", Succ={self.successors}, Pred={self.predecessors}"
@@ -53,7 +104,12 @@ class FlowGraph(DiGraph):
         super().__init__()
         self.logger = logging.getLogger("flowgraph")
         self._map = {}
-        self._live_ranges = defaultdict(list)
+        self._instruction_nodes = {}
+
+        # Dense numbering of registers, in order of appearance:
+        self.registers = []
+        self._numbers = {}
+        self._liveness = None
 
         # TODO: make this very tricky part of code better readable!!!
 
@@ -103,7 +159,65 @@ class FlowGraph(DiGraph):
             self.add_node(node)
         return self._map[ins]
 
-    # def live_range(
+    def number(self, register):
+        """Get the number of a register, numbering it when it is new"""
+        if register in self._numbers:
+            return self._numbers[register]
+        else:
+            number = len(self.registers)
+            self._numbers[register] = number
+            self.registers.append(register)
+            return number
+
+    def to_mask(self, registers):
+        """Convert a collection of registers into a bit mask"""
+        mask = 0
+        for register in registers:
+            mask |= 1 << self.number(register)
+        return mask
+
+    def to_list(self, mask):
+        """Convert a bit mask into a list of registers, ordered by number"""
+        registers = []
+        while mask:
+            low_bit = mask & -mask
+            registers.append(self.registers[low_bit.bit_length() - 1])
+            mask ^= low_bit
+        return registers
+
+    def to_set(self, mask):
+        """Convert a bit mask into a set of registers"""
+        return set(self.to_list(mask))
+
+    def postorder(self):
+        """Get the nodes in post order of a depth first search from the
+        first node. Nodes not reachable from the first node come last.
+        """
+        node_order = {node: index for index, node in enumerate(self.nodes)}
+
+        def successors(node):
+            # Successors are stored in a set, visit them in node order:
+            return iter(sorted(node.successors, key=node_order.__getitem__))
+
+        order = []
+        visited = set()
+        for root in self.nodes:
+            if root in visited:
+                continue
+            visited.add(root)
+            stack = [(root, successors(root))]
+            while stack:
+                node, todo = stack[-1]
+                for successor in todo:
+                    if successor not in visited:
+                        visited.add(successor)
+                        stack.append((successor, successors(successor)))
+                        break
+                else:
+                    stack.pop()
+                    order.append(node)
+        return order
+
     def calculate_liveness(self):
         """Calculate liveness in CFG:"""
         ###
@@ -112,53 +226,148 @@ class FlowGraph(DiGraph):
         #  out[n] = for s in n.succ in union in[s]
         ###
         for node in self:
-            node.live_in = set()
-            node.live_out = set()
+            node.live_in_mask = 0
+            node.live_out_mask = 0
+
+        self._liveness = None
 
-        # Sort flowgraph nodes by backward depth first search:
-        # TODO: cfg_nodes = [x[1] for x in dfs(self.nodes[0], reverse=True)]
-        cfg_nodes = list(self.nodes)
+        # Liveness flows backwards, so visit nodes in the reverse of
+        # their reverse post order, such that successors are mostly
+        # processed before their predecessors:
+        worklist = deque(self.postorder())
+        on_worklist = set(worklist)
 
         # Dataflow fixed point iteration over the nodes in the CFG:
         n_iterations = 0
-        change = True
-        while change:
-            change = False
-            for node in cfg_nodes:
-                _in = node.live_in
-                _out = node.live_out
-                node.live_in = node.gen | (node.live_out - node.kill)
-                if node.successors:
-                    node.live_out = set.union(
-                        *(s.live_in for s in node.successors)
-                    )
-                else:
-                    node.live_out = set()
-
-                # Record for change:
-                change = (
-                    change or (_in != node.live_in) or (_out != node.live_out)
-                )
+        while worklist:
+            node = worklist.popleft()
+            on_worklist.remove(node)
             n_iterations += 1
 
-        # In one pass fix all instructions:
+            live_out = 0
+            for successor in node.successors:
+                live_out |= successor.live_in_mask
+            node.live_out_mask = live_out
+            live_in = node.gen_mask | (live_out & ~node.kill_mask)
+            if live_in != node.live_in_mask:
+                node.live_in_mask = live_in
+                for predecessor in node.predecessors:
+                    if predecessor not in on_worklist:
+                        on_worklist.add(predecessor)
+                        worklist.append(predecessor)
+
+        self.logger.debug(
+            "Iterations: %s,  nodes: %s", n_iterations, len(self)
+        )
+
+    def update(self, instructions, removed):
+        """Update the flow graph after code was inserted.
+
+        This is used after spilling, when the removed registers were
+        replaced by new registers, and loads and stores of the new
+        registers were inserted into the instruction list. The inserted
+        code may not change the control flow, and the new registers must
+        be local to the node they are used in. Then, the liveness of the
+        nodes is updated starting at the nodes which changed, instead of
+        analyzing the whole function again.
+
+        Returns the nodes of which the code or liveness changed.
+        """
+        removed_mask = self.to_mask(removed)
+
+        # Code inserted after an instruction belongs to the node of this
+        # instruction, code inserted before the first instruction belongs
+        # to the first node:
+        contents = {}
+        changed = OrderedSet()
+        node = None
+        inserted = []
+        for ins in instructions:
+            if ins in self._instruction_nodes:
+                node = self._instruction_nodes[ins]
+                if node not in contents:
+                    contents[node] = []
+                    if inserted:
+                        contents[node].extend(inserted)
+                        inserted = []
+                        changed.add(node)
+                contents[node].append(ins)
+            elif node is None:
+                inserted.append(ins)
+            else:
+                contents[node].append(ins)
+                changed.add(node)
+
+        for node in changed:
+            leader = node.instructions[0]
+            node.set_instructions(contents[node])
+            if node.instructions[0] is not leader:
+                self._map.pop(leader, None)
+                self._map[node.instructions[0]] = node
+
+        # The removed registers are not live anywhere anymore:
         for node in self:
-            assert len(node.instructions) > 0
-            ins2 = node.instructions[-1]
-            ins2.live_out = node.live_out  # Propagate into last instruction
-            ins2.live_in = ins2.gen | (ins2.live_out - ins2.kill)
-            if len(node.instructions) > 1:
-                for ins in reversed(node.instructions[:-1]):
-                    ins1 = ins
+            node.live_in_mask &= ~removed_mask
+            node.live_out_mask &= ~removed_mask
 
-                    ins1.live_out = ins2.live_in
-                    ins1.live_in = ins1.gen | (ins1.live_out - ins1.kill)
+        # Registers used by the inserted code, such as the frame pointer,
+        # can be live outside the node, so propagate liveness changes:
+        updated = OrderedSet(changed)
+        worklist = deque(changed)
+        on_worklist = set(worklist)
+        while worklist:
+            node = worklist.popleft()
+            on_worklist.remove(node)
 
-                    for vreg in ins2.live_in & ins1.live_out:
-                        self._live_ranges[vreg].append((ins1, ins2))
+            live_out = 0
+            for successor in node.successors:
+                live_out |= successor.live_in_mask
+            if live_out != node.live_out_mask:
+                node.live_out_mask = live_out
+                updated.add(node)
+            live_in = node.gen_mask | (live_out & ~node.kill_mask)
+            if live_in != node.live_in_mask:
+                node.live_in_mask = live_in
+                for predecessor in node.predecessors:
+                    if predecessor not in on_worklist:
+                        on_worklist.add(predecessor)
+                        worklist.append(predecessor)
 
-                    ins2 = ins1
+        self._liveness = None
+        return updated
 
-        self.logger.debug(
-            "Iterations: %s,  nodes: %s", n_iterations, len(self)
-        )
+    def has_instruction(self, ins):
+        """Test if the given instruction is part of this flow graph"""
+        if self._liveness is None:
+            self._calculate_instruction_liveness()
+        return ins in self._liveness
+
+    def get_liveness(self, ins):
+        """Get gen, kill, live in and live out sets of an instruction.
+
+        The sets are calculated for all instructions on the first call.
+        """
+        if self._liveness is None:
+            self._calculate_instruction_liveness()
+        return tuple(self.to_set(mask) for mask in self._liveness[ins])
+
+    def _calculate_instruction_liveness(self):
+        self._liveness = {}
+        for node in self:
+            for ins, *masks in node.instruction_liveness():
+                self._liveness[ins] = masks
+
+    def live_ranges(self, vreg):
+        """Get the pairs of consecutive instructions between which
+        the given register is live.
+        """
+        bit = 1 << self._numbers[vreg]
+        ranges = []
+        for node in self:
+            liveness = node.instruction_liveness()
+            for (ins1, _, _, _, live_out), (ins2, _, _, live_in, _) in zip(
+                liveness, liveness[1:]
+            ):
+                if live_out & live_in & bit:
+                    ranges.append((ins1, ins2))
+        return ranges
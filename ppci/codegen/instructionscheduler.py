@@ -1,11 +1,306 @@
+"""List scheduling of selected instructions.
+
+The instruction selector generates the code for one tree of the
+selection graph at a time. The instructions of a tree form a unit, which
+is scheduled as a whole. This keeps state which is not visible in the
+registers of the instructions intact, for example the shift amount
+register set and used by the code for a single shift.
+
+Trees with side effects are connected in the selection graph by a chain
+of control dependencies, so their units keep their order. Loads from
+memory may be reordered with respect to each other, but not with
+respect to other side effects. The other units only depend on the
+registers they use and define. Units are placed in order of their
+critical path, and the use of a result is delayed until the latency of
+the instruction producing it has passed. The latencies are taken from
+the instruction set of the target.
+
+This improves the code for in-order pipelines, where for example an
+instruction directly following a load of one of its operands stalls
+the pipeline.
+
+See: https://en.wikipedia.org/wiki/Instruction_scheduling
 """
-This algorithm takes the selected instructions and schedules them in
-a linear form.
-"""
+
+import heapq
+import logging
+
+from ..arch.generic_instructions import (
+    ArtificialInstruction,
+    Label,
+    PseudoInstruction,
+    VirtualInstruction,
+)
+
+
+def is_executed(instruction):
+    """Test if an instruction is executed, which takes a cycle"""
+    if isinstance(instruction, ArtificialInstruction):
+        return True
+    return not isinstance(instruction, (VirtualInstruction, PseudoInstruction))
+
+
+class ScheduleUnit:
+    """A sequence of instructions which is scheduled as a whole"""
+
+    PURE = 0
+    LOAD = 1
+    ORDERED = 2
+
+    def __init__(self, number, instructions, kind):
+        assert kind in (self.PURE, self.LOAD, self.ORDERED)
+        self.number = number
+        self.instructions = instructions
+        self.kind = kind
+        self.successors = {}  # Minimal delay in cycles per successor unit
+        self.n_predecessors = 0
+        self.earliest = 0
+        self.priority = 0
+
+    def __repr__(self):
+        return f"Unit({self.number}, {len(self.instructions)} instructions)"
+
+    @property
+    def size(self):
+        """The number of cycles it takes to issue this unit"""
+        return sum(1 for ins in self.instructions if is_executed(ins))
+
+    @property
+    def is_barrier(self):
+        """Units with labels, jumps or calls keep their place in the block.
+
+        Moving code across a call would make values live across the
+        call, which requires saving their registers.
+        """
+        return any(
+            ins.jumps or ins.clobbers or isinstance(ins, Label)
+            for ins in self.instructions
+        )
+
+    def add_successor(self, unit, delay):
+        if unit in self.successors:
+            self.successors[unit] = max(self.successors[unit], delay)
+        else:
+            self.successors[unit] = delay
+            unit.n_predecessors += 1
 
 
 class InstructionScheduler:
-    def schedule(self, graph, frame):
-        # TODO: schedule traces in better order.
-        # This is optional!
-        pass
+    """Latency aware list scheduler for in-order targets."""
+
+    logger = logging.getLogger("scheduler")
+    window = 8
+
+    def __init__(self, arch):
+        self.arch = arch
+        self.isa = arch.isa
+
+    def schedule(self, units):
+        """Order the units of code of a basic block.
+
+        The units are given as tuples with a list of instructions and
+        the kind of the unit, which tells how the unit must keep its
+        order with respect to other units with side effects. Returns the
+        scheduled instructions.
+        """
+        units = [
+            ScheduleUnit(number, instructions, kind)
+            for number, (instructions, kind) in enumerate(units)
+        ]
+
+        # Schedule the code between labels, jumps and calls separately:
+        instructions = []
+        region = []
+        for unit in units:
+            if unit.is_barrier:
+                instructions.extend(self.schedule_region(region))
+                instructions.extend(unit.instructions)
+                region = []
+            else:
+                region.append(unit)
+        instructions.extend(self.schedule_region(region))
+        return instructions
+
+    def schedule_region(self, units):
+        """Schedule units without labels, jumps and calls"""
+        if len(units) < 2:
+            return [ins for unit in units for ins in unit.instructions]
+
+        self.add_dependencies(units)
+        self.calculate_priorities(units)
+
+        # Units of which all predecessors are scheduled wait until
+        # their operands are available. Units are not moved up more than
+        # the window size, because this increases the register pressure:
+        waiting = []
+        available = []
+        outside = []
+        first = units[0].number  # The first unit which is not scheduled
+        scheduled = set()
+
+        def release(unit):
+            if unit.number > first + self.window:
+                heapq.heappush(outside, (unit.number, unit))
+            else:
+                heapq.heappush(waiting, (unit.earliest, unit.number, unit))
+
+        for unit in units:
+            if unit.n_predecessors == 0:
+                release(unit)
+
+        instructions = []
+        cycle = 0
+        n_stalls = 0
+        while waiting or available:
+            while waiting and waiting[0][0] <= cycle:
+                _, _, unit = heapq.heappop(waiting)
+                heapq.heappush(available, (-unit.priority, unit.number, unit))
+
+            if not available:
+                n_stalls += waiting[0][0] - cycle
+                cycle = waiting[0][0]
+                continue
+
+            _, _, unit = heapq.heappop(available)
+            instructions.extend(unit.instructions)
+            start = cycle
+            cycle += unit.size
+
+            for successor, delay in unit.successors.items():
+                successor.earliest = max(successor.earliest, start + delay)
+                successor.n_predecessors -= 1
+                if successor.n_predecessors == 0:
+                    release(successor)
+
+            # Move the window:
+            scheduled.add(unit.number)
+            while first in scheduled:
+                first += 1
+            while outside and outside[0][0] <= first + self.window:
+                _, unit = heapq.heappop(outside)
+                release(unit)
+
+        assert len(instructions) == sum(len(u.instructions) for u in units)
+        self.logger.debug(
+            "Scheduled %s units in %s cycles, %s stall cycles",
+            len(units),
+            cycle,
+            n_stalls,
+        )
+        return instructions
+
+    def add_dependencies(self, units):
+        """Determine the order which must be kept between the units.
+
+        The delay of a dependency is the number of cycles between the
+        start of the first unit and the start of the second unit.
+        """
+        last_def = {}  # Unit and ready time of the value of a register
+        readers = {}  # Units reading a register since its definition
+        previous = None  # The last ordered unit
+        loads = []  # Loads since the last ordered unit
+        for unit in units:
+            uses, defs = self.unit_registers(unit)
+
+            # True dependencies:
+            for reg, offset in uses.items():
+                if reg in last_def:
+                    producer, ready = last_def[reg]
+                    producer.add_successor(unit, ready - offset)
+
+            # Anti and output dependencies:
+            for reg in defs:
+                if reg in last_def:
+                    last_def[reg][0].add_successor(unit, 0)
+                for reader in readers.get(reg, ()):
+                    if reader is not unit:
+                        reader.add_successor(unit, 0)
+
+            # Memory and control dependencies:
+            if unit.kind == ScheduleUnit.ORDERED:
+                if previous is not None:
+                    previous.add_successor(unit, 0)
+                for load in loads:
+                    load.add_successor(unit, 0)
+                previous = unit
+                loads = []
+            elif unit.kind == ScheduleUnit.LOAD:
+                if previous is not None:
+                    previous.add_successor(unit, 0)
+                loads.append(unit)
+
+            for reg in uses:
+                readers.setdefault(reg, []).append(unit)
+            for reg, ready in defs.items():
+                last_def[reg] = (unit, ready)
+                readers[reg] = []
+
+    def unit_registers(self, unit):
+        """Get the registers used and defined by a unit.
+
+        Returns the offset of the first use of each register read by the
+        unit, and the cycle at which each defined register is ready,
+        counted from the start of the unit.
+        """
+        uses = {}
+        defs = {}
+        offset = 0
+        for ins in unit.instructions:
+            for reg in ins.used_registers:
+                for key in self.register_keys(reg):
+                    if key not in uses and key not in defs:
+                        uses[key] = offset
+            ready = offset + self.isa.get_latency(ins)
+            for reg in ins.defined_registers:
+                for key in self.register_keys(reg):
+                    defs[key] = ready
+            for reg in ins.clobbers:
+                for key in self.register_keys(reg):
+                    defs[key] = offset + 1
+            if is_executed(ins):
+                offset += 1
+        return uses, defs
+
+    @staticmethod
+    def register_keys(reg):
+        """Get the registers to track for a register, including the
+        registers overlapping with physical registers.
+        """
+        if reg.is_colored:
+            real = reg.get_real()
+            return (real,) + tuple(real.aliases)
+        else:
+            return (reg,)
+
+    @staticmethod
+    def calculate_priorities(units):
+        """Determine the length of the critical path from each unit to
+        the end of the region.
+        """
+        for unit in reversed(units):
+            priority = unit.size
+            for successor, delay in unit.successors.items():
+                priority = max(priority, delay + successor.priority)
+            unit.priority = priority
+
+    def count_cycles(self, instructions):
+        """Estimate the number of cycles to execute a sequence of
+        instructions on a single issue in-order pipeline.
+
+        Each instruction waits until its operands are available. Jumps
+        are not followed, so this is meant for straight line code.
+        """
+        ready = {}
+        cycle = 0
+        for ins in instructions:
+            if not is_executed(ins):
+                continue
+            for reg in ins.used_registers:
+                for key in self.register_keys(reg):
+                    cycle = max(cycle, ready.get(key, 0))
+            latency = self.isa.get_latency(ins)
+            for reg in ins.defined_registers:
+                for key in self.register_keys(reg):
+                    ready[key] = cycle + latency
+            cycle += 1
+        return cycle
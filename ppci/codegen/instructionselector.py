@@ -56,15 +56,18 @@ Memory move operations:
 
 import abc
 import logging
+import os
 
 from .. import ir
 from ..arch.encoding import Instruction
 from ..arch.generic_instructions import InlineAssembly, RegisterUseDef
+from ..utils.cache import TableCache, get_cache_dir
 from ..utils.tree import Tree
 from .burg import BurgSystem
 from .dagsplit import DagSplitter
+from .instructionscheduler import ScheduleUnit
 from .irdag import FunctionInfo, prepare_function_info
-from .treematcher import State
+from .treematcher import StateTable
 
 data_types = [str(t).upper() for t in ir.all_types]
 
@@ -153,10 +156,23 @@ class InstructionContext(ContextInterface):
 
 
 class TreeSelector:
-    """Tree matcher that can match a tree and generate instructions"""
+    """Tree matcher that can match a tree and generate instructions.
 
-    def __init__(self, sys):
+    When a cache directory is given, the state tables are loaded from
+    and saved to this directory. By default the tables are only kept in
+    memory. The directory must be trusted, since the tables are pickled.
+    """
+
+    def __init__(self, sys, cache_dir=None):
         self.sys = sys
+        self.state_table = StateTable(sys)
+        if cache_dir:
+            self.cache_file = os.path.join(
+                cache_dir, f"burg-{self.state_table.fingerprint[:32]}.pickle"
+            )
+            self.state_table.load(self.cache_file)
+        else:
+            self.cache_file = None
 
     def gen(self, context, tree):
         """Generate code for a given tree. The tree will be tiled with
@@ -170,42 +186,17 @@ class TreeSelector:
 
     def burm_label(self, tree):
         """Label all nodes in the tree bottom up"""
-        for child_tree in tree.children:
-            self.burm_label(child_tree)
-
-        # Now the child nodes have been labeled, assign a state to the tree:
-        tree.state = State()
-
-        # Check all rules for matching with this subtree and
-        # check if a state can be determined
-        for rule in self.sys.get_rules_for_root(tree.name):
-            if self.sys.tree_terminal_equal(tree, rule.tree):
-                nts = self.nts(rule.nr)
-                kids = self.kids(tree, rule.nr)
-
-                # Check for acceptance:
-                if rule.acceptance:
-                    accept = rule.acceptance(tree)
-                else:
-                    accept = True
-
-                if (
-                    all(x.state.has_goal(y) for x, y in zip(kids, nts))
-                    and accept
-                ):
-                    cost = sum(x.state.get_cost(y) for x, y in zip(kids, nts))
-                    marked_rules = set()
-                    self.mark_tree(tree, rule, cost, marked_rules)
-
-    def mark_tree(self, tree, rule, cost, marked_rules):
-        cost = cost + rule.cost
-        tree.state.set_cost(rule.non_term, cost, rule.nr)
-        marked_rules.add(rule)
-
-        # Also set cost for chain rules here:
-        for cr in self.sys.chain_rules_for_nt(rule.non_term):
-            if cr not in marked_rules:
-                self.mark_tree(tree, cr, cost, marked_rules)
+        self.state_table.label(tree)
+
+    def save_tables(self):
+        """Save the state tables to the cache, if they were extended"""
+        if self.cache_file and self.state_table.modified:
+            try:
+                self.state_table.save(self.cache_file)
+            except OSError as ex:
+                logging.getLogger("instruction-selector").warning(
+                    "Could not save %s: %s", self.cache_file, ex
+                )
 
     def apply_rules(self, context, tree, goal):
         """Apply all selected instructions to the tree"""
@@ -234,6 +225,109 @@ class TreeSelector:
         return self.sys.get_nts(template_tree)
 
 
+_tree_selectors = TableCache()
+
+
+def get_tree_selector(arch, weights=(1, 1, 1)):
+    """Get a tree selector for the given architecture and weights.
+
+    Tree selectors are created once per process and are shared by all
+    instruction selectors with the same architecture, architecture
+    options and weights.
+    """
+    key = (arch.__class__, arch.make_id_str(), tuple(weights))
+    return _tree_selectors.get(
+        key,
+        lambda: TreeSelector(
+            create_burg_system(arch, weights), cache_dir=get_cache_dir()
+        ),
+    )
+
+
+def create_burg_system(arch, weights=(1, 1, 1)):
+    """Create a burg system with the rules for the given architecture.
+
+    Weights can be given to select instructions given more for:
+    - size
+    - execution cycles
+    - or energy
+    respectively.
+    """
+    system = BurgSystem()
+
+    for terminal in terminals:
+        system.add_terminal(terminal)
+
+    # Add special case nodes:
+    system.add_rule("stm", Tree("CALL"), 0, None, call_function)
+    system.add_rule("stm", Tree("ASM"), 0, None, inline_asm)
+
+    # Add undefined value for register classes:
+    _create_undefined_rules(system, arch)
+
+    # Add all isa patterns:
+    for pattern in arch.isa.patterns:
+        cost = (
+            pattern.size * weights[0]
+            + pattern.cycles * weights[1]
+            + pattern.energy * weights[2]
+        )
+        system.add_rule(
+            pattern.non_term,
+            pattern.tree,
+            cost,
+            pattern.condition,
+            pattern.method,
+        )
+
+    system.check()
+    return system
+
+
+def _create_undefined_rules(system, arch):
+    """Create rules for undefined values based on register classes."""
+    und_map = {}
+    for register_class in arch.info.register_classes:
+        for ir_typ in register_class.ir_types:
+            if ir_typ in ir.value_types:
+                und_map[ir_typ] = (register_class.name, register_class.typ)
+
+    for ir_typ, info in und_map.items():
+        reg_class_name, reg_class = info
+        _mk_undefined_rule(system, reg_class_name, reg_class, ir_typ)
+
+
+def _mk_undefined_rule(system, reg_class_name, reg_class, ir_ty):
+    """Create rule for undefined value.
+
+    For example, create UNDU16 which defines
+    a 16 bits registers and returns it.
+    """
+    suffix = ir_ty.name.upper()
+
+    def und_pattern(context, tree):
+        r = context.new_reg(reg_class)
+        context.emit(RegisterUseDef(defs=(r,)))
+        return r
+
+    system.add_rule(reg_class_name, Tree(f"UND{suffix}"), 0, None, und_pattern)
+
+
+def call_function(context, tree):
+    """Generate a function call."""
+    label, args, rv = tree.value
+    for instruction in context.arch.gen_call(context.frame, label, args, rv):
+        context.emit(instruction)
+
+
+def inline_asm(context, tree):
+    """Run assembler on inline assembly code."""
+    template, output_registers, input_registers, clobbers = tree.value
+    context.emit(
+        InlineAssembly(template, output_registers, input_registers, clobbers)
+    )
+
+
 class InstructionSelector1:
     """Instruction selector which takes in a DAG and puts instructions
     into a frame.
@@ -243,7 +337,14 @@ class InstructionSelector1:
 
     verbose = False
 
-    def __init__(self, arch, sgraph_builder, reporter, weights=(1, 1, 1)):
+    def __init__(
+        self,
+        arch,
+        sgraph_builder,
+        reporter,
+        weights=(1, 1, 1),
+        scheduler=None,
+    ):
         """Create a new instruction selector.
 
         Weights can be given to select instructions given more for:
@@ -251,86 +352,21 @@ class InstructionSelector1:
         - execution cycles
         - or energy
         respectively.
+
+        The selection tables are shared with other instruction selectors
+        for the same architecture and weights.
+
+        When a scheduler is given, the code of the trees of each block
+        is reordered by this scheduler.
         """
         self.logger = logging.getLogger("instruction-selector")
         self.dag_builder = sgraph_builder
         self.arch = arch
         self.reporter = reporter
+        self.scheduler = scheduler
         self.dag_splitter = DagSplitter(arch)
-
-        # Generate burm table of rules:
-        self.sys = BurgSystem()
-
-        for terminal in terminals:
-            self.sys.add_terminal(terminal)
-
-        # Add special case nodes:
-        self.sys.add_rule("stm", Tree("CALL"), 0, None, self.call_function)
-        self.sys.add_rule("stm", Tree("ASM"), 0, None, self.inline_asm)
-
-        # Add undefined value for register classes:
-        self._create_undefined_rules()
-
-        # Add all isa patterns:
-        for pattern in arch.isa.patterns:
-            cost = (
-                pattern.size * weights[0]
-                + pattern.cycles * weights[1]
-                + pattern.energy * weights[2]
-            )
-            self.sys.add_rule(
-                pattern.non_term,
-                pattern.tree,
-                cost,
-                pattern.condition,
-                pattern.method,
-            )
-
-        self.sys.check()
-        self.tree_selector = TreeSelector(self.sys)
-
-    def _create_undefined_rules(self):
-        """Create rules for undefined values based on register classes."""
-        und_map = {}
-        for register_class in self.arch.info.register_classes:
-            for ir_typ in register_class.ir_types:
-                if ir_typ in ir.value_types:
-                    und_map[ir_typ] = (register_class.name, register_class.typ)
-
-        for ir_typ, info in und_map.items():
-            reg_class_name, reg_class = info
-            self._mk_undefined_rule(reg_class_name, reg_class, ir_typ)
-
-    def _mk_undefined_rule(self, reg_class_name, reg_class, ir_ty):
-        """Create rule for undefined value.
-
-        For example, create UNDU16 which defines
-        a 16 bits registers and returns it.
-        """
-        suffix = ir_ty.name.upper()
-
-        def und_pattern(context, tree):
-            r = context.new_reg(reg_class)
-            context.emit(RegisterUseDef(defs=(r,)))
-            return r
-
-        self.sys.add_rule(
-            reg_class_name, Tree(f"UND{suffix}"), 0, None, und_pattern
-        )
-
-    def call_function(self, context, tree):
-        label, args, rv = tree.value
-        for instruction in self.arch.gen_call(context.frame, label, args, rv):
-            context.emit(instruction)
-
-    def inline_asm(self, context, tree):
-        """Run assembler on inline assembly code."""
-        template, output_registers, input_registers, clobbers = tree.value
-        context.emit(
-            InlineAssembly(
-                template, output_registers, input_registers, clobbers
-            )
-        )
+        self.tree_selector = get_tree_selector(arch, weights)
+        self.sys = self.tree_selector.sys
 
     def select(self, ir_function: ir.SubRoutine, frame):
         """Select instructions of function into a frame"""
@@ -394,6 +430,10 @@ class InstructionSelector1:
         TODO: implement different strategies.
         """
 
+        if self.scheduler:
+            self.munch_and_schedule_trees(context, trees)
+            return
+
         # Match all splitted trees:
         for tree in trees:
             # Invoke dynamic programming matcher machinery:
@@ -403,6 +443,40 @@ class InstructionSelector1:
                 assert isinstance(tree, Tree)
                 self.gen_tree(context, tree)
 
+    def munch_and_schedule_trees(self, context, trees):
+        """Match the trees, and schedule the code of each block.
+
+        The code of each tree is kept together. Trees with side effects
+        are kept in order, except for loads, which may be reordered with
+        respect to other loads.
+        """
+        instructions = context.frame.instructions
+        pure_trees = self.dag_splitter.pure_trees
+        load_trees = self.dag_splitter.load_trees
+        units = []
+        for tree in trees:
+            if isinstance(tree, Instruction):
+                instructions.extend(self.scheduler.schedule(units))
+                units = []
+                context.emit(tree)
+            else:
+                assert isinstance(tree, Tree)
+                start = len(instructions)
+                self.gen_tree(context, tree)
+                if tree in pure_trees:
+                    kind = ScheduleUnit.PURE
+                elif tree in load_trees:
+                    kind = ScheduleUnit.LOAD
+                else:
+                    kind = ScheduleUnit.ORDERED
+                units.append((instructions[start:], kind))
+                del instructions[start:]
+        instructions.extend(self.scheduler.schedule(units))
+
     def gen_tree(self, context, tree):
         """Generate code from a tree"""
         self.tree_selector.gen(context, tree)
+
+    def save_tables(self):
+        """Save the instruction selection tables for later use"""
+        self.tree_selector.save_tables()
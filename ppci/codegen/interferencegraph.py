@@ -3,14 +3,21 @@
 .. autoclass:: ppci.codegen.interferencegraph.InterferenceGraph
     :members: get_node, combine, interfere
 
+.. autoclass:: ppci.codegen.interferencegraph.CompactInterferenceGraph
+
+.. autoclass:: ppci.codegen.interferencegraph.RegisterInterference
+    :members: update
+
 """
 
 import logging
 from collections import defaultdict
 
 from ..arch.registers import Register
+from ..graph.compact_graph import CompactGraph
 from ..graph.graph import Node
 from ..graph.maskable_graph import MaskableGraph
+from ..utils.collections import OrderedSet
 
 
 class InterferenceGraphNode(Node):
@@ -18,8 +25,8 @@ class InterferenceGraphNode(Node):
 
     def __init__(self, graph, vreg):
         super().__init__(graph)
-        self.temps = {vreg}
-        self.moves = set()
+        self.temps = OrderedSet([vreg])
+        self.moves = OrderedSet()
         self.reg = vreg if vreg.is_colored else None
         self.reg_class = type(vreg)
 
@@ -31,11 +38,101 @@ class InterferenceGraphNode(Node):
         return f"{self.temps}(reg={self.reg},class={self.reg_class})"
 
 
-class InterferenceGraph(MaskableGraph):
-    """Interference graph."""
+class RegisterInterference:
+    """Interference between the registers of a flow graph.
+
+    The registers which interfere with a register are stored as a bit
+    mask, using the register numbering of the flow graph. Unlike the
+    interference graph, this information is not modified during register
+    allocation, so it can be updated after spilling, instead of being
+    calculated again for the whole function.
+    """
+
+    def __init__(self, flowgraph):
+        self.flowgraph = flowgraph
+        self.register_mask = 0
+        self.edges = defaultdict(int)
+        self.defs = defaultdict(list)
+        self.uses = defaultdict(list)
+        self._instructions = set()
+        self._n_registers = 0
+        self.update(flowgraph, ())
+
+    def update(self, nodes, removed):
+        """Remove the given registers, and add the interference of the
+        registers in the given flow graph nodes.
+        """
+        self.remove_registers(removed)
+        for node in nodes:
+            self.add_node(node)
+        self._n_registers = len(self.flowgraph.registers)
+
+    def remove_registers(self, registers):
+        """Remove registers which do not occur in the code anymore"""
+        flowgraph = self.flowgraph
+        mask = flowgraph.to_mask(registers)
+        self.register_mask &= ~mask
+        for tmp in registers:
+            for tmp2 in flowgraph.to_list(self.edges.pop(tmp, 0)):
+                if tmp2 in self.edges:
+                    self.edges[tmp2] &= ~mask
+            self.defs.pop(tmp, None)
+            self.uses.pop(tmp, None)
+
+    def add_node(self, node):
+        """Add the interference of the registers in a flow graph node"""
+        flowgraph = self.flowgraph
+        edges = self.edges
+
+        # Registers which are live at the same point interfere.
+        # Pairs of registers live at the previous instruction are
+        # connected already, so only connect newly live registers:
+        previous = 0
+        for ins, _, kill, live_in, live_out in node.instruction_liveness():
+            # Live out and zero length defined variables:
+            live_and_def = live_out | kill
+            self.register_mask |= live_in | live_and_def
+
+            # Add interfering edges:
+            new = live_and_def & ~previous
+            for tmp in flowgraph.to_list(new):
+                edges[tmp] |= live_and_def
+            for tmp in flowgraph.to_list(live_and_def):
+                edges[tmp] |= new
+            previous = live_and_def
+
+            # Add clobbered interfering edges:
+            if ins.clobbers and live_and_def:
+                clobbers = flowgraph.to_mask(ins.clobbers)
+                self.register_mask |= clobbers
+                for tmp in flowgraph.to_list(live_and_def):
+                    edges[tmp] |= clobbers
+                for tmp in flowgraph.to_list(clobbers):
+                    edges[tmp] |= live_and_def
+
+            # Generate usage info for new instructions and registers:
+            if ins in self._instructions:
+                for reg in ins.defined_registers:
+                    if flowgraph.number(reg) >= self._n_registers:
+                        self.defs[reg].append(ins)
+                for reg in ins.used_registers:
+                    if flowgraph.number(reg) >= self._n_registers:
+                        self.uses[reg].append(ins)
+            else:
+                self._instructions.add(ins)
+                for reg in ins.defined_registers:
+                    self.defs[reg].append(ins)
+                for reg in ins.used_registers:
+                    self.uses[reg].append(ins)
+
+
+class BaseInterferenceGraph:
+    """Register related functionality of the interference graphs.
+
+    This is combined with a graph class, which stores the edges.
+    """
 
     def __init__(self):
-        """Create a new interference graph from a flowgraph"""
         super().__init__()
         self.logger = logging.getLogger("interferencegraph")
         self.temp_map = {}
@@ -50,32 +147,32 @@ class InterferenceGraph(MaskableGraph):
 
     def calculate_interference(self, flowgraph):
         """Construct interference graph"""
-        for n in flowgraph:
-            for ins in n.instructions:
-                # ins.live_out |= ins.
-                for tmp in ins.live_in:
-                    self.get_node(tmp)
-
-                # Live out and zero length defined variables:
-                live_and_def = ins.live_out | ins.kill
-
-                # Add interfering edges:
-                for tmp in live_and_def:
-                    n1 = self.get_node(tmp)
-                    for tmp2 in live_and_def - {tmp}:
-                        n2 = self.get_node(tmp2)
-                        self.add_edge(n1, n2)
-
-                    # Add clobbered interfering edges:
-                    for tmp2 in ins.clobbers:
-                        n2 = self.get_node(tmp2)
-                        self.add_edge(n1, n2)
-
-                # Generate usage info:
-                for reg in ins.defined_registers:
-                    self._def_map[reg].append(ins)
-                for reg in ins.used_registers:
-                    self._use_map[reg].append(ins)
+        self.add_interference(RegisterInterference(flowgraph))
+
+    def add_interference(self, interference):
+        """Construct the interference graph from register interference.
+
+        The graph must be empty.
+        """
+        assert not self.nodes
+        flowgraph = interference.flowgraph
+        temps = flowgraph.to_list(interference.register_mask)
+        for tmp in temps:
+            self.get_node(tmp)
+
+        temp_map = self.temp_map
+        for tmp in temps:
+            self.set_adjacent(
+                temp_map[tmp],
+                (
+                    temp_map[tmp2]
+                    for tmp2 in flowgraph.to_list(interference.edges[tmp])
+                    if tmp2 is not tmp
+                ),
+            )
+
+        self._def_map = interference.defs
+        self._use_map = interference.uses
 
     def has_node(self, tmp):
         """Check if there exists a node for this temp register"""
@@ -107,7 +204,7 @@ class InterferenceGraph(MaskableGraph):
         """Combine n and m into n and return n"""
         # Copy associated moves and temporaries into n:
         n.temps |= m.temps
-        n.moves.update(m.moves)
+        n.moves |= m.moves
 
         # Update local temp map:
         for tmp in m.temps:
@@ -115,3 +212,23 @@ class InterferenceGraph(MaskableGraph):
 
         super().combine(n, m)
         return n
+
+
+class InterferenceGraph(BaseInterferenceGraph, MaskableGraph):
+    """Interference graph with ordered sets of neighbours."""
+
+    def set_adjacent(self, node, neighbours):
+        """Connect a node to the given neighbours, see add_interference"""
+        self.adj_map[node] = OrderedSet(neighbours)
+
+
+class CompactInterferenceGraph(BaseInterferenceGraph, CompactGraph):
+    """Interference graph with a bit matrix of edges.
+
+    The nodes are numbered, the edges are stored in a triangular bit
+    matrix and the neighbours of each node are kept in an insertion
+    ordered dictionary keyed by node number. Masking, unmasking and
+    combining nodes gives the same results as with the
+    :class:`InterferenceGraph`, so both result in the same coloring. This
+    is the graph used by the graph coloring allocator.
+    """
@@ -342,6 +342,7 @@ class SelectionGraphBuilder:
         """Create dag node for load operation"""
         address = self.get_address(node.address)
         sgnode = self.new_node("LDR", node.ty, address)
+        sgnode.volatile_access = node.volatile
         # Make sure a data dependence is added to this node
         self.debug_db.map(node, sgnode)
         self.chain(sgnode)
@@ -0,0 +1,361 @@
+"""Linear scan register allocation.
+
+The graph coloring register allocator produces good code, but building
+the interference graph takes quadratic time on large functions, and
+this is repeated for each round of spilling. The linear scan allocator
+trades some code quality for speed, which is useful for debug builds
+and just in time compilation.
+
+**Live intervals**
+
+Each instruction in the instruction list occupies two program points:
+one at which its registers are read, and one at which its registers
+are written. A virtual register is live from the first point to the
+last point where it is used, defined or live according to the liveness
+analysis of the flow graph. This range of points is called the live
+interval of the register. Holes in the live range are ignored.
+
+Physical registers, used for example to pass arguments to a function,
+are live only briefly. For those, all points are remembered where the
+register is live or clobbered.
+
+**Allocation**
+
+The intervals are visited in order of their start point. An interval
+is assigned a register of its class which is not used by an interval
+that is still active, and which is not live as a physical register
+during the interval. Registers which are connected to the interval
+by a move instruction are tried first, such that the move can be
+removed.
+
+When no register is available, either the current interval or the
+active interval which ends last is spilled. Spilled registers are
+rewritten into loads and stores by the same spill code generator as
+used by the graph coloring allocator, and the allocation is repeated.
+
+See: https://en.wikipedia.org/wiki/Register_allocation#Linear_scan
+
+"""
+
+import logging
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from ..arch.arch import Architecture, Frame
+from ..utils.collections import OrderedSet
+from .flowgraph import FlowGraph
+from .registerallocator import (
+    AllocationStatistics,
+    MiniGen,
+    get_register_class_tables,
+)
+
+
+class LiveInterval:
+    """The range of program points at which a virtual register is live."""
+
+    def __init__(self, vreg):
+        self.vreg = vreg
+        self.start = None
+        self.end = None
+        self.reg = None
+        self.instructions = OrderedSet()
+
+    def __repr__(self):
+        return f"{self.vreg}[{self.start}, {self.end}](reg={self.reg})"
+
+    def add_point(self, point):
+        """Extend the interval such that it includes the given point"""
+        if self.start is None:
+            self.start = self.end = point
+        else:
+            self.start = min(self.start, point)
+            self.end = max(self.end, point)
+
+
+class LinearScanRegisterAllocator:
+    """Target independent linear scan register allocator.
+
+    This allocator is a drop in replacement for the
+    :class:`ppci.codegen.registerallocator.GraphColoringRegisterAllocator`.
+    """
+
+    logger = logging.getLogger("regalloc")
+    max_spill_rounds = 30
+
+    def __init__(self, arch: Architecture, instruction_selector, reporter):
+        assert isinstance(arch, Architecture), arch
+        self.arch = arch
+        self.spill_gen = MiniGen(arch, instruction_selector)
+        self.reporter = reporter
+        self.statistics = {}  # Statistics per function
+
+        # Register class information, shared between allocators:
+        tables = get_register_class_tables(arch)
+        self.alias = tables.alias
+        self.cls_regs = tables.cls_regs
+
+    def alloc_frame(self, frame: Frame):
+        """Do linear scan register allocation for a single frame.
+
+        Args:
+            frame: The frame to perform register allocation on.
+        """
+        spill_rounds = 0
+        self.spill_temps = set()
+        stats = AllocationStatistics(frame.name)
+        self.statistics[frame.name] = stats
+
+        while True:
+            start_time = time.perf_counter()
+            intervals = self.build_intervals(frame)
+            stats.build_time += time.perf_counter() - start_time
+            spilled = self.scan(intervals)
+            if not spilled:
+                break
+
+            spill_rounds += 1
+            stats.spill_rounds = spill_rounds
+            stats.spilled_registers += len(spilled)
+            self.logger.debug(
+                "Spilling round %s: %s registers", spill_rounds, len(spilled)
+            )
+            if spill_rounds > self.max_spill_rounds:
+                raise RuntimeError(
+                    f"Give up after {self.max_spill_rounds} spill rounds!"
+                )
+
+            for interval in spilled:
+                self.rewrite_program(frame, interval)
+
+        self.apply_colors(frame, intervals)
+        self.remove_redundant_moves(frame)
+        self.logger.debug("%s", stats)
+
+    def build_intervals(self, frame: Frame):
+        """Determine the live intervals of all virtual registers.
+
+        Returns the intervals sorted by start point.
+        """
+        cfg = FlowGraph(frame.instructions)
+        cfg.calculate_liveness()
+        frame.cfg = cfg
+
+        positions = {ins: idx for idx, ins in enumerate(frame.instructions)}
+        physical_mask = cfg.to_mask(r for r in cfg.registers if r.is_colored)
+        virtual_mask = cfg.to_mask(
+            r for r in cfg.registers if not r.is_colored
+        )
+
+        intervals = self.intervals_by_vreg = {}
+
+        def get_interval(vreg):
+            if vreg not in intervals:
+                intervals[vreg] = LiveInterval(vreg)
+            return intervals[vreg]
+
+        # Points at which physical registers are occupied:
+        self.fixed = defaultdict(list)
+
+        # Registers connected by move instructions:
+        self.hints = defaultdict(list)
+
+        for node in cfg:
+            first = positions[node.instructions[0]]
+            last = positions[node.instructions[-1]]
+            for vreg in cfg.to_list(node.live_in_mask & virtual_mask):
+                get_interval(vreg).add_point(2 * first)
+            for vreg in cfg.to_list(node.live_out_mask & virtual_mask):
+                get_interval(vreg).add_point(2 * last + 1)
+
+            liveness = node.instruction_liveness()
+            for ins, gen, kill, live_in, live_out in liveness:
+                point = 2 * positions[ins]
+                for reg in cfg.to_list((gen | live_in) & physical_mask):
+                    self.fixed[reg.get_real()].append(point)
+                for reg in cfg.to_list((kill | live_out) & physical_mask):
+                    self.fixed[reg.get_real()].append(point + 1)
+                for reg in ins.clobbers:
+                    self.fixed[reg.get_real()].append(point + 1)
+
+                for reg in ins.used_registers:
+                    if not reg.is_colored:
+                        interval = get_interval(reg)
+                        interval.add_point(point)
+                        interval.instructions.add(ins)
+                for reg in ins.defined_registers:
+                    if not reg.is_colored:
+                        interval = get_interval(reg)
+                        interval.add_point(point + 1)
+                        interval.instructions.add(ins)
+
+                if ins.ismove:
+                    dst = ins.defined_registers[0]
+                    src = ins.used_registers[0]
+                    self.hints[dst].append(src)
+                    self.hints[src].append(dst)
+
+        for points in self.fixed.values():
+            points.sort()
+
+        self.logger.debug(
+            "Constructed %s live intervals in %s instructions",
+            len(intervals),
+            len(frame.instructions),
+        )
+        return sorted(intervals.values(), key=lambda i: i.start)
+
+    def scan(self, intervals):
+        """Assign registers to the intervals.
+
+        Returns a list of intervals which must be spilled.
+        """
+        active = []
+        spilled = []
+        for current in intervals:
+            # Expire old intervals:
+            active = [a for a in active if a.end >= current.start]
+
+            reg = self.find_free_register(current, active)
+            if reg is None:
+                reg, victims = self.select_victims(current, active)
+                if reg is None:
+                    spilled.append(current)
+                    continue
+
+                for victim in victims:
+                    victim.reg = None
+                    active.remove(victim)
+                    spilled.append(victim)
+
+            current.reg = reg
+            active.append(current)
+
+        return spilled
+
+    def find_free_register(self, current, active):
+        """Find a register for the current interval, or return None"""
+        taken = set()
+        for interval in active:
+            taken.update(self.aliases(interval.reg))
+
+        for reg in self.candidates(current):
+            if reg not in taken and not self.is_fixed(reg, current):
+                return reg
+
+    def candidates(self, current):
+        """Get the registers suitable for the given interval, preferred
+        registers first.
+        """
+        regs = self.cls_regs[type(current.vreg)]
+        for other in self.hints[current.vreg]:
+            if other.is_colored:
+                hint = other.get_real()
+            elif other in self.intervals_by_vreg:
+                hint = self.intervals_by_vreg[other].reg
+            else:
+                hint = None
+
+            if hint in regs:
+                yield hint
+
+        yield from regs
+
+    def select_victims(self, current, active):
+        """Select active intervals to spill in favor of the current one.
+
+        A register of the current class is selected, such that the
+        intervals occupying it end last. Spill code is never spilled
+        again. Returns a tuple with the register and the intervals to
+        spill, or None when the current interval must be spilled itself.
+        """
+        best_reg, best_victims, best_end = None, None, None
+        for reg in self.cls_regs[type(current.vreg)]:
+            if self.is_fixed(reg, current):
+                continue
+
+            # The register may be blocked by intervals of other classes:
+            aliases = self.aliases(reg)
+            victims = [a for a in active if a.reg in aliases]
+            if not victims:
+                # Blocked, but not by an active interval of this register:
+                continue
+            if any(v.vreg in self.spill_temps for v in victims):
+                continue
+
+            end = min(v.end for v in victims)
+            if best_end is None or end > best_end:
+                best_reg, best_victims, best_end = reg, victims, end
+
+        if best_reg is None:
+            return None, ()
+        elif current.vreg in self.spill_temps or best_end > current.end:
+            return best_reg, best_victims
+        else:
+            return None, ()
+
+    def aliases(self, reg):
+        """Get the registers which overlap with the given register"""
+        return self.alias.get(reg, (reg,))
+
+    def is_fixed(self, reg, interval):
+        """Test if the register or one of its aliases is occupied as a
+        physical register during the given interval.
+        """
+        for reg2 in self.aliases(reg):
+            points = self.fixed.get(reg2)
+            if points:
+                idx = bisect_left(points, interval.start)
+                if idx < len(points) and points[idx] <= interval.end:
+                    return True
+        return False
+
+    def rewrite_program(self, frame, interval):
+        """Rewrite program by creating a load and a store for each use"""
+        vreg = interval.vreg
+        self.logger.debug("Placing %s on stack", vreg)
+        size = vreg.bitsize // 8
+        slot = frame.alloc(size, size)
+
+        for instruction in interval.instructions:
+            vreg2 = frame.new_reg(type(vreg))
+            self.spill_temps.add(vreg2)
+            instruction.replace_register(vreg, vreg2)
+
+            if instruction.reads_register(vreg2):
+                code = self.spill_gen.gen_load(frame, vreg2, slot)
+                frame.insert_code_before(instruction, code)
+
+            if instruction.writes_register(vreg2):
+                code = self.spill_gen.gen_store(frame, vreg2, slot)
+                frame.insert_code_after(instruction, code)
+
+    def apply_colors(self, frame, intervals):
+        """Assign colors to registers"""
+        # Mark the physical registers defined in this frame as used.
+        # Registers which are only clobbered, for example by calls, are
+        # not used:
+        for ins in frame.instructions:
+            for reg in ins.defined_registers:
+                if reg.is_colored:
+                    frame.used_regs.add(reg.get_real())
+
+        for interval in intervals:
+            assert interval.reg is not None
+            interval.vreg.set_color(interval.reg.color)
+            frame.used_regs.add(interval.reg.get_real())
+
+    def remove_redundant_moves(self, frame):
+        """Remove moves of which the source and destination got the
+        same register.
+        """
+        frame.instructions = [
+            ins
+            for ins in frame.instructions
+            if not (
+                ins.ismove
+                and ins.used_registers[0].get_real()
+                is ins.defined_registers[0].get_real()
+            )
+        ]
@@ -0,0 +1,134 @@
+"""Literal pool placement.
+
+Some targets, like arm and thumb, load constants relative to the program
+counter from a literal pool. Usually the pool of a function is placed
+after its epilogue, but the load instructions can only reach a limited
+distance, which is given by the ``literal_pool_range`` of the
+architecture. When a function is larger than this range, pools are
+placed within the function, with a jump over each pool.
+
+Literals are always placed after the instructions which load them. When
+a literal is loaded again after its pool was placed, it gets a new label
+and is placed again in a later pool.
+"""
+
+from ..arch.generic_instructions import (
+    ArtificialInstruction,
+    VirtualInstruction,
+)
+
+# The sizes of instruction classes with tokens, which are measured by
+# encoding the first instruction of each class:
+_instruction_sizes = {}
+
+
+class LiteralPoolPlacer:
+    """Keep track of the code size of a function, and insert literal
+    pools before the literals get out of range.
+    """
+
+    # Space for the jump over a pool and for alignment:
+    margin = 8
+
+    def __init__(self, arch, frame):
+        self.arch = arch
+        self.frame = frame
+        self.max_distance = arch.literal_pool_range - self.margin
+        self.values = dict(frame.constants)
+        self.labels = {}  # The current label of each literal
+        self.placed = set()
+        self.pending = {}  # Literals loaded since the last pool
+        self.pending_size = 0
+        self.first_load = 0
+        self.offset = 0
+        self.n_pools = 0
+
+    def place(self, instruction):
+        """Get the instructions to emit for the given instruction.
+
+        These are the instruction itself, possibly preceded by a pool.
+        """
+        size = self.instruction_size(instruction)
+        if self.pending and self.out_of_range(size):
+            yield from self.flush()
+
+        for reloc in instruction.relocations():
+            label = reloc.symbol_name
+            if label not in self.values:
+                continue
+            current = self.labels.get(label, label)
+            if current in self.placed:
+                # The pool with this literal was placed already:
+                current = self.frame.new_name("literal")
+                self.values[current] = self.values[label]
+                self.labels[label] = current
+            if current != label:
+                instruction.replace_label(label, current)
+            if current not in self.pending:
+                if not self.pending:
+                    self.first_load = self.offset
+                self.pending[current] = self.values[current]
+                self.pending_size += self.literal_size(self.values[current])
+
+        self.offset += size
+        yield instruction
+
+    def finish(self, epilogue):
+        """Prepare the pool which is placed after the epilogue.
+
+        Returns instructions to emit before the epilogue.
+        """
+        size = sum(self.instruction_size(i) for i in epilogue)
+        if self.pending and self.out_of_range(size):
+            yield from self.flush()
+
+        # Literals which are not loaded at all stay in the final pool:
+        referenced = set(self.labels) | set(self.pending) | self.placed
+        constants = list(self.pending.items())
+        for label, value in self.values.items():
+            if label not in referenced:
+                constants.append((label, value))
+        self.frame.constants = constants
+
+    def out_of_range(self, size):
+        """Test if the pending literals get out of range when code of the
+        given size is emitted before them.
+        """
+        end = self.offset + size + self.pending_size
+        return end - self.first_load > self.max_distance
+
+    def flush(self):
+        """Place a pool with the pending literals"""
+        pool = list(
+            self.arch.gen_literal_pool(self.frame, list(self.pending.items()))
+        )
+        self.placed.update(self.pending)
+        self.pending = {}
+        self.pending_size = 0
+        self.n_pools += 1
+        for instruction in pool:
+            self.offset += self.instruction_size(instruction)
+        return pool
+
+    @classmethod
+    def instruction_size(cls, instruction):
+        if isinstance(instruction, ArtificialInstruction):
+            return sum(cls.instruction_size(i) for i in instruction.render())
+        elif isinstance(instruction, VirtualInstruction):
+            return 0
+
+        ins_cls = type(instruction)
+        size = _instruction_sizes.get(ins_cls)
+        if size is None:
+            size = len(instruction.encode())
+            if getattr(ins_cls, "tokens", None):
+                _instruction_sizes[ins_cls] = size
+        return size
+
+    @staticmethod
+    def literal_size(value):
+        """Literals are words, or byte strings padded to whole words"""
+        if isinstance(value, bytes):
+            return (len(value) + 3) // 4 * 4
+        else:
+            return 4
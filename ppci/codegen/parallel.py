@@ -0,0 +1,107 @@
+"""Parallel code generation.
+
+Code generation for one function does not depend on code generation of
+other functions. This module distributes the functions of a module over
+a pool of worker processes. Each worker selects instructions, allocates
+registers and emits the function into a list of encoded instructions.
+The parent process merges these lists into the output stream in the
+original function order, so that the result is identical to a serial
+build.
+
+Worker processes are forked, so that the ir-module and the code
+generator are inherited by the workers and need not be serialized.
+On platforms without fork, code is generated serially. The workers
+do not write to the compilation report, so code is also generated
+serially when the reporter collects the emitted instructions.
+"""
+
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from .. import ir
+from ..arch.generic_instructions import EncodedInstruction, PseudoInstruction
+from ..binutils.debuginfo import DebugDb
+from ..binutils.outstream import FunctionOutputStream
+from ..utils import reporting
+
+logger = logging.getLogger("codegen")
+
+# State inherited by the forked worker processes:
+_worker_state = None
+
+
+def can_generate_parallel(ir_module, debug=False, reporter=None):
+    """Check if the functions of the given module can be generated
+    in parallel.
+    """
+    if debug:
+        # Debug information is collected in a single debug database.
+        return False
+
+    if reporter is not None and reporter.collects_instructions:
+        # The workers do not report:
+        return False
+
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return False
+
+    # The inline assembler numbers literals across functions:
+    for function in ir_module.functions:
+        for block in function:
+            for instruction in block:
+                if isinstance(instruction, ir.InlineAsm):
+                    return False
+
+    return True
+
+
+def generate_functions(code_generator, ir_module, output_stream, jobs):
+    """Generate code for all functions of a module using `jobs` processes.
+
+    The instructions are emitted into output_stream in function order.
+    """
+    global _worker_state
+    worker = code_generator.__class__(
+        code_generator.arch,
+        reporting.DummyReportGenerator(),
+        optimize_for=code_generator.optimize_for,
+        regalloc=code_generator.regalloc,
+    )
+    worker.debug_db = DebugDb()
+    _worker_state = (worker, ir_module)
+
+    indices = range(len(ir_module.functions))
+    chunksize = max(1, len(indices) // (jobs * 4))
+    context = multiprocessing.get_context("fork")
+    try:
+        with ProcessPoolExecutor(jobs, mp_context=context) as executor:
+            for items in executor.map(
+                _generate_function, indices, chunksize=chunksize
+            ):
+                output_stream.emit_all(items)
+    finally:
+        _worker_state = None
+
+
+def _generate_function(index):
+    """Generate code for a single function inside a worker process."""
+    code_generator, ir_module = _worker_state
+    ir_function = ir_module.functions[index]
+    items = []
+    code_generator.generate_function(
+        ir_function, FunctionOutputStream(items.append)
+    )
+    return [_freeze(item) for item in items]
+
+
+def _freeze(instruction):
+    """Turn an instruction into something which can be pickled.
+
+    Target instructions are created by the isa machinery and cannot be
+    pickled, so send their encoding instead.
+    """
+    if isinstance(instruction, PseudoInstruction):
+        return instruction
+    else:
+        return EncodedInstruction.from_instruction(instruction)
@@ -81,6 +81,15 @@ effect on the colorability of the graph.
 
 **Spilling**
 
+When no color can be found for a node, its registers are spilled: they
+are stored on the stack after each definition, and loaded from the stack
+before each use, using new short lived registers. The allocation is then
+repeated. Only the flow graph nodes around the spill code change, so the
+liveness and interference information is updated from there, instead of
+being analyzed again for the whole function. The number of spill rounds
+and the time spent on liveness and interference are recorded per
+function in the ``statistics`` of the allocator.
+
 **Iterated register coalescing**
 
 Iterated register coalescing (IRC) is a combination of graph coloring,
@@ -109,20 +118,23 @@ classes that possibly interfere.
 
 **Implementations**
 
-The following class can be used to perform register allocation.
+The following class can be used to perform register allocation. A faster
+alternative is the :mod:`ppci.codegen.linearscan` allocator.
 
 """
 
 import logging
-from functools import lru_cache
+import time
+from itertools import chain
 
 from ..arch.arch import Architecture, Frame
 from ..arch.registers import Register
+from ..utils.cache import TableCache
 from ..utils.collections import OrderedSet
 from ..utils.tree import Tree
 from .flowgraph import FlowGraph
 from .instructionselector import ContextInterface
-from .interferencegraph import InterferenceGraph
+from .interferencegraph import CompactInterferenceGraph, RegisterInterference
 
 
 class MiniCtx(ContextInterface):
@@ -191,7 +203,86 @@ class MiniGen:
         return offset_tree
 
 
-# TODO: implement linear scan allocator and other allocators!
+class RegisterClassTables:
+    """Register class information of an architecture.
+
+    These tables only depend on the architecture, and are shared by all
+    register allocators for the same architecture.
+    """
+
+    def __init__(self, arch: Architecture):
+        # A map with register alias info:
+        self.alias = arch.info.alias
+
+        # Register information:
+        # TODO: Improve different register classes
+        self.K = {}  # type: Dict[Register, int]
+        self.cls_regs = {}  # Mapping from class to register set
+        for reg_class in arch.info.register_classes:
+            kls, regs = reg_class.typ, reg_class.registers
+            self.K[kls] = len(regs)
+            self.cls_regs[kls] = OrderedSet(regs)
+
+        self._q = {}
+        self._common_reg_class = {}
+
+    def q(self, B, C) -> int:
+        """The number of class B registers that can be blocked by class C."""
+        if (B, C) not in self._q:
+            assert issubclass(B, Register)
+            assert issubclass(C, Register)
+            B_regs = self.cls_regs[B]
+            C_regs = self.cls_regs[C]
+            self._q[(B, C)] = max(len(self.alias[r] & B_regs) for r in C_regs)
+        return self._q[(B, C)]
+
+    def common_reg_class(self, u, v):
+        """Determine the smallest common register class of two classes"""
+        if (u, v) not in self._common_reg_class:
+            if issubclass(u, v):
+                cc = u
+            elif issubclass(v, u):
+                cc = v
+            else:
+                raise RuntimeError(
+                    f"Cannot determine common registerclass for {u} and {v}"
+                )
+            self._common_reg_class[(u, v)] = cc
+        return self._common_reg_class[(u, v)]
+
+
+_register_class_tables = TableCache()
+
+
+def get_register_class_tables(arch: Architecture) -> RegisterClassTables:
+    """Get the register class tables for the given architecture.
+
+    The tables are created once per process for each architecture and
+    set of architecture options.
+    """
+    key = (arch.__class__, arch.make_id_str())
+    return _register_class_tables.get(key, lambda: RegisterClassTables(arch))
+
+
+class AllocationStatistics:
+    """Register allocation statistics of a single function.
+
+    The build time is the time spent analyzing liveness and building
+    the interference information, in seconds.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.spill_rounds = 0
+        self.spilled_registers = 0
+        self.build_time = 0.0
+
+    def __repr__(self):
+        return (
+            f"{self.name}: {self.spill_rounds} spill rounds, "
+            f"{self.spilled_registers} spilled registers, "
+            f"build time {self.build_time:.3f}s"
+        )
 
 
 class GraphColoringRegisterAllocator:
@@ -204,27 +295,26 @@ class GraphColoringRegisterAllocator:
     logger = logging.getLogger("regalloc")
     verbose = False  # Set verbose to True to get more logging info
 
+    # The interference graph implementation. The InterferenceGraph with
+    # ordered sets of neighbours results in the same allocation:
+    interference_graph_class = CompactInterferenceGraph
+
     def __init__(self, arch: Architecture, instruction_selector, reporter):
         assert isinstance(arch, Architecture), arch
         self.arch = arch
         self.spill_gen = MiniGen(arch, instruction_selector)
         self.reporter = reporter
+        self.statistics = {}  # Statistics per function
 
-        # A map with register alias info:
-        self.alias = arch.info.alias
-
-        # Register information:
-        # TODO: Improve different register classes
-        self.K = {}  # type: Dict[Register, int]
-        self.cls_regs = {}  # Mapping from class to register set
-        for reg_class in self.arch.info.register_classes:
-            kls, regs = reg_class.typ, reg_class.registers
-            if self.verbose:
+        # Register class information, shared between allocators:
+        self.tables = get_register_class_tables(arch)
+        self.alias = self.tables.alias
+        self.K = self.tables.K
+        self.cls_regs = self.tables.cls_regs
+        if self.verbose:
+            for kls, regs in self.cls_regs.items():
                 self.logger.debug('Register class "%s" contains %s', kls, regs)
 
-            self.K[kls] = len(regs)
-            self.cls_regs[kls] = OrderedSet(regs)
-
     def alloc_frame(self, frame: Frame):
         """Do iterated register allocation for a single frame.
 
@@ -235,10 +325,16 @@ class GraphColoringRegisterAllocator:
             frame: The frame to perform register allocation on.
         """
         spill_rounds = 0
+        stats = AllocationStatistics(frame.name)
+        self.statistics[frame.name] = stats
 
         self.logger.debug("Starting iterative coloring")
+        interference = None
         while True:
-            self.init_data(frame)
+            start_time = time.perf_counter()
+            self.init_data(frame, interference)
+            interference = self.interference
+            stats.build_time += time.perf_counter() - start_time
 
             # Process all work lists:
             while True:
@@ -260,6 +356,7 @@ class GraphColoringRegisterAllocator:
             spilled_nodes = self.assign_colors()
             if spilled_nodes:
                 spill_rounds += 1
+                stats.spill_rounds = spill_rounds
 
                 self.logger.debug("Spilling round %s", spill_rounds)
                 max_spill_rounds = 30
@@ -269,8 +366,16 @@ class GraphColoringRegisterAllocator:
                     )
 
                 # Rewrite program now.
+                spilled = []
                 for node in spilled_nodes:
                     self.rewrite_program(node)
+                    spilled.extend(node.temps)
+                stats.spilled_registers += len(spilled)
+
+                # Only the code around the spilled registers changed:
+                start_time = time.perf_counter()
+                self.update_interference(spilled)
+                stats.build_time += time.perf_counter() - start_time
 
                 if self.verbose:
                     self.reporter.message("Rewrote program with spilling")
@@ -282,6 +387,20 @@ class GraphColoringRegisterAllocator:
 
         self.remove_redundant_moves()
         self.apply_colors()
+        self.logger.debug("%s", stats)
+
+    def update_interference(self, spilled):
+        """Update liveness and interference after spill code was
+        inserted for the given registers.
+        """
+        cfg = self.interference.flowgraph
+        nodes = cfg.update(self.frame.instructions, spilled)
+        self.interference.update(nodes, spilled)
+        self.logger.debug(
+            "Updated interference in %s of %s flowgraph nodes",
+            len(nodes),
+            len(cfg.nodes),
+        )
 
     def link_move(self, move):
         """Associate move with its source and destination"""
@@ -298,18 +417,28 @@ class GraphColoringRegisterAllocator:
         if move in dst.moves:
             dst.moves.remove(move)
 
-    def init_data(self, frame: Frame):
-        """Initialize data structures"""
+    def init_data(self, frame: Frame, interference=None):
+        """Initialize data structures.
+
+        When the register interference of the frame is given, the
+        interference graph is created from it, instead of analyzing
+        the code of the frame.
+        """
         self.frame = frame
 
-        cfg = FlowGraph(self.frame.instructions)
-        self.logger.debug(
-            "Constructed flowgraph with %s nodes", len(cfg.nodes)
-        )
+        if interference is None:
+            cfg = FlowGraph(self.frame.instructions)
+            self.logger.debug(
+                "Constructed flowgraph with %s nodes", len(cfg.nodes)
+            )
+
+            cfg.calculate_liveness()
+            interference = RegisterInterference(cfg)
 
-        cfg.calculate_liveness()
-        self.frame.ig = InterferenceGraph()
-        self.frame.ig.calculate_interference(cfg)
+        self.interference = interference
+        self.frame.cfg = interference.flowgraph
+        self.frame.ig = self.interference_graph_class()
+        self.frame.ig.add_interference(interference)
         self.logger.debug(
             "Constructed interferencegraph with %s nodes",
             len(self.frame.ig.nodes),
@@ -386,14 +515,9 @@ class GraphColoringRegisterAllocator:
 
         return False
 
-    @lru_cache(maxsize=None)
     def q(self, B, C) -> int:
         """The number of class B registers that can be blocked by class C."""
-        assert issubclass(B, Register)
-        assert issubclass(C, Register)
-        B_regs = self.cls_regs[B]
-        C_regs = self.cls_regs[C]
-        x = max(len(self.alias[r] & B_regs) for r in C_regs)
+        x = self.tables.q(B, C)
         if self.verbose:
             self.logger.debug(
                 "Class %s register can block max %s class %s register", C, x, B
@@ -469,7 +593,7 @@ class GraphColoringRegisterAllocator:
         """
         # This check was m.degree == self.K - 1
         if m in self.spill_worklist and self.is_colorable(m):
-            self.enable_moves({m} | m.adjecent)
+            self.enable_moves(chain(m.adjecent, (m,)))
             self.spill_worklist.remove(m)
             if self.is_move_related(m):
                 self.freeze_worklist.add(m)
@@ -557,7 +681,7 @@ class GraphColoringRegisterAllocator:
         many registers can be blocked by the remaining nodes. If this is
         less than the number of available registers, the coalesc is safe!
         """
-        nodes = u.adjecent | v.adjecent
+        nodes = OrderedSet(chain(u.adjecent, v.adjecent))
         B = self.common_reg_class(u.reg_class, v.reg_class)
         num_blocked = sum(
             self.q(B, j.reg_class) for j in nodes if not self.is_colorable(j)
@@ -613,18 +737,9 @@ class GraphColoringRegisterAllocator:
             self.freeze_worklist.remove(u)
             self.spill_worklist.add(u)
 
-    @lru_cache(maxsize=None)
     def common_reg_class(self, u, v):
         """Determine the smallest common register class of two nodes"""
-        if issubclass(u, v):
-            cc = u
-        elif issubclass(v, u):
-            cc = v
-        else:
-            raise RuntimeError(
-                f"Cannot determine common registerclass for {u} and {v}"
-            )
-
+        cc = self.tables.common_reg_class(u, v)
         if self.verbose:
             self.logger.debug("The common class of %s and %s is %s", u, v, cc)
 
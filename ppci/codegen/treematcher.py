@@ -1,3 +1,37 @@
+"""Tree matching support.
+
+The :class:`StateTable` labels trees using transition tables. The rules
+of a burg system are normalized, such that each rule matches a single
+terminal with only non terminals as children. Nested terminals in a
+pattern are replaced by internal non terminals. For example::
+
+    reg -> ADDI32(reg, CONSTI32)
+
+becomes::
+
+    reg -> ADDI32(reg, <CONSTI32>)
+    <CONSTI32> -> CONSTI32
+
+The state of a node is then fully determined by the name of the node,
+the states of its children and the outcome of the acceptance conditions
+of the rules. The costs in a state are stored relative to the cheapest
+non terminal, such that the amount of different states is finite.
+Computing the state of a node thus becomes a table lookup, like in
+the iburg and burg tools.
+
+The transitions are computed the first time a combination is
+encountered, and the tables can be saved to disk to be reused later.
+The tables are kept in memory only, unless a cache directory is given.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+
+
 class State:
     """State used to label tree nodes"""
 
@@ -50,3 +84,243 @@ class BaseMatcher:
             )
         ]
         return self.pat_f[rule](tree, *results)
+
+
+class _BaseRule:
+    """A normalized rule, which matches a single terminal."""
+
+    __slots__ = ("non_term", "child_nts", "rule")
+
+    def __init__(self, non_term, child_nts, rule):
+        self.non_term = non_term
+        self.child_nts = child_nts
+        self.rule = rule
+
+
+class StateTable:
+    """Table driven labeling of trees using the rules of a burg system"""
+
+    logger = logging.getLogger("treematcher")
+    version = 1
+
+    def __init__(self, system):
+        self.system = system
+        self.rules_for_root = {}
+        self.acceptance = {}
+        self.internal_non_terms = set()
+        for rule in system.rules:
+            if rule.tree.name in system.terminals:
+                child_nts = tuple(
+                    self._child_non_term(child) for child in rule.tree.children
+                )
+                self._add_base_rule(
+                    rule.tree.name, _BaseRule(rule.non_term, child_nts, rule)
+                )
+                if rule.acceptance:
+                    self.acceptance[rule.nr] = rule.acceptance
+
+        # The transition table maps the node name and the states of
+        # its children to a state, or to a tuple with the acceptance
+        # conditions to evaluate and a map from outcome to state:
+        self.transitions = {}
+        self.states = {}
+        self.modified = False
+
+        # The tables can be shared by threads. Lookups need no locking,
+        # but extending or saving the tables does:
+        self._lock = threading.RLock()
+
+    def _add_base_rule(self, name, base_rule):
+        self.rules_for_root.setdefault(name, []).append(base_rule)
+
+    def _child_non_term(self, tree):
+        """Get the non terminal to match a child pattern"""
+        if tree.name in self.system.non_terminals:
+            return tree.name
+
+        # Create an internal non terminal for a nested pattern:
+        non_term = f"<{tree}>"
+        if non_term not in self.internal_non_terms:
+            child_nts = tuple(
+                self._child_non_term(child) for child in tree.children
+            )
+            self.internal_non_terms.add(non_term)
+            base_rule = _BaseRule(non_term, child_nts, None)
+            self._add_base_rule(tree.name, base_rule)
+        return non_term
+
+    @property
+    def fingerprint(self):
+        """A hash of all information which determines the tables"""
+        h = hashlib.sha256()
+        h.update(f"version={self.version}".encode())
+        for rule in self.system.rules:
+            h.update(
+                f"{rule.nr}:{rule.non_term}:{rule.tree}:{rule.cost}:"
+                f"{rule.acceptance is not None}\n".encode()
+            )
+        return h.hexdigest()
+
+    def label(self, tree):
+        """Label all nodes in the tree bottom up"""
+        for child_tree in tree.children:
+            self.label(child_tree)
+
+        key = (tree.name,) + tuple(c.state for c in tree.children)
+        entry = self.transitions.get(key)
+        if entry is None:
+            entry = self._new_transition(key)
+
+        if entry.__class__ is State:
+            tree.state = entry
+        else:
+            rule_nrs, outcomes = entry
+            outcome = tuple(bool(self.acceptance[nr](tree)) for nr in rule_nrs)
+            state = outcomes.get(outcome)
+            if state is None:
+                state = self._new_outcome(key, rule_nrs, outcomes, outcome)
+            tree.state = state
+
+    def _matching_rules(self, name, kid_states):
+        """Get the rules which match given the states of the kids"""
+        for base_rule in self.rules_for_root.get(name, ()):
+            if all(
+                nt in state.labels
+                for state, nt in zip(kid_states, base_rule.child_nts)
+            ):
+                yield base_rule
+
+    def _new_transition(self, key):
+        with self._lock:
+            entry = self.transitions.get(key)
+            if entry is None:
+                name, kid_states = key[0], key[1:]
+                rule_nrs = tuple(
+                    base_rule.rule.nr
+                    for base_rule in self._matching_rules(name, kid_states)
+                    if base_rule.rule and base_rule.rule.acceptance
+                )
+                if rule_nrs:
+                    entry = (rule_nrs, {})
+                else:
+                    entry = self._calculate_state(name, kid_states, ())
+                self.transitions[key] = entry
+                self.modified = True
+        return entry
+
+    def _new_outcome(self, key, rule_nrs, outcomes, outcome):
+        with self._lock:
+            state = outcomes.get(outcome)
+            if state is None:
+                accepted = {nr for nr, x in zip(rule_nrs, outcome) if x}
+                state = self._calculate_state(key[0], key[1:], accepted)
+                outcomes[outcome] = state
+                self.modified = True
+        return state
+
+    def _calculate_state(self, name, kid_states, accepted):
+        """Calculate the state of a node using dynamic programming"""
+        labels = {}
+        for base_rule in self._matching_rules(name, kid_states):
+            rule = base_rule.rule
+            if rule and rule.acceptance and rule.nr not in accepted:
+                continue
+
+            cost = sum(
+                state.labels[nt][0]
+                for state, nt in zip(kid_states, base_rule.child_nts)
+            )
+            if rule:
+                self._mark(labels, rule, cost, set())
+            else:
+                self._set_cost(labels, base_rule.non_term, cost, None)
+
+        # Normalize costs:
+        if labels:
+            lowest = min(cost for cost, _ in labels.values())
+            labels = {
+                nt: (cost - lowest, rule)
+                for nt, (cost, rule) in labels.items()
+            }
+
+        # Re-use an equal state:
+        state_key = frozenset(labels.items())
+        if state_key not in self.states:
+            state = State()
+            state.labels = labels
+            self.states[state_key] = state
+        return self.states[state_key]
+
+    def _mark(self, labels, rule, cost, marked_rules):
+        cost = cost + rule.cost
+        self._set_cost(labels, rule.non_term, cost, rule.nr)
+        marked_rules.add(rule)
+
+        # Also set cost for chain rules here:
+        for cr in self.system.chain_rules_for_nt(rule.non_term):
+            if cr not in marked_rules:
+                self._mark(labels, cr, cost, marked_rules)
+
+    @staticmethod
+    def _set_cost(labels, goal, cost, rule):
+        if goal not in labels or labels[goal][0] > cost:
+            labels[goal] = (cost, rule)
+
+    def load(self, filename):
+        """Load previously calculated tables from file.
+
+        Returns True when the tables were loaded. The file is unpickled,
+        so it must come from a trusted location.
+        """
+        try:
+            with open(filename, "rb") as f:
+                data = pickle.load(f)
+        except (
+            OSError,
+            pickle.UnpicklingError,
+            EOFError,
+            AttributeError,
+        ) as ex:  # Missing, corrupt or incompatible file
+            self.logger.debug("Cannot load tables from %s: %s", filename, ex)
+            return False
+
+        if (
+            not isinstance(data, dict)
+            or data.get("fingerprint") != self.fingerprint
+        ):
+            return False
+
+        self.transitions = data["transitions"]
+        self.states = {
+            frozenset(state.labels.items()): state for state in data["states"]
+        }
+        self.modified = False
+        self.logger.debug(
+            "Loaded %s transitions from %s", len(self.transitions), filename
+        )
+        return True
+
+    def save(self, filename):
+        """Save the tables to file"""
+        with self._lock:
+            self._save(filename)
+
+    def _save(self, filename):
+        data = {
+            "fingerprint": self.fingerprint,
+            "states": list(self.states.values()),
+            "transitions": self.transitions,
+        }
+        directory = os.path.dirname(filename)
+        os.makedirs(directory, exist_ok=True)
+
+        # Write to a temporary file first, such that other processes
+        # never read a partially written file:
+        fd, tmp_filename = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, filename)
+        self.modified = False
+        self.logger.debug(
+            "Saved %s transitions to %s", len(self.transitions), filename
+        )
@@ -1,7 +1,15 @@
 """Graph algorithms module."""
 
+from .compact_graph import CompactGraph
 from .digraph import DiGraph, DiNode
 from .graph import Graph, Node
 from .maskable_graph import MaskableGraph
 
-__all__ = ("Graph", "Node", "DiGraph", "DiNode", "MaskableGraph")
+__all__ = (
+    "Graph",
+    "Node",
+    "DiGraph",
+    "DiNode",
+    "MaskableGraph",
+    "CompactGraph",
+)
@@ -0,0 +1,223 @@
+"""Maskable graph with array backed adjacency information.
+
+Nodes are numbered in the order in which they are added to the graph.
+The edges are stored in a triangular bit matrix, and the neighbours of
+each node are kept in an insertion ordered dictionary keyed by node
+number, such that a neighbour is removed in constant time when a node is
+masked. These dictionaries are kept in a list indexed by node number.
+"""
+
+from itertools import chain
+
+from ..utils.collections import OrderedSet
+from .graph import BaseGraph
+
+
+class CompactGraph(BaseGraph):
+    """A maskable graph storing its edges in a triangular bit matrix.
+
+    This graph behaves exactly like the
+    :class:`ppci.graph.maskable_graph.MaskableGraph`, including the order
+    in which the neighbours of a node are visited.
+    """
+
+    __slots__ = (
+        "_numbers",
+        "_node_list",
+        "_adjacent",
+        "_masked_adjacent",
+        "_masked",
+        "_matrix",
+    )
+
+    def __init__(self):
+        # The adjacency information is kept per node number, so the
+        # adj_map of the base graph is not used:
+        self.nodes = OrderedSet()
+        self._numbers = {}
+        self._node_list = []  # The nodes by number
+        self._adjacent = []  # Unmasked neighbours by node number
+        self._masked_adjacent = []  # Masked neighbours by node number
+        self._masked = bytearray()  # Masked flag by node number
+
+        # Bit i * (i - 1) // 2 + j is set when nodes i and j, with i > j,
+        # are connected by an edge:
+        self._matrix = bytearray()
+
+    def add_node(self, node):
+        """Add a node to the graph"""
+        if node not in self._numbers:
+            number = len(self._node_list)
+            self._numbers[node] = number
+            self._node_list.append(node)
+            self._adjacent.append({})
+            self._masked_adjacent.append({})
+            self._masked.append(0)
+            n_bytes = ((number + 1) * number // 2 + 7) // 8
+            self._matrix.extend(bytes(n_bytes - len(self._matrix)))
+        self.nodes.add(node)
+
+    @staticmethod
+    def _bit(i, j):
+        """Get the position in the bit matrix of the edge i - j"""
+        return i * (i - 1) // 2 + j if i > j else j * (j - 1) // 2 + i
+
+    def _test_bit(self, i, j):
+        bit = self._bit(i, j)
+        return self._matrix[bit >> 3] & (1 << (bit & 7))
+
+    def _set_bit(self, i, j):
+        bit = self._bit(i, j)
+        self._matrix[bit >> 3] |= 1 << (bit & 7)
+
+    def _clear_bit(self, i, j):
+        bit = self._bit(i, j)
+        self._matrix[bit >> 3] &= ~(1 << (bit & 7))
+
+    def set_adjacent(self, node, neighbours):
+        """Connect a node to the given neighbours.
+
+        The node may not have neighbours yet. This is a fast alternative
+        to adding the edges one by one, but each neighbour must be
+        connected to the node in the same way.
+        """
+        numbers = self._numbers
+        i = numbers[node]
+        assert not self._adjacent[i]
+        adjacent = self._adjacent[i] = dict.fromkeys(
+            numbers[n] for n in neighbours
+        )
+
+        # Set the bits of the row of this node, the bits of the other
+        # nodes are set when their neighbours are set:
+        matrix = self._matrix
+        row = i * (i - 1) // 2
+        for j in adjacent:
+            if j < i:
+                bit = row + j
+                matrix[bit >> 3] |= 1 << (bit & 7)
+
+    def del_node(self, node):
+        """Remove a node from the graph"""
+        for neighbour in self.adjecent(node):
+            self.del_edge(node, neighbour)
+        self.nodes.remove(node)
+
+    def add_edge(self, n, m):
+        """Add an edge between n and m"""
+        if n == m:
+            return
+        assert n in self.nodes
+        assert m in self.nodes
+        i = self._numbers[n]
+        j = self._numbers[m]
+        if not self._test_bit(i, j):
+            self._set_bit(i, j)
+            self._adjacent[i][j] = None
+            self._adjacent[j][i] = None
+
+    def del_edge(self, n, m):
+        """Delete edge between n and m"""
+        assert n != m
+        assert n in self.nodes
+        assert m in self.nodes
+        i = self._numbers[n]
+        j = self._numbers[m]
+        if self._test_bit(i, j):
+            self._clear_bit(i, j)
+            del self._adjacent[j][i]
+            del self._adjacent[i][j]
+
+    def has_edge(self, n, m):
+        """Test if there exists an edge between n and an unmasked node m"""
+        if n == m:
+            return False
+        j = self._numbers[m]
+        if self._masked[j]:
+            return False
+        return bool(self._test_bit(self._numbers[n], j))
+
+    def get_number_of_edges(self):
+        """Get the number of edges in this graph"""
+        n_edges = sum(self.get_degree(n) for n in self.nodes)
+        return n_edges // 2
+
+    def get_degree(self, node):
+        """Get the degree of a certain node"""
+        return len(self._adjacent[self._numbers[node]])
+
+    def adjecent(self, n):
+        """Return all unmasked nodes with edges to n"""
+        node_list = self._node_list
+        adjacent = self._adjacent[self._numbers[n]]
+        return tuple([node_list[j] for j in adjacent])
+
+    def mask_node(self, node):
+        """Add the node into the masked set"""
+        assert not self.is_masked(node)
+        i = self._numbers[node]
+        self._masked[i] = 1
+
+        # Update neighbour adjecency:
+        adjacent = self._adjacent
+        masked_adjacent = self._masked_adjacent
+        for j in chain(adjacent[i], masked_adjacent[i]):
+            del adjacent[j][i]
+            masked_adjacent[j][i] = None
+
+        self.nodes.remove(node)
+
+    def unmask_node(self, node):
+        """Unmask a node (put it back into the graph)"""
+        assert self.is_masked(node)
+        i = self._numbers[node]
+        self._masked[i] = 0
+        self.nodes.add(node)
+
+        # Restore connections:
+        adjacent = self._adjacent
+        masked_adjacent = self._masked_adjacent
+        for j in chain(adjacent[i], masked_adjacent[i]):
+            adjacent[j][i] = None
+            del masked_adjacent[j][i]
+
+    def is_masked(self, node):
+        """Test if a node is masked"""
+        return bool(self._masked[self._numbers[node]])
+
+    def combine(self, n, m):
+        """Merge nodes n and m into node n"""
+        assert n != m
+
+        # node m is going away, make sure to unmask it first:
+        if self.is_masked(m):
+            self.unmask_node(m)
+
+        # Move stored masked edges:
+        i = self._numbers[n]
+        j = self._numbers[m]
+        masked_n = self._masked_adjacent[i]
+        masked_m = self._masked_adjacent[j]
+        for k in masked_m:
+            # Move connection end 1:
+            neighbours = self._adjacent[k]
+            del neighbours[j]
+            self._clear_bit(j, k)
+
+            # Move connection end 2:
+            if not self._test_bit(i, k):
+                neighbours[i] = None
+                masked_n[k] = None
+                self._set_bit(i, k)
+        masked_m.clear()
+
+        assert not self.is_masked(n), "Combining only allowed for non-masked"
+
+        # Reroute all edges:
+        for a in self.adjecent(m):
+            self.del_edge(m, a)
+            self.add_edge(n, a)
+
+        # Remove node m:
+        assert self.get_degree(m) == 0  # Node should not have neighbours
+        self.del_node(m)
@@ -6,9 +6,11 @@ import logging
 import math
 import struct
 import time
+from functools import partial
 
 from ... import ir
-from ...graph import relooper
+from ...graph.cfg import ir_function_to_graph
+from .ranges import ValueRanges
 
 
 def literal_label(lit):
@@ -16,13 +18,25 @@ def literal_label(lit):
     return f"{lit.function.name}_{lit.name}"
 
 
-def ir_to_python(ir_modules, f, reporter=None, runtime=True):
-    """Convert ir-code to python code"""
+def ir_to_python(
+    ir_modules, f, reporter=None, runtime=True, checks=True, counters=False
+):
+    """Convert ir-code to python code.
+
+    When checks is False, the runtime does not assert that memory
+    accesses are within bounds. Negative addresses are still rejected,
+    since these would silently access the end of the stack. When counters
+    is True, the generated functions count their calls and loop
+    iterations in the counters of the runtime, and call the safe_point
+    method of the runtime every so many counts.
+    """
     if reporter:
         f2 = f
         f = io.StringIO()
 
-    generator = IrToPythonCompiler(f, reporter)
+    generator = IrToPythonCompiler(
+        f, reporter, checks=checks, counters=counters
+    )
     generator.header()
     if runtime:
         generator.generate_runtime()
@@ -37,22 +51,76 @@ def ir_to_python(ir_modules, f, reporter=None, runtime=True):
         reporter.dump_source("Python code", source_code)
 
 
-def irpy_runtime_code(f):
+def irpy_runtime_code(f, checks=True):
     """Generate irpy runtime."""
     reporter = None
-    generator = IrToPythonCompiler(f, reporter)
+    generator = IrToPythonCompiler(f, reporter, checks=checks)
     generator.header()
     generator.generate_runtime()
 
 
+class _Construct:
+    """A construct in the structured code, which continues at the loop
+    header or breaks to the follower block.
+
+    Constructs which are not wrapped in a while loop can only be left by
+    falling through to the follower.
+    """
+
+    __slots__ = ("header", "follower", "wrapped", "number", "exits")
+
+    def __init__(self, header, follower, wrapped, number):
+        self.header = header
+        self.follower = follower
+        self.wrapped = wrapped
+        self.number = number
+        self.exits = set()  # Exit codes of jumps through this construct
+
+
+class _BreakNeeded(Exception):
+    """Raised when a follower block must be wrapped in a while loop"""
+
+    def __init__(self, block):
+        super().__init__(block)
+        self.block = block
+
+
 class IrToPythonCompiler:
     """Can generate python script from ir-code"""
 
     logger = logging.getLogger("ir2py")
 
-    def __init__(self, output_file, reporter):
+    # Python limits the nesting of loops and the indentation of code:
+    max_nested_loops = 16
+    max_level = 80
+
+    # Counting functions call the safe point when the count is a multiple
+    # of 1024:
+    safe_point_mask = 0x3FF
+
+    # Addresses from here onwards are in the heap, below in the stack:
+    heap_start = 0x10000000
+
+    # Struct formats of the types which can be loaded and stored:
+    memory_formats = [
+        (ir.f64, "d"),
+        (ir.f32, "f"),
+        (ir.i64, "q"),
+        (ir.u64, "Q"),
+        (ir.i32, "i"),
+        (ir.u32, "I"),
+        (ir.ptr, "i"),
+        (ir.i16, "h"),
+        (ir.u16, "H"),
+        (ir.i8, "b"),
+        (ir.u8, "B"),
+    ]
+
+    def __init__(self, output_file, reporter, checks=True, counters=False):
         self.output_file = output_file
         self.reporter = reporter
+        self.checks = checks
+        self.counters = counters
         self.stack_size = 0
         self._level = 0
 
@@ -96,9 +164,17 @@ class IrToPythonCompiler:
         self.emit("import math")
         # self.emit("import irpyrt")
         self.emit("")
+
+        # Loads and stores use precompiled structs:
+        for ty, fmt in self.memory_formats:
+            name = f"_irpy_{ty.name}_struct"
+            self.emit(f'{name} = struct.Struct("{fmt}")')
+            self.emit(f"_irpy_unpack_{ty.name} = {name}.unpack_from")
+            self.emit(f"_irpy_pack_{ty.name} = {name}.pack_into")
+        self.emit("")
         self.emit("class IrPy:")
         self._indent()
-        self.emit("HEAP_START = 0x10000000")
+        self.emit(f"HEAP_START = {self.heap_start:#x}")
         with self.func_def("__init__(self):"):
             self.emit("self.heap = bytearray()")
             self.emit("self.stack = bytearray()")
@@ -106,6 +182,7 @@ class IrToPythonCompiler:
             self.emit("self.func_pointers.append(None)  # Null-entry")
             self.emit("self.f_ptrs_by_name = {}")
             self.emit("self.externals = {}")
+            self.emit("self.counters = {}")
 
         with self.func_def("clone(self):"):
             self.emit("x = IrPy()")
@@ -119,6 +196,11 @@ class IrToPythonCompiler:
             self.emit("self.f_ptrs_by_name[name] = idx")
             self.emit("self.externals[name] = f")
 
+        # Functions which count their calls and loop iterations call the
+        # safe point every so many counts:
+        with self.func_def("safe_point(self):"):
+            self.emit("pass")
+
         self.generate_builtins()
         self.generate_memory_builtins()
         self._dedent()
@@ -127,52 +209,57 @@ class IrToPythonCompiler:
     def generate_memory_builtins(self):
         with self.func_def("read_mem(self, address, size):"):
             self.emit("mem, address = self.get_memory(address)")
-            self.emit("assert address+size <= len(mem), str(hex(address))")
+            if self.checks:
+                self.emit("assert address+size <= len(mem), str(hex(address))")
             self.emit("return mem[address:address+size]")
 
         with self.func_def("write_mem(self, address, data):"):
             self.emit("mem, address = self.get_memory(address)")
             self.emit("size = len(data)")
-            self.emit("assert address+size <= len(mem), f'{hex(address)}'")
+            if self.checks:
+                self.emit("assert address+size <= len(mem), f'{hex(address)}'")
             self.emit("mem[address:address+size] = data")
 
         with self.func_def("get_memory(self, v):"):
-            self.emit("if v >= self.HEAP_START:")
+            self.emit(f"if v >= {self.heap_start:#x}:")
             with self.indented():
-                self.emit("return self.heap, v - self.HEAP_START")
-            self.emit("else:")
+                self.emit(f"return self.heap, v - {self.heap_start:#x}")
+            self.emit("elif v >= 0:")
             with self.indented():
                 self.emit("return self.stack, v")
+            self.emit("raise IndexError(hex(v))")
 
         with self.func_def("heap_top(self):"):
-            self.emit("return len(self.heap) + self.HEAP_START")
-
-        # Generate load functions:
-        foo = [
-            (ir.f64, "d", 8),
-            (ir.f32, "f", 4),
-            (ir.i64, "q", 8),
-            (ir.u64, "Q", 8),
-            (ir.i32, "i", 4),
-            (ir.u32, "I", 4),
-            (ir.ptr, "i", 4),
-            (ir.i16, "h", 2),
-            (ir.u16, "H", 2),
-            (ir.i8, "b", 1),
-            (ir.u8, "B", 1),
-        ]
-
-        for ty, fmt, size in foo:
-            assert struct.calcsize(fmt) == size
-            # Generate load helpers:
+            self.emit(f"return len(self.heap) + {self.heap_start:#x}")
+
+        # Generate load and store functions, which access the memory
+        # without copying it:
+        for ty, fmt in self.memory_formats:
+            size = struct.calcsize(fmt)
             with self.func_def(f"load_{ty.name}(self, address):"):
-                self.emit(f"data = self.read_mem(address, {size})")
-                self.emit(f'return struct.unpack("{fmt}", data)[0]')
+                self.emit_select_memory(size)
+                self.emit(f"return _irpy_unpack_{ty.name}(mem, address)[0]")
 
-            # Generate store helpers:
             with self.func_def(f"store_{ty.name}(self, address, value):"):
-                self.emit(f'data = struct.pack("{fmt}", value)')
-                self.emit("self.write_mem(address, data)")
+                self.emit_select_memory(size)
+                self.emit(f"_irpy_pack_{ty.name}(mem, address, value)")
+
+    def emit_select_memory(self, size):
+        """Emit code selecting the memory of an address"""
+        self.emit(f"if address >= {self.heap_start:#x}:")
+        with self.indented():
+            self.emit("mem = self.heap")
+            self.emit(f"address -= {self.heap_start:#x}")
+        self.emit("elif address >= 0:")
+        with self.indented():
+            self.emit("mem = self.stack")
+        self.emit("else:")
+        with self.indented():
+            self.emit("raise IndexError(hex(address))")
+        if self.checks:
+            self.emit(
+                f"assert 0 <= address <= len(mem) - {size}, str(hex(address))"
+            )
 
     def generate_builtins(self):
         # Wrap type helper:
@@ -227,9 +314,7 @@ class IrToPythonCompiler:
             self.emit("return (ptr, amount)")
 
         with self.func_def("free(self, amount):"):
-            self.emit("for _ in range(amount):")
-            with self.indented():
-                self.emit("self.stack.pop()")
+            self.emit("del self.stack[len(self.stack) - amount :]")
 
     def generate(self, ir_mod):
         """Write ir-code to file f"""
@@ -270,115 +355,470 @@ class IrToPythonCompiler:
 
     def generate_function(self, ir_function: ir.SubRoutine):
         """Generate a function to python code"""
-        self.stack_size = 0
         name = ir_function.name
         args = ",".join(a.name for a in ir_function.arguments)
+        self._cfg, self._block_map = ir_function_to_graph(ir_function)
+        self._ranges = ValueRanges(ir_function, self._cfg, self._block_map)
+        if self.counters:
+            # The number of calls and loop iterations of the function:
+            self.emit(f"rt.counters['{name}'] = [0, 0]")
         with self.func_def(f"{name}({args}):"):
-            # TODO: enable shape style:
-            # try:
-            #     # TODO: remove this to enable shape style:
-            #     raise ValueError
-            #     shape, _rmap = relooper.find_structure(ir_function)
-            #     src = io.StringIO()
-            #     relooper.print_shape(shape, file=src)
-            #     self.reporter.dump_source(ir_function.name, src.getvalue())
-            #     self._rmap = _rmap
-            #     self._shape_style = True
-            #     self.generate_shape(shape)
-            # except ValueError:
-            self.logger.debug("Falling back to block-switch-style")
-            # Fall back to block switch stack!
-            self._shape_style = False
-            self.generate_function_fallback(ir_function)
+            # The structured code is discarded when the control flow has
+            # no structure:
+            n_literals = len(self.literals)
+            try:
+                code = self.generate_body(
+                    self.generate_structured, ir_function
+                )
+            except ValueError as ex:
+                self.logger.debug("Falling back to block-switch-style: %s", ex)
+                del self.literals[n_literals:]
+                code = self.generate_body(
+                    self.generate_function_fallback, ir_function
+                )
+
+            # Bind the used runtime helpers to local variables:
+            for helper in sorted(self._runtime_helpers):
+                self.emit(f"{self.runtime(helper)} = rt.{helper}")
+            if self._exit_used:
+                self.emit("_irpy_exit = 0")
+            if self.counters:
+                self.emit(f"_irpy_counter = rt.counters['{name}']")
+                self.emit_count(0)
+            self.output_file.write(code)
 
         # Register function for function pointers:
         self.emit(f"rt.register_function('{name}', {name})")
         self.emit("")
 
-    def generate_shape(self, shape):
-        """Generate python code for a shape structured program"""
-        if isinstance(shape, relooper.BasicShape):
-            self.generate_block(self._rmap[shape.content])
-        elif isinstance(shape, relooper.SequenceShape):
-            if shape.shapes:
-                for sub_shape in shape.shapes:
-                    self.generate_shape(sub_shape)
+    def generate_body(self, generate, ir_function: ir.SubRoutine):
+        """Generate the body of a function into a string"""
+        output_file = self.output_file
+        level = self._level
+        self.output_file = io.StringIO()
+        self.stack_size = 0
+        self._runtime_helpers = set()
+        self._exit_used = False
+        try:
+            generate(ir_function)
+            return self.output_file.getvalue()
+        finally:
+            self.output_file = output_file
+            self._level = level
+
+    def runtime(self, helper: str):
+        """Get the local variable name of a runtime helper.
+
+        The helpers used by a function are looked up in the runtime
+        once, when the function is entered.
+        """
+        self._runtime_helpers.add(helper)
+        return f"_irpy_{helper}"
+
+    def generate_structured(self, ir_function: ir.SubRoutine):
+        """Generate python code with if and while statements.
+
+        This is the translation of reducible control flow from "Beyond
+        Relooper" by Norman Ramsey. Blocks are placed in the order of the
+        dominator tree. A loop header becomes a while loop, and the blocks
+        which are reached by several forward jumps or by leaving a loop
+        are placed after the code jumping to them.
+
+        Jumps to a loop header become continue statements. Jumps to a
+        block placed after the current code either fall through, or break
+        out of a while loop. When there is no such loop, a one-shot
+        ``while True`` loop is placed around the code. Jumps out of
+        several nested while loops assign the number of their destination
+        to ``_irpy_exit``, and break out of the loops one by one.
+        Irreducible control flow raises a ValueError.
+        """
+        cfg, block_map = self._cfg, self._block_map
+
+        # Children of the blocks in the dominator tree:
+        node_blocks = {node: block for block, node in block_map.items()}
+        self._dominated = {block: [] for block in block_map}
+        for block in ir_function.blocks:
+            if block in block_map:
+                idom = cfg.get_immediate_dominator(block_map[block])
+                if idom is not None:
+                    self._dominated[node_blocks[idom]].append(block)
+
+        # Jumps to blocks earlier in reverse postorder must be back edges:
+        self._order = self.reverse_postorder(ir_function.entry)
+        forward_jumps = {}
+        for block in self._order:
+            for target in block.successors:
+                if self._order[target] > self._order[block]:
+                    forward_jumps[target] = forward_jumps.get(target, 0) + 1
+                elif not self.dominates(target, block):
+                    raise ValueError("Irreducible control flow")
+
+        # Blocks which are placed after the code which jumps to them:
+        self._loops = self.find_loops(ir_function)
+        self._followers = {b for b, n in forward_jumps.items() if n > 1}
+        for header, body in self._loops.items():
+            self._followers.update(
+                b for b in self._dominated[header] if b not in body
+            )
+
+        self._constructs = []
+        self._wrapped = set()
+        self._placed = set()
+        self.generate_tree(ir_function.entry, None)
+
+    def reverse_postorder(self, entry):
+        """Number the blocks reachable from entry in reverse postorder"""
+        postorder = []
+        visited = {entry}
+        worklist = [(entry, iter(entry.successors))]
+        while worklist:
+            block, successors = worklist[-1]
+            for successor in successors:
+                if successor not in visited:
+                    visited.add(successor)
+                    worklist.append((successor, iter(successor.successors)))
+                    break
             else:
-                self.emit("pass")
-        elif isinstance(shape, relooper.IfShape):
-            blk = self._rmap[shape.content]
-            self.generate_block(blk)
-            with self.indented():
-                if shape.yes_shape:
-                    self.generate_shape(shape.yes_shape)
-                else:
-                    self.emit("pass")
-            if shape.no_shape:
-                self.emit("else:")
-                with self.indented():
-                    self.generate_shape(shape.no_shape)
-        elif isinstance(shape, relooper.LoopShape):
+                worklist.pop()
+                postorder.append(block)
+        return {block: n for n, block in enumerate(reversed(postorder))}
+
+    def dominates(self, one, other):
+        """Test if block one dominates block other"""
+        return self._cfg.dominates(
+            self._block_map[one], self._block_map[other]
+        )
+
+    def is_back_edge(self, block, target):
+        """Test if a jump from block to target is a back edge of a loop"""
+        block_map = self._block_map
+        return (
+            block in block_map
+            and target in block_map
+            and self.dominates(target, block)
+        )
+
+    def find_loops(self, ir_function):
+        """Find the natural loops, as a mapping from header to body"""
+        loops = {}
+        for block in ir_function.blocks:
+            if block not in self._block_map:
+                continue
+            for successor in block.successors:
+                if self.dominates(successor, block):
+                    # Back edge, collect the blocks reaching it:
+                    body = loops.setdefault(successor, {successor})
+                    worklist = [block]
+                    while worklist:
+                        member = worklist.pop()
+                        if member not in body:
+                            body.add(member)
+                            worklist.extend(
+                                p
+                                for p in member.predecessors
+                                if p in self._block_map
+                            )
+        return loops
+
+    def generate_tree(self, block, follow):
+        """Generate code for a block and the blocks it dominates.
+
+        Code falling through the end of the generated code continues at
+        the follow block.
+        """
+        while block is not None:
+            followers = sorted(
+                (b for b in self._dominated[block] if b in self._followers),
+                key=self._order.get,
+            )
+            if block in self._loops:
+                # The first block after the loop is reached by breaking
+                # out of the loop, the others are placed around the loop:
+                body = self._loops[block]
+                inside = [b for b in followers if b in body]
+                outside = [b for b in followers if b not in body]
+                loop_exit = outside.pop(0) if outside else None
+                generate = partial(
+                    self.generate_loop, block, inside, loop_exit
+                )
+                block = self.generate_followed(outside, generate, follow)
+            elif followers:
+                generate = partial(self.generate_structured_block, block)
+                block = self.generate_followed(followers, generate, follow)
+            else:
+                block = self.generate_structured_block(block, follow)
+
+    def generate_followed(self, followers, generate, follow):
+        """Generate code followed by the follower blocks.
+
+        The code generated by the generate function is placed innermost.
+        The followers are sorted in reverse postorder, the last one is
+        placed outermost. Returns the block with which the code continues.
+        """
+        if not followers:
+            return generate(follow)
+
+        follower = followers[-1]
+        if follower not in self._wrapped:
+            # Try to reach the follower by falling through:
+            state = self.save_state()
+            try:
+                with self.construct(None, follower, False):
+                    block = self.generate_followed(
+                        followers[:-1], generate, follower
+                    )
+                    self.generate_tree(block, follower)
+            except _BreakNeeded as ex:
+                if ex.block is not follower:
+                    raise
+                self.restore_state(state)
+                self._wrapped.add(follower)
+
+        if follower in self._wrapped:
             self.emit("while True:")
+            with self.indented(), self.construct(
+                None, follower, True
+            ) as construct:
+                block = self.generate_followed(followers[:-1], generate, None)
+                self.generate_tree(block, None)
+            self.emit_exit_checks(construct)
+        return follower
+
+    def generate_loop(self, header, followers, loop_exit, follow):
+        """Generate a while loop, returns the block after the loop"""
+        self.emit("while True:")
+        with self.indented():
+            if self.counters:
+                self.emit_count(1)
+            with self.construct(header, loop_exit, True) as construct:
+                generate = partial(self.generate_structured_block, header)
+                block = self.generate_followed(followers, generate, header)
+                self.generate_tree(block, header)
+        self.emit_exit_checks(construct)
+        return loop_exit
+
+    @contextlib.contextmanager
+    def construct(self, header, follower, wrapped):
+        """Place code in a construct, which continues at the header or
+        breaks to the follower block.
+        """
+        if wrapped:
+            n_loops = sum(c.wrapped for c in self._constructs)
+            if n_loops >= self.max_nested_loops:
+                raise ValueError("Too many nested loops")
+        construct = _Construct(
+            header, follower, wrapped, len(self._constructs) + 1
+        )
+        self._constructs.append(construct)
+        try:
+            yield construct
+        finally:
+            self._constructs.pop()
+
+    def save_state(self):
+        """Save the state of the generator to retry code generation"""
+        return (
+            self.output_file.tell(),
+            self._level,
+            len(self.literals),
+            self.stack_size,
+            set(self._runtime_helpers),
+            set(self._placed),
+            self._exit_used,
+            [set(c.exits) for c in self._constructs],
+        )
+
+    def restore_state(self, state):
+        """Discard the code generated since the state was saved"""
+        position, self._level, n_literals, self.stack_size = state[:4]
+        self._runtime_helpers, self._placed, self._exit_used = state[4:7]
+        for construct, exits in zip(self._constructs, state[7]):
+            construct.exits = exits
+        self.output_file.seek(position)
+        self.output_file.truncate()
+        del self.literals[n_literals:]
+
+    def generate_structured_block(self, block, follow):
+        """Generate code for a block, and the if statement ending it.
+
+        Returns the block to place after this block, if any.
+        """
+        if block in self._placed:
+            raise ValueError(f"Block {block.name} is reached twice")
+        if self._level > self.max_level:
+            raise ValueError("Code is nested too deep")
+        self._placed.add(block)
+
+        start = self.output_file.tell()
+        for ins in block.instructions[:-1]:
+            self.generate_instruction(ins, block)
+
+        last = block.last_instruction
+        if isinstance(last, ir.CJump):
+            a = self.fetch_value(last.a)
+            b = self.fetch_value(last.b)
+            self.emit(f"if {a} {last.cond} {b}:")
             with self.indented():
-                self.generate_shape(shape.body)
-        elif isinstance(shape, relooper.ContinueShape):
-            self.emit("continue")
-        elif isinstance(shape, relooper.BreakShape):
-            self.emit("break")
-        elif shape is None:
+                self.generate_branch(block, last.lab_yes, follow)
+            self.emit("else:")
+            with self.indented():
+                self.generate_branch(block, last.lab_no, follow)
+        elif isinstance(last, ir.Jump):
+            target = self.generate_jump(block, last.target, follow)
+            if target is not None:
+                return target
+        else:
+            self.generate_instruction(last, block)
+        if self.output_file.tell() == start:
+            self.emit("pass")
+
+    def generate_branch(self, block, target, follow):
+        """Generate code for one of the branches of an if statement"""
+        start = self.output_file.tell()
+        target = self.generate_jump(block, target, follow)
+        self.generate_tree(target, follow)
+        if self.output_file.tell() == start:
             self.emit("pass")
+
+    def generate_jump(self, block, target, follow):
+        """Generate code for the jump from block to target.
+
+        Returns the target when its code must be placed here.
+        """
+        self.fill_phis(block, [target])
+        if target is follow:
+            pass  # Fall through
+        elif self._order[target] <= self._order[block]:
+            self.goto(target, True)
+        elif target in self._followers:
+            self.goto(target, False)
+        else:
+            return target
+
+    def goto(self, target, is_continue):
+        """Emit a continue to a loop header, or a break to a follower"""
+        crossed = []
+        for construct in reversed(self._constructs):
+            if is_continue and construct.header is target:
+                break
+            elif not is_continue and construct.follower is target:
+                break
+            elif construct.wrapped:
+                crossed.append(construct)
         else:  # pragma: no cover
-            raise NotImplementedError(str(shape))
+            raise ValueError(f"Cannot jump to {target.name}")
+
+        if not construct.wrapped:
+            raise _BreakNeeded(target)
+        elif crossed:
+            # Break out of the crossed loops one by one. The exit code is
+            # the number of the construct to leave, or minus the number of
+            # the loop to continue:
+            code = -construct.number if is_continue else construct.number
+            self._exit_used = True
+            self.emit(f"_irpy_exit = {code}")
+            self.emit("break")
+            for crossed_construct in crossed:
+                crossed_construct.exits.add(code)
+        elif is_continue:
+            self.emit("continue")
+        else:
+            self.emit("break")
+
+    def emit_exit_checks(self, construct):
+        """Continue jumps out of several loops after the given loop"""
+        if not construct.exits:
+            return
+        enclosing = next(c for c in reversed(self._constructs) if c.wrapped)
+        own_codes = {enclosing.number: "break", -enclosing.number: "continue"}
+        keyword = "if"
+        for code, statement in own_codes.items():
+            if code in construct.exits:
+                self.emit(f"{keyword} _irpy_exit == {code}:")
+                with self.indented():
+                    self.emit("_irpy_exit = 0")
+                    self.emit(statement)
+                keyword = "elif"
+        if not construct.exits.issubset(own_codes):
+            self.emit(f"{keyword} _irpy_exit:")
+            with self.indented():
+                self.emit("break")
 
     def generate_function_fallback(self, ir_function: ir.SubRoutine):
         """Generate a while-true with a switch-case on current block.
 
-        This is a non-optimal, but always working strategy.
+        The blocks are numbered, and the current block is found by a
+        binary search over the numbers. This is a non-optimal, but always
+        working strategy.
         """
-        self.emit("_irpy_prev_block = None")
-        self.emit(f"_irpy_current_block = '{ir_function.entry.name}'")
+        self._block_numbers = {
+            block: number for number, block in enumerate(ir_function.blocks)
+        }
+        entry = self._block_numbers[ir_function.entry]
+        self.emit(f"_irpy_current_block = {entry}")
         self.emit("while True:")
         with self.indented():
-            for block in ir_function.blocks:
-                self.emit(f'if _irpy_current_block == "{block.name}":')
-                with self.indented():
-                    self.generate_block(block)
+            self.generate_block_switch(ir_function.blocks, 0)
         self.emit("")
 
+    def generate_block_switch(self, blocks, first: int):
+        """Generate code selecting the current block among blocks, which
+        are numbered from first onwards.
+        """
+        if len(blocks) == 1:
+            self.generate_block(blocks[0])
+        else:
+            half = len(blocks) // 2
+            self.emit(f"if _irpy_current_block < {first + half}:")
+            with self.indented():
+                self.generate_block_switch(blocks[:half], first)
+            self.emit("else:")
+            with self.indented():
+                self.generate_block_switch(blocks[half:], first + half)
+
     def generate_block(self, block):
         """Generate code for one block"""
         for ins in block:
             self.generate_instruction(ins, block)
+        self.fill_phis(block, block.successors)
 
-        if not self._shape_style:
-            self.fill_phis(block)
-
-    def fill_phis(self, block):
-        # Generate eventual phi fill code:
-        phis = [p for s in block.successors for p in s.phis]
+    def fill_phis(self, block, successors):
+        """Assign the phis of the successors for the jump from block"""
+        phis = [p for s in successors for p in s.phis]
         if phis:
             phi_names = ", ".join(p.name for p in phis)
             value_names = ", ".join(p.inputs[block].name for p in phis)
             self.emit(f"{phi_names} = {value_names}")
 
     def reset_stack(self):
-        self.emit(f"rt.free({self.stack_size})")
+        if self.stack_size:
+            self.emit(f"{self.runtime('free')}({self.stack_size})")
         self.stack_size = 0
 
-    def emit_jump(self, target: ir.Block):
+    def emit_count(self, index):
+        """Count a call or a loop iteration of the function"""
+        self.emit(f"_irpy_counter[{index}] += 1")
+        self.emit(f"if not _irpy_counter[{index}] & {self.safe_point_mask}:")
+        with self.indented():
+            self.emit("rt.safe_point()")
+
+    def emit_jump(self, target: ir.Block, block: ir.Block):
         """Perform a jump in block mode."""
         assert isinstance(target, ir.Block)
-        self.emit("_irpy_prev_block = _irpy_current_block")
-        self.emit(f'_irpy_current_block = "{target.name}"')
+        if self.counters and self.is_back_edge(block, target):
+            # Count the iterations of loops at their back edges:
+            self.emit_count(1)
+        self.emit(f"_irpy_current_block = {self._block_numbers[target]}")
 
     def generate_instruction(self, ins, block):
         """Generate python code for this instruction"""
         if isinstance(ins, ir.CJump):
-            self.gen_cjump(ins)
+            self.gen_cjump(ins, block)
         elif isinstance(ins, ir.Jump):
-            self.gen_jump(ins)
+            self.gen_jump(ins, block)
         elif isinstance(ins, ir.Alloc):
-            self.emit(f"{ins.name} = rt.alloca({ins.amount})")
+            alloca = self.runtime("alloca")
+            self.emit(f"{ins.name} = {alloca}({ins.amount})")
             self.stack_size += ins.amount
         elif isinstance(ins, ir.AddressOf):
             src = self.fetch_value(ins.src)
@@ -393,11 +833,8 @@ class IrToPythonCompiler:
             op = ins.operation
             a = self.fetch_value(ins.a)
             self.emit(f"{ins.name} = {op}{a}")
-            if ins.ty.is_integer:
-                self.emit(
-                    f"{ins.name} = rt.correct({ins.name}, {ins.ty.bits}, "
-                    + f"{ins.ty.signed})"
-                )
+            if ins.ty.is_integer and self._ranges.needs_wrap(ins):
+                self.emit_wrap(ins)
         elif isinstance(ins, ir.Binop):
             self.gen_binop(ins)
         elif isinstance(ins, ir.Cast):
@@ -428,35 +865,27 @@ class IrToPythonCompiler:
             self.emit(f"not implemented: {ins}")
             raise NotImplementedError(str(type(ins)))
 
-    def gen_cjump(self, ins):
+    def gen_cjump(self, ins, block):
         a = self.fetch_value(ins.a)
         b = self.fetch_value(ins.b)
-        if self._shape_style:
-            raise NotImplementedError("TODO")
-            # self.fill_phis(block)
-            self.emit(f"if {a} {ins.cond} {b}:")
-        else:
-            self.emit(f"if {a} {ins.cond} {b}:")
-            with self.indented():
-                self.emit_jump(ins.lab_yes)
-            self.emit("else:")
-            with self.indented():
-                self.emit_jump(ins.lab_no)
+        self.emit(f"if {a} {ins.cond} {b}:")
+        with self.indented():
+            self.emit_jump(ins.lab_yes, block)
+        self.emit("else:")
+        with self.indented():
+            self.emit_jump(ins.lab_no, block)
 
-    def gen_jump(self, ins):
-        if self._shape_style:
-            raise NotImplementedError("TODO")
-            # self.fill_phis(block)
-            self.emit("pass")
-        else:
-            self.emit_jump(ins.target)
+    def gen_jump(self, ins, block):
+        self.emit_jump(ins.target, block)
 
     def gen_cast(self, ins):
         if ins.ty.is_integer:
-            self.emit(
-                f"{ins.name} = rt.correct(int(round({ins.src.name})), "
-                + f"{ins.ty.bits}, {ins.ty.signed})"
-            )
+            if ins.src.ty.is_integer:
+                self.emit(f"{ins.name} = {ins.src.name}")
+            else:
+                self.emit(f"{ins.name} = int(round({ins.src.name}))")
+            if self._ranges.needs_wrap(ins):
+                self.emit_wrap(ins)
         elif ins.ty is ir.ptr:
             self.emit(f"{ins.name} = int(round({ins.src.name}))")
         elif ins.ty in [ir.f32, ir.f64]:
@@ -469,41 +898,59 @@ class IrToPythonCompiler:
         b = self.fetch_value(ins.b)
         # Assume int for now.
         op = ins.operation
-        int_ops = {"/": "rt.idiv", "%": "rt.irem"}
+        int_ops = {"/": "idiv", "%": "irem"}
 
-        shift_ops = {">>": "rt.ishr", "<<": "rt.ishl"}
+        shift_ops = {">>": "ishr", "<<": "ishl"}
 
         if op in int_ops and ins.ty.is_integer:
-            fname = int_ops[op]
+            fname = self.runtime(int_ops[op])
             self.emit(f"{ins.name} = {fname}({a}, {b})")
         elif op in shift_ops and ins.ty.is_integer:
-            fname = shift_ops[op]
+            fname = self.runtime(shift_ops[op])
             self.emit(f"{ins.name} = {fname}({a}, {b}, {ins.ty.bits})")
         else:
             self.emit(f"{ins.name} = {a} {op} {b}")
 
-        if ins.ty.is_integer:
-            bits = ins.ty.bits
-            signed = ins.ty.signed
-            self.emit(f"{ins.name} = rt.correct({ins.name}, {bits}, {signed})")
+        if ins.ty.is_integer and self._ranges.needs_wrap(ins):
+            self.emit_wrap(ins)
+
+    def emit_wrap(self, ins):
+        """Wrap an integer result around to the range of its type.
+
+        This is only required when the value range analysis shows that
+        the result can overflow.
+        """
+        mask = (1 << ins.ty.bits) - 1
+        if ins.ty.signed:
+            half = 1 << (ins.ty.bits - 1)
+            self.emit(
+                f"{ins.name} = (({ins.name} + {half:#x}) & {mask:#x})"
+                + f" - {half:#x}"
+            )
+        else:
+            self.emit(f"{ins.name} = {ins.name} & {mask:#x}")
 
     def gen_load(self, ins):
         address = self.fetch_value(ins.address)
         if isinstance(ins.ty, ir.BlobDataTyp):
-            self.emit(f"{ins.name} = rt.read_mem({address}, {ins.ty.size})")
+            read_mem = self.runtime("read_mem")
+            self.emit(f"{ins.name} = {read_mem}({address}, {ins.ty.size})")
         else:
-            self.emit(f"{ins.name} = rt.load_{ins.ty.name}({address})")
+            load = self.runtime(f"load_{ins.ty.name}")
+            self.emit(f"{ins.name} = {load}({address})")
 
     def gen_store(self, ins):
         address = ins.address.name
         if isinstance(ins.value.ty, ir.BlobDataTyp):
             self.emit(
-                f"rt.write_mem({address}, {ins.value.ty.size}, "
+                f"{self.runtime('write_mem')}({address}, "
+                + f"{ins.value.ty.size}, "
                 + f"{ins.value.name})"
             )
         else:
             value = self.fetch_value(ins.value)
-            self.emit(f"rt.store_{ins.value.ty.name}({address}, {value})")
+            store = self.runtime(f"store_{ins.value.ty.name}")
+            self.emit(f"{store}({address}, {value})")
 
     def gen_const(self, ins):
         if math.isinf(ins.value):
@@ -520,17 +967,17 @@ class IrToPythonCompiler:
         if isinstance(callee, ir.SubRoutine):
             expr = str(callee.name)
         elif isinstance(callee, ir.ExternalSubRoutine):
-            expr = f"rt.externals['{callee.name}']"
+            expr = f"{self.runtime('externals')}['{callee.name}']"
         else:
-            expr = f"rt.func_pointers[{callee.name}]"
+            expr = f"{self.runtime('func_pointers')}[{callee.name}]"
         return expr
 
     def fetch_value(self, value):
         if isinstance(value, (ir.SubRoutine, ir.ExternalSubRoutine)):
             # Function pointer!
-            expr = f"rt.f_ptrs_by_name['{value.name}']"
+            expr = f"{self.runtime('f_ptrs_by_name')}['{value.name}']"
         elif isinstance(value, ir.ExternalVariable):
-            expr = f"rt.externals['{value.name}']"
+            expr = f"{self.runtime('externals')}['{value.name}']"
         else:
             expr = value.name
         return expr
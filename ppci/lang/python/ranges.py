@@ -0,0 +1,278 @@
+"""Value range analysis of the integer values of an ir function.
+
+The python backend represents integers by python integers, which do not
+overflow. After each integer operation, the result must be wrapped
+around to the range of its type. This is not required when the range of
+the operands shows that the result cannot overflow.
+
+The range of each integer value is an interval of python integers. The
+ranges are determined by iterating over the function until they do not
+change anymore. Ranges which keep growing are widened to the range of
+their type, such that the iteration terminates.
+
+Within a block which is only reached by one edge of a conditional jump,
+the condition is known to hold. This narrows the ranges of the compared
+values, which for example shows that a loop counter cannot overflow when
+it is incremented.
+"""
+
+from ... import ir
+
+# The conditions which hold when a conditional jump is not taken:
+negated_conditions = {
+    "==": "!=",
+    "!=": "==",
+    "<": ">=",
+    ">=": "<",
+    ">": "<=",
+    "<=": ">",
+}
+
+
+def type_range(ty):
+    """Get the range of values of an integer type"""
+    if ty.signed:
+        half = 1 << (ty.bits - 1)
+        return (-half, half - 1)
+    else:
+        return (0, (1 << ty.bits) - 1)
+
+
+def within(value_range, ty):
+    """Test if a range is within the range of a type"""
+    if value_range is None:
+        return False
+    lo, hi = type_range(ty)
+    return lo <= value_range[0] and value_range[1] <= hi
+
+
+def join(one, other):
+    """Get the smallest range including two ranges"""
+    if one is None:
+        return other
+    elif other is None:
+        return one
+    else:
+        return (min(one[0], other[0]), max(one[1], other[1]))
+
+
+class ValueRanges:
+    """Ranges of the integer values of a function.
+
+    Args:
+        ir_function: the function to analyze.
+        cfg: the control flow graph of the function.
+        block_map: the nodes in the control flow graph of the blocks.
+    """
+
+    # Number of iterations after which changing ranges are widened:
+    widen_after = 3
+
+    def __init__(self, ir_function, cfg, block_map):
+        self.ranges = {}  # Ranges of the values
+        self.raw_ranges = {}  # Ranges of the results before wrapping
+        self.refined = {}  # Narrowed ranges per block
+        self.order = self.reverse_postorder(ir_function, block_map)
+        node_blocks = {node: block for block, node in block_map.items()}
+        self.idoms = {}
+        for block in self.order:
+            idom = cfg.get_immediate_dominator(block_map[block])
+            self.idoms[block] = node_blocks.get(idom)
+
+        iteration = 0
+        while self.update(iteration >= self.widen_after):
+            iteration += 1
+
+    @staticmethod
+    def reverse_postorder(ir_function, block_map):
+        """Order the reachable blocks such that blocks are preceded by
+        their dominators.
+        """
+        order = []
+        visited = {ir_function.entry}
+        stack = [(ir_function.entry, iter(ir_function.entry.successors))]
+        while stack:
+            block, successors = stack[-1]
+            for successor in successors:
+                if successor not in visited and successor in block_map:
+                    visited.add(successor)
+                    stack.append((successor, iter(successor.successors)))
+                    break
+            else:
+                stack.pop()
+                order.append(block)
+        order.reverse()
+        return order
+
+    def update(self, widen):
+        """Evaluate all values once, returns whether a range changed"""
+        changed = False
+        for block in self.order:
+            refined = self.refine(block)
+            self.refined[block] = refined
+            for ins in block:
+                if not (isinstance(ins, ir.Value) and ins.ty.is_integer):
+                    continue
+                raw = self.evaluate(ins, refined)
+                self.raw_ranges[ins] = raw
+                if not within(raw, ins.ty):
+                    raw = type_range(ins.ty)
+                old = self.ranges.get(ins)
+                new = join(old, raw)
+                if widen and old is not None and new != old:
+                    lo, hi = type_range(ins.ty)
+                    new = (
+                        lo if new[0] < old[0] else old[0],
+                        hi if new[1] > old[1] else old[1],
+                    )
+                if new != old:
+                    self.ranges[ins] = new
+                    changed = True
+        return changed
+
+    def refine(self, block):
+        """Determine the narrowed ranges which hold within a block"""
+        idom = self.idoms[block]
+        refined = self.refined.get(idom, {}) if idom else {}
+        predecessors = set(block.predecessors)
+        if len(predecessors) != 1:
+            return refined
+
+        (predecessor,) = predecessors
+        last = predecessor.last_instruction
+        if not isinstance(last, ir.CJump) or last.lab_yes is last.lab_no:
+            return refined
+        if not (last.a.ty.is_integer and last.b.ty.is_integer):
+            return refined
+
+        a = self.get_range(last.a, refined)
+        b = self.get_range(last.b, refined)
+        if a is None or b is None:
+            return refined
+
+        cond = last.cond
+        if block is last.lab_no:
+            cond = negated_conditions[cond]
+        if cond == "<":
+            a, b = (a[0], min(a[1], b[1] - 1)), (max(b[0], a[0] + 1), b[1])
+        elif cond == "<=":
+            a, b = (a[0], min(a[1], b[1])), (max(b[0], a[0]), b[1])
+        elif cond == ">":
+            a, b = (max(a[0], b[0] + 1), a[1]), (b[0], min(b[1], a[1] - 1))
+        elif cond == ">=":
+            a, b = (max(a[0], b[0]), a[1]), (b[0], min(b[1], a[1]))
+        elif cond == "==":
+            a = b = (max(a[0], b[0]), min(a[1], b[1]))
+        else:
+            return refined
+
+        refined = dict(refined)
+        for value, value_range in ((last.a, a), (last.b, b)):
+            # An empty range means that the block is never reached:
+            if value_range[0] <= value_range[1]:
+                refined[value] = value_range
+        return refined
+
+    def get_range(self, value, refined):
+        """Get the range of a value, narrowed by the given ranges"""
+        if value in refined:
+            return refined[value]
+        elif isinstance(value, ir.Const):
+            return (value.value, value.value)
+        elif value in self.ranges:
+            return self.ranges[value]
+        elif value.ty.is_integer and not isinstance(value, ir.Phi):
+            return type_range(value.ty)
+
+    def evaluate(self, ins, refined):
+        """Determine the range of the result of an instruction"""
+        if isinstance(ins, ir.Const):
+            return (ins.value, ins.value)
+        elif isinstance(ins, ir.Undefined):
+            return (0, 0)
+        elif isinstance(ins, ir.Phi):
+            value_range = None
+            for predecessor, value in ins.inputs.items():
+                if predecessor in self.refined:
+                    value_range = join(
+                        value_range,
+                        self.get_range(value, self.refined[predecessor]),
+                    )
+            return value_range
+        elif isinstance(ins, ir.Binop):
+            a = self.get_range(ins.a, refined)
+            b = self.get_range(ins.b, refined)
+            if a is None or b is None:
+                return None
+            return self.binop_range(ins.operation, a, b, ins.ty)
+        elif isinstance(ins, ir.Unop):
+            a = self.get_range(ins.a, refined)
+            if a is None:
+                return None
+            elif ins.operation == "-":
+                return (-a[1], -a[0])
+            else:
+                return (-a[1] - 1, -a[0] - 1)
+        elif isinstance(ins, ir.Cast):
+            if ins.src.ty.is_integer:
+                return self.get_range(ins.src, refined)
+        else:
+            return type_range(ins.ty)
+
+    @staticmethod
+    def binop_range(op, a, b, ty):
+        """Determine the range of the result of a binary operation.
+
+        Returns None when the range is not known.
+        """
+        if op == "+":
+            return (a[0] + b[0], a[1] + b[1])
+        elif op == "-":
+            return (a[0] - b[1], a[1] - b[0])
+        elif op == "*":
+            products = [x * y for x in a for y in b]
+            return (min(products), max(products))
+        elif op == "/":
+            # Division rounds towards zero:
+            largest = max(abs(a[0]), abs(a[1]))
+            if a[0] >= 0 and b[0] >= 0:
+                return (0, a[1])
+            return (-largest, largest)
+        elif op == "%":
+            # The remainder has the sign of the dividend:
+            largest = min(
+                max(abs(a[0]), abs(a[1])),
+                max(abs(b[0]), abs(b[1]), 1) - 1,
+            )
+            return (
+                -largest if a[0] < 0 else 0,
+                largest if a[1] > 0 else 0,
+            )
+        elif op == "<<":
+            if b[0] == b[1] and 0 <= b[0] < ty.bits:
+                return (a[0] << b[0], a[1] << b[0])
+        elif not (within(a, ty) and within(b, ty)):
+            # The bitwise operations below keep values in the range of
+            # their type:
+            return None
+        elif op == "&":
+            if a[0] >= 0 and b[0] >= 0:
+                return (0, min(a[1], b[1]))
+            elif a[0] >= 0:
+                return (0, a[1])
+            elif b[0] >= 0:
+                return (0, b[1])
+            return type_range(ty)
+        elif op in ("|", "^"):
+            if a[0] >= 0 and b[0] >= 0:
+                bits = max(a[1].bit_length(), b[1].bit_length())
+                return (0, (1 << bits) - 1)
+            return type_range(ty)
+        elif op == ">>":
+            return (min(a[0], 0), max(a[1], 0))
+
+    def needs_wrap(self, ins):
+        """Test if the result of an instruction must be wrapped around to
+        the range of its type.
+        """
+        return not within(self.raw_ranges.get(ins), ins.ty)
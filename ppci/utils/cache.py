@@ -0,0 +1,52 @@
+"""Caching of data which is expensive to calculate.
+
+Some tables, such as the instruction selection tables, are expensive to
+create. These tables are kept in memory in a :class:`TableCache`, such
+that they are created only once per process.
+
+The tables can also be cached in files between runs, by setting the
+``PPCI_CACHE_DIR`` environment variable to a cache directory. Nothing is
+written to disk when this variable is not set. The cached tables are
+pickled, and loading them can execute arbitrary code, so only use a
+directory which cannot be written by others.
+"""
+
+import os
+import threading
+
+
+def get_cache_dir():
+    """Get the cache directory, or None when caching is disabled."""
+    return os.environ.get("PPCI_CACHE_DIR") or None
+
+
+class TableCache:
+    """A thread safe, process wide cache of tables.
+
+    The tables are created on first use, by calling the given factory
+    function. Concurrent requests for the same table wait until it is
+    created, so that each table is created only once.
+    """
+
+    def __init__(self):
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        """Get the table for the given key, creating it if required"""
+        table = self._tables.get(key)
+        if table is None:
+            with self._lock:
+                table = self._tables.get(key)
+                if table is None:
+                    table = factory()
+                    self._tables[key] = table
+        return table
+
+    def clear(self):
+        """Remove all tables from the cache"""
+        with self._lock:
+            self._tables.clear()
+
+    def __len__(self):
+        return len(self._tables)
@@ -117,6 +117,9 @@ class Mod:
             elif isinstance(imp_obj, MemoryPage):
                 self._import_symbols.append((name, imp_obj))
                 extra_symbols[name] = imp_obj.addr
+            elif isinstance(imp_obj, int):
+                # The address of native code or data:
+                extra_symbols[name] = imp_obj
             else:
                 raise ValueError(
                     f"Cannot import {name} of type {type(imp_obj)}"
@@ -14,15 +14,16 @@ from collections.abc import MutableSet
 
 
 class OrderedSet(MutableSet):
-    """Set which retains order of elements"""
+    """Set which retains order of elements.
+
+    The elements are stored as keys of a dictionary, which retains the
+    insertion order.
+    """
+
+    __slots__ = ("_map",)
 
     def __init__(self, iterable=None):
-        end = []
-        end += [None, end, end]
-        self._end = end
-        self._map = {}  # key -> [key, prev, next]
-        if iterable is not None:
-            self |= iterable
+        self._map = {} if iterable is None else dict.fromkeys(iterable)
 
     def __len__(self):
         return len(self._map)
@@ -31,17 +32,26 @@ class OrderedSet(MutableSet):
         return key in self._map
 
     def add(self, value):
-        if value not in self._map:
-            end = self._end
-            curr = end[1]
-            curr[2] = end[1] = self._map[value] = [value, curr, end]
+        self._map[value] = None
 
     def discard(self, value):
         """Remove element from set"""
-        if value in self._map:
-            value, prev_item, next_item = self._map.pop(value)
-            prev_item[2] = next_item
-            next_item[1] = prev_item
+        self._map.pop(value, None)
+
+    def remove(self, value):
+        """Remove element from set, raise KeyError if it is not present"""
+        del self._map[value]
+
+    def pop(self):
+        """Remove and return the first element"""
+        if not self._map:
+            raise KeyError("pop from an empty set")
+        value = next(iter(self._map))
+        del self._map[value]
+        return value
+
+    def clear(self):
+        self._map.clear()
 
     def __getitem__(self, index):
         """O(n) implementation for lookups"""
@@ -50,18 +60,10 @@ class OrderedSet(MutableSet):
                 return key
 
     def __iter__(self):
-        end = self._end
-        curr = end[2]
-        while curr is not end:
-            yield curr[0]
-            curr = curr[2]
+        return iter(self._map)
 
     def __reversed__(self):
-        end = self._end
-        curr = end[2]
-        while curr is not end:
-            yield curr[0]
-            curr = curr[1]
+        return reversed(self._map)
 
     def __repr__(self):
         return f"{self.__class__.__name__}({list(self)!r})"
@@ -53,6 +53,100 @@ class MemoryPage:
         self.write(data)
 
 
+class ReservedMemory:
+    """A range of virtual memory of which the first part is usable.
+
+    The whole range is reserved up front, without using memory. The
+    usable part grows by committing more of the range. The address of
+    the memory therefore never changes, and the data is not copied when
+    the memory grows. Accessing the memory beyond the usable part
+    crashes the process.
+    """
+
+    def __init__(self, reserve_size, size=0):
+        reserve_size = max(round_up_page(reserve_size), mmap.PAGESIZE)
+        self.reserve_size = reserve_size
+        self.size = 0
+        if sys.platform == "win32":
+            self._space = WinSpace(reserve_size)
+        else:
+            self._space = PosixSpace(reserve_size)
+        self.addr = self._space.addr
+        logger.debug("Reserved %s bytes at 0x%x", reserve_size, self.addr)
+        self.commit(size)
+
+    def commit(self, size):
+        """Make the first size bytes of the memory usable"""
+        if size > self.reserve_size:
+            raise ValueError(f"Cannot commit more than {self.reserve_size}")
+        new_size = round_up_page(size)
+        if new_size > self.size:
+            self._space.commit(self.size, new_size - self.size)
+            self.size = new_size
+
+    def check_range(self, address, size):
+        if address < 0 or address + size > self.size:
+            raise IndexError(f"Access of {size} bytes at {address}")
+
+    def read(self, address, size) -> bytes:
+        self.check_range(address, size)
+        return ctypes.string_at(self.addr + address, size)
+
+    def write(self, address, data):
+        self.check_range(address, len(data))
+        ctypes.memmove(self.addr + address, bytes(data), len(data))
+
+    def view(self):
+        """Get a memoryview of the usable part of the memory"""
+        data = (ctypes.c_char * self.size).from_address(self.addr)
+        return memoryview(data).cast("B")
+
+
+def round_up_page(size):
+    """Round a size up to a whole number of pages of the host"""
+    return -(-size // mmap.PAGESIZE) * mmap.PAGESIZE
+
+
+class PosixSpace:
+    """Reserved address space on posix systems"""
+
+    def __init__(self, size):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._mmap = libc.mmap
+        self._mmap.argtypes = (
+            ctypes.c_void_p,
+            ctypes.c_size_t,
+            ctypes.c_int,
+            ctypes.c_int,
+            ctypes.c_int,
+            ctypes.c_long,
+        )
+        self._mmap.restype = ctypes.c_void_p
+        self._mprotect = libc.mprotect
+        self._mprotect.argtypes = (
+            ctypes.c_void_p,
+            ctypes.c_size_t,
+            ctypes.c_int,
+        )
+        self._munmap = libc.munmap
+        self._munmap.argtypes = (ctypes.c_void_p, ctypes.c_size_t)
+
+        flags = mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS
+        addr = self._mmap(None, size, 0, flags, -1, 0)
+        if addr in (None, ctypes.c_void_p(-1).value):
+            raise OSError(ctypes.get_errno(), "Cannot reserve memory")
+        self.addr = addr
+        self.size = size
+
+    def commit(self, offset, size):
+        prot = mmap.PROT_READ | mmap.PROT_WRITE
+        if self._mprotect(self.addr + offset, size, prot) != 0:
+            raise OSError(ctypes.get_errno(), "Cannot commit memory")
+
+    def __del__(self):
+        self._munmap(self.addr, self.size)
+
+
 uintt = ctypes.c_uint64 if struct.calcsize("P") == 8 else ctypes.c_uint32
 
 
@@ -93,3 +187,33 @@ class WinPage:
         vfree = kern.VirtualFree
         vfree.argtypes = (uintt,) * 3
         vfree(self.addr, self.size, 0x8000)
+
+
+class WinSpace:
+    """Reserved address space on windows"""
+
+    MEM_COMMIT = 0x1000
+    MEM_RESERVE = 0x2000
+    MEM_RELEASE = 0x8000
+    PAGE_NOACCESS = 0x1
+    PAGE_READWRITE = 0x4
+
+    def __init__(self, size):
+        kern = ctypes.windll.kernel32
+        self._valloc = kern.VirtualAlloc
+        self._valloc.argtypes = (uintt,) * 4
+        self._valloc.restype = uintt
+        self.addr = self._valloc(0, size, self.MEM_RESERVE, self.PAGE_NOACCESS)
+        if not self.addr:
+            raise OSError("Cannot reserve memory")
+
+    def commit(self, offset, size):
+        addr = self.addr + offset
+        if not self._valloc(addr, size, self.MEM_COMMIT, self.PAGE_READWRITE):
+            raise OSError("Cannot commit memory")
+
+    def __del__(self):
+        kern = ctypes.windll.kernel32
+        vfree = kern.VirtualFree
+        vfree.argtypes = (uintt,) * 3
+        vfree(self.addr, 0, self.MEM_RELEASE)
@@ -101,6 +101,14 @@ class ReportGenerator(abc.ABC):
     def dump_ig(self, ig):
         pass
 
+    @property
+    def collects_instructions(self):
+        """Whether the emitted instructions must be collected for
+        dump_instructions. Code generation can release the instructions
+        right after encoding them when this is not the case.
+        """
+        return True
+
     @abc.abstractmethod
     def dump_instructions(self, instructions, arch):
         """Print instructions"""
@@ -131,6 +139,10 @@ class DummyReportGenerator(ReportGenerator):
     def dump_trees(self, trees):
         pass
 
+    @property
+    def collects_instructions(self):
+        return False
+
     def dump_instructions(self, instructions, arch):
         pass
 
@@ -484,7 +496,12 @@ class HtmlReportGenerator(TextWritingReporter):
             for ur in used_regs:
                 self.print(f"<th>{ur}</th>")
             self.print("</tr>")
+            cfg = getattr(frame, "cfg", None)
             for idx, ins in enumerate(frame.instructions):
+                if cfg and cfg.has_instruction(ins):
+                    gen, kill, live_in, live_out = cfg.get_liveness(ins)
+                else:
+                    gen = kill = live_in = live_out = None
                 self.print("<tr>")
                 self.tcell(idx)
                 self.tcell(ins)
@@ -501,28 +518,15 @@ class HtmlReportGenerator(TextWritingReporter):
                     self.print("yes", end="")
                 self.print("</td>")
 
-                self.print("<td>", end="")
-                if hasattr(ins, "gen"):
-                    self.print(str2(ins.gen), end="")
-                self.print("</td>")
-
-                self.print("<td>", end="")
-                if hasattr(ins, "kill"):
-                    self.print(str2(ins.kill), end="")
-                self.print("</td>")
-
-                self.print("<td>", end="")
-                if hasattr(ins, "live_in"):
-                    self.print(str2(ins.live_in), end="")
-                self.print("</td>")
+                for regs in (gen, kill, live_in, live_out):
+                    self.print("<td>", end="")
+                    if regs is not None:
+                        self.print(str2(regs), end="")
+                    self.print("</td>")
 
-                self.print("<td>", end="")
-                if hasattr(ins, "live_out"):
-                    self.print(str2(ins.live_out), end="")
-                self.print("</td>")
                 for ur in used_regs:
                     self.print("<td>")
-                    for r2 in ins.live_out:
+                    for r2 in live_out or ():
                         if r2.color == ur.color:
                             self.print(r2.name)
                     self.print("</td>")
@@ -3,11 +3,15 @@
 import logging
 import struct
 from contextlib import contextmanager
-from io import BytesIO
 
-from ...utils.leb128 import signed_leb128_decode, unsigned_leb128_decode
 from .. import components
-from ..components import DEFINITION_CLASSES, SECTION_IDS, Instruction, Ref
+from ..components import (
+    DEFINITION_CLASSES,
+    SECTION_IDS,
+    BlockInstruction,
+    Instruction,
+    Ref,
+)
 from ..opcodes import OPERANDS, REVERZ, ArgType
 from .io import LANG_TYPES_REVERSE
 
@@ -19,12 +23,22 @@ class BinaryDecodingError(Exception):
 
 
 class BinaryFileReader:
-    """Reader which can read binary wasm."""
+    """Reader which can read binary wasm.
+
+    The whole binary is kept in a single memoryview, in which the reader
+    moves a position. Sections and function bodies are read as regions
+    of this view, such that no data is copied.
+
+    The instructions of a function body are only decoded when they are
+    used. Loading a module to inspect its imports and exports, or to
+    write it out again, does not decode instructions at all.
+    """
 
     def __init__(self, f):
-        self._f = [f]
-        self._buffer = bytes()
+        data = f.read() if hasattr(f, "read") else f
+        self._data = memoryview(data)
         self._pos = 0
+        self._end = len(self._data)
 
         self._section_id_to_name = {}
         for name, id in SECTION_IDS.items():
@@ -52,14 +66,9 @@ class BinaryFileReader:
 
         # Read sections that contain definitions
         self._definitions = []
-        while True:
-            try:
-                section_id = self.read_byte()
-            except EOFError:
-                break
-
-            section_data = self.read_length_prefixed_bytes()
-            with self.push_data(section_data):
+        while self._pos < self._end:
+            section_id = self.read_byte()
+            with self.push_region(self.read_uint()):
                 self.read_section(section_id)
 
         logger.info(
@@ -128,63 +137,111 @@ class BinaryFileReader:
         }
         return mp[cls]()
 
-    def read_exactly(self, amount=None):
-        if amount is not None and amount < 0:
+    def read_view(self, amount=None):
+        """Read a number of bytes as a view on the binary data.
+
+        When no amount is given, the rest of the current region is read.
+        """
+        pos = self._pos
+        if amount is None:
+            end = self._end
+        elif amount < 0:
             raise ValueError(f"Cannot read {amount} bytes")
-        data = self._f[-1].read(amount)
-        if amount is not None and len(data) != amount:
-            raise EOFError("Reading beyond end of file")
-        return data
+        else:
+            end = pos + amount
+            if end > self._end:
+                raise EOFError("Reading beyond end of file")
+        self._pos = end
+        return self._data[pos:end]
+
+    def read_exactly(self, amount=None):
+        return bytes(self.read_view(amount))
 
     @contextmanager
-    def push_data(self, data: bytes):
-        """Process the given data first."""
-        self._f.append(BytesIO(data))
+    def push_region(self, size):
+        """Read the next size bytes as a separate region.
+
+        All data in the region must be read within the context.
+        """
+        end = self._pos + size
+        if end > self._end:
+            raise EOFError("Reading beyond end of file")
+        outer_end = self._end
+        self._end = end
         yield
-        f = self._f.pop()
-        remaining = f.read()
-        assert len(remaining) == 0, str(remaining)
+        remaining = self._data[self._pos : end]
+        assert len(remaining) == 0, str(bytes(remaining))
+        self._end = outer_end
 
     def read_fmt(self, fmt):
         """Read data according to the given format."""
         size = struct.calcsize(fmt)
-        data = self.read_exactly(size)
+        data = self.read_view(size)
         return struct.unpack(fmt, data)[0]
 
-    def bytefile(self, f):
-        b = f.read(1)
-        while b:
-            yield b[0]
-            b = f.read(1)
-
-    def __next__(self):
-        b = self.read_exactly(1)
-        return b[0]
-
     def read_byte(self):
         """Read the value of a single byte"""
-        data = self.read_exactly(1)
-        return data[0]
+        pos = self._pos
+        if pos >= self._end:
+            raise EOFError("Reading beyond end of file")
+        self._pos = pos + 1
+        return self._data[pos]
 
     def read_int(self):
         """Read variable size signed int"""
-        return signed_leb128_decode(self)
+        data = self._data
+        pos = self._pos
+        result = 0
+        shift = 0
+        while True:
+            if pos >= self._end:
+                raise EOFError("Reading beyond end of file")
+            byte = data[pos]
+            pos += 1
+            result |= (byte & 0x7F) << shift
+            shift += 7
+            if byte < 0x80:
+                break
+        self._pos = pos
+        if byte & 0x40:  # Sign extend
+            result -= 1 << shift
+        return result
 
     def read_uint(self):
         """Read variable size unsigned integer"""
-        return unsigned_leb128_decode(self)
+        data = self._data
+        pos = self._pos
+        if pos < self._end:
+            # Most numbers fit in a single byte:
+            byte = data[pos]
+            if byte < 0x80:
+                self._pos = pos + 1
+                return byte
+        result = 0
+        shift = 0
+        while True:
+            if pos >= self._end:
+                raise EOFError("Reading beyond end of file")
+            byte = data[pos]
+            pos += 1
+            result |= (byte & 0x7F) << shift
+            shift += 7
+            if byte < 0x80:
+                break
+        self._pos = pos
+        return result
 
     def read_f32(self) -> float:
         """Read a single f32 value"""
-        return self.read_fmt("f")
+        return f32_struct.unpack(self.read_view(4))[0]
 
     def read_f64(self) -> float:
         """Read a single f64 value"""
-        return self.read_fmt("d")
+        return f64_struct.unpack(self.read_view(8))[0]
 
     def read_u32(self) -> int:
         """Read a single u32 value"""
-        return self.read_fmt("<I")
+        return u32_struct.unpack(self.read_view(4))[0]
 
     def read_length_prefixed_bytes(self) -> bytes:
         """Read length prefixed raw bytes data"""
@@ -193,8 +250,8 @@ class BinaryFileReader:
 
     def read_str(self):
         """Read a string"""
-        data = self.read_length_prefixed_bytes()
-        return data.decode("utf-8")
+        amount = self.read_uint()
+        return str(self.read_view(amount), "utf-8")
 
     def read_type(self):
         """Read a wasm type"""
@@ -229,63 +286,43 @@ class BinaryFileReader:
         """Read instructions until an end marker is found"""
         expr = []
         blocks = 1
-        i = self.read_instruction()
-        # keep track of if/block/loop etc:
-        if i.opcode == "end":
-            blocks -= 1
-        elif i.opcode in ("if", "block", "loop"):
-            blocks += 1
-        expr.append(i)
-        while blocks:
-            i = self.read_instruction()
-            # print(i)
-            if i.opcode == "end":
+        read_instruction = self.read_instruction
+        while True:
+            i = read_instruction()
+            # keep track of if/block/loop etc:
+            opcode = i.opcode
+            if opcode == "end":
                 blocks -= 1
-            elif i.opcode in ("if", "block", "loop"):
+                if not blocks:
+                    break
+            elif opcode in ("if", "block", "loop"):
                 blocks += 1
             expr.append(i)
 
-        # Strip of last end opcode:
-        assert expr[-1].opcode == "end"
-        return expr[:-1]
+        # The last end opcode is left out:
+        return expr
 
     def read_instruction(self):
         """Read a single instruction"""
-        binopcode = self.read_byte()
+        pos = self._pos
+        if pos >= self._end:
+            raise EOFError("Reading beyond end of file")
+        self._pos = pos + 1
+        binopcode = self._data[pos]
         if binopcode == 0xFC or binopcode == 0xFD:
             opcode2 = self.read_uint()
             binopcode = (binopcode, opcode2)
-        opcode = REVERZ[binopcode]
-        operands = OPERANDS[opcode]
-        # print(opcode, type, operands)
-        args = []
-        for operand in operands:
-            if operand in rfm:
-                arg = rfm[operand](self)
-            elif operand == "br_table":
-                count = self.read_uint()
-                vec = []
-                for _ in range(count + 1):
-                    idx = self.read_space_ref("label")
-                    vec.append(idx)
-                arg = vec
-            elif operand == "result_types":
-                if binopcode == 0x1C:
-                    count = self.read_uint()
-                    vec = [self.read_type() for _ in range(count)]
-                else:
-                    vec = []
-                arg = vec
-            else:  # pragma: no cover
-                raise NotImplementedError(operand)
-            args.append(arg)
-        args = tuple(args)
-
-        block_types = ("block", "loop", "if")
-        if opcode in block_types:
-            instruction = components.BlockInstruction(opcode, *args)
-        else:
-            instruction = Instruction(opcode, *args)
+        try:
+            cls, opcode, readers = decoders[binopcode]
+        except KeyError:
+            raise BinaryDecodingError(f"Invalid opcode {binopcode}") from None
+
+        # Fill the slots directly, the arguments are known to be valid:
+        instruction = object.__new__(cls)
+        instruction.opcode = opcode
+        instruction.args = tuple([read(self) for read in readers])
+        if cls is BlockInstruction:
+            instruction.id = None
         return instruction
 
     def read_type_definition(self):
@@ -388,24 +425,25 @@ class BinaryFileReader:
         return definition
 
     def read_func_definition(self, index) -> components.Func:
-        """Read a function with locals and instructions."""
-        # First read on the function body block:
-        body_data = self.read_length_prefixed_bytes()
+        """Read a function with locals and instructions.
 
-        with self.push_data(body_data):
+        The instructions are decoded when they are first accessed.
+        """
+        # First read on the function body block:
+        with self.push_region(self.read_uint()):
             num_local_pairs = self.read_uint()
             localz = []
             for _ in range(num_local_pairs):
                 c = self.read_uint()
                 t = self.read_type()
                 localz.extend([(None, t)] * c)
-            instructions = self.read_expression()
+            body = self.read_exactly()
 
         # Function type ref:
         ref = Ref("type", index=self._type4func[index])
 
         id = self.gen_id("func")
-        func = components.Func(id, ref, localz, instructions)
+        func = components.Func(id, ref, localz, body)
         self.add_definition("func", func)
         return func
 
@@ -438,20 +476,90 @@ class BinaryFileReader:
         return components.Custom(name, data)
 
 
+def read_instructions(body):
+    """Decode the binary instructions of a function body.
+
+    The body must end with an end instruction, which is left out.
+    """
+    reader = BinaryFileReader(body)
+    instructions = reader.read_expression()
+    if reader._pos != reader._end:
+        raise BinaryDecodingError("Unexpected data after function body")
+    return instructions
+
+
+def read_br_table(reader):
+    count = reader.read_uint()
+    return [reader.read_space_ref("label") for _ in range(count + 1)]
+
+
+def read_result_types(reader):
+    count = reader.read_uint()
+    return [reader.read_type() for _ in range(count)]
+
+
+def read_no_result_types(reader):
+    return []
+
+
+f32_struct = struct.Struct("<f")
+f64_struct = struct.Struct("<d")
+u32_struct = struct.Struct("<I")
+
 # This is a list of functions to read specific argument types:
 rfm = {
-    ArgType.TYPE: lambda reader: reader.read_type(),
-    ArgType.U8: lambda reader: reader.read_byte(),
-    ArgType.U32: lambda reader: reader.read_uint(),
+    ArgType.TYPE: BinaryFileReader.read_type,
+    ArgType.U8: BinaryFileReader.read_byte,
+    ArgType.U32: BinaryFileReader.read_uint,
     ArgType.LABELIDX: lambda reader: reader.read_space_ref("label"),
     ArgType.LOCALIDX: lambda reader: reader.read_space_ref("local"),
     ArgType.GLOBALIDX: lambda reader: reader.read_space_ref("global"),
     ArgType.FUNCIDX: lambda reader: reader.read_space_ref("func"),
     ArgType.TYPEIDX: lambda reader: reader.read_space_ref("type"),
     ArgType.TABLEIDX: lambda reader: reader.read_space_ref("table"),
-    ArgType.I32: lambda reader: reader.read_int(),
-    ArgType.I64: lambda reader: reader.read_int(),
-    ArgType.F32: lambda reader: reader.read_f32(),
-    ArgType.F64: lambda reader: reader.read_f64(),
+    ArgType.I32: BinaryFileReader.read_int,
+    ArgType.I64: BinaryFileReader.read_int,
+    ArgType.F32: BinaryFileReader.read_f32,
+    ArgType.F64: BinaryFileReader.read_f64,
     ArgType.U8x16: lambda reader: reader.read_exactly(16),
+    "br_table": read_br_table,
 }
+
+
+def make_operand_reader(operand):
+    """Get the function to read an operand of which the type is not
+    supported.
+    """
+
+    def read_operand(reader):  # pragma: no cover
+        raise NotImplementedError(operand)
+
+    return read_operand
+
+
+def make_decoders():
+    """Determine the instruction class, the opcode and the functions to
+    read the operands of each binary opcode.
+    """
+    table = {}
+    for binopcode, opcode in REVERZ.items():
+        readers = []
+        for operand in OPERANDS[opcode]:
+            if operand == "result_types":
+                if binopcode == 0x1C:
+                    readers.append(read_result_types)
+                else:
+                    readers.append(read_no_result_types)
+            elif operand in rfm:
+                readers.append(rfm[operand])
+            else:
+                readers.append(make_operand_reader(operand))
+        if opcode in ("block", "loop", "if"):
+            cls = BlockInstruction
+        else:
+            cls = Instruction
+        table[binopcode] = (cls, opcode, tuple(readers))
+    return table
+
+
+decoders = make_decoders()
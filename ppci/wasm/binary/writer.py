@@ -334,10 +334,13 @@ class BinaryFileWriter(BaseIoWriter):
             f3.write_vu32(count)  # number of locals of this type
             f3.write_type(loc_type)
 
-        # Instructions:
-        for instruction in func.instructions:
-            f3.write_instruction(instruction)
-        f3.write(b"\x0b")  # end
+        # Instructions, which are copied when they were not decoded:
+        if func.encoded_instructions is None:
+            for instruction in func.instructions:
+                f3.write_instruction(instruction)
+            f3.write(b"\x0b")  # end
+        else:
+            f3.write(func.encoded_instructions)
         body = f3.f.getvalue()
         self.write_vu32(len(body))  # number of bytes in body
         self.write(body)
@@ -697,32 +697,62 @@ class Func(Definition):
     * ref: the reference to the type (i.e. signature).
     * locals: a list of ($id, typ) tuples. The id can be None to indicate
       implicit id's (note that the id is offset by the parameters).
-    * instructions: a list of instructions (may be given as tuples).
+    * instructions: a list of instructions (may be given as tuples), or
+      the binary encoded instructions, which are decoded when they are
+      first accessed.
 
     """
 
     # todo: force local ids to be either int or str?
 
-    __slots__ = ("id", "ref", "locals", "instructions")  # ref to type
+    __slots__ = ("id", "ref", "locals", "_instructions", "_encoded")
 
     def _from_args(self, id, ref, locals, instructions):
         if not isinstance(ref, Ref):
             raise TypeError("ref must be of type Ref")
         assert isinstance(locals, (tuple, list))
-        assert isinstance(instructions, (tuple, list))
+        assert isinstance(instructions, (tuple, list, bytes))
         assert all(isinstance(el, tuple) and len(el) == 2 for el in locals)
         self.id = check_id(id)
         self.ref = ref
         self.locals = tuple(locals)
+        if isinstance(instructions, bytes):
+            self._instructions = None
+            self._encoded = instructions
+        else:
+            self.instructions = instructions
+
+    def __getitem__(self, i):
+        return (self.id, self.ref, self.locals, self.instructions)[i]
+
+    @property
+    def instructions(self):
+        if self._instructions is None:
+            from .binary.reader import read_instructions
+
+            self._instructions = read_instructions(self._encoded)
+            self._encoded = None
+        return self._instructions
+
+    @instructions.setter
+    def instructions(self, instructions):
         # Parse instructions
         if instructions and isinstance(instructions[0], Instruction):
-            self.instructions = instructions  # assume all are instructions
+            self._instructions = instructions  # assume all are instructions
         else:
             blocktypes = ("block", "loop", "if")
-            self.instructions = [
+            self._instructions = [
                 (BlockInstruction if i[0] in blocktypes else Instruction)(*i)
                 for i in instructions
             ]
+        self._encoded = None
+
+    @property
+    def encoded_instructions(self):
+        """The binary encoded instructions, including the final end
+        instruction, or None when the instructions are decoded.
+        """
+        return self._encoded
 
     def __repr__(self):
         return f"<WASM-Func {self.id}>"
@@ -22,6 +22,13 @@ class ModuleInstance(abc.ABC):
     def invoke(self, name, *args):
         raise NotImplementedError()
 
+    @property
+    def counters(self):
+        """The number of calls and loop iterations per function, for
+        instances which count them.
+        """
+        return {}
+
     def table_grow(self, table_idx: int, val: int, size: int) -> int:
         logger.debug(f"table_grow({table_idx=}, {size=}, {val=})")
         if size < 0:
@@ -332,6 +339,14 @@ class MemoryInstance(abc.ABC):
     def read(self, address, size):
         raise NotImplementedError()
 
+    @abc.abstractmethod
+    def view(self):
+        """Get a memoryview of the memory.
+
+        The view must be released before the memory grows.
+        """
+        raise NotImplementedError()
+
 
 class GlobalInstance(abc.ABC):
     """Base class for an exported wasm global."""
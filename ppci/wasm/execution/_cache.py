@@ -0,0 +1,171 @@
+"""Cache of compiled wasm modules.
+
+Compiling a wasm module to native or python code takes much longer than
+loading the result, so compiled modules can be stored in a directory
+between runs. The entries are named after a hash of everything which
+determines the compiled code: the binary wasm module, the target, the
+ppci version and the compilation options. Changing any of these gives
+a new entry, so entries never need to be updated.
+
+Entries which cannot be loaded, for example because they were written
+by an incompatible python version, are removed and compiled again. The
+total size of the cache is bounded by removing the least recently used
+entries.
+
+The entries are pickled, and loading a pickle can execute arbitrary
+code. The cache directory must therefore be trusted, and must not be
+writable by other users.
+"""
+
+import contextlib
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import tempfile
+
+from ... import __version__
+
+
+class ModuleCache:
+    """A directory with compiled wasm modules.
+
+    Args:
+        directory: the directory in which the entries are stored. Only
+            use a directory which cannot be written by untrusted users.
+        max_size: the maximum total size of the entries in bytes.
+    """
+
+    logger = logging.getLogger("wasm-cache")
+    version = 1
+    prefix = "wasm-"
+    suffix = ".pickle"
+    max_size = 256 * 1024 * 1024
+
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        if max_size is not None:
+            self.max_size = max_size
+
+    def make_key(self, module, target, **options):
+        """Determine the key of the compiled code of a wasm module"""
+        h = hashlib.sha256()
+        h.update(module.to_bytes())
+        parts = [
+            target,
+            __version__,
+            str(self.version),
+            sys.implementation.cache_tag or "",
+        ]
+        parts.extend(f"{k}={options[k]!r}" for k in sorted(options))
+        for part in parts:
+            h.update(b"\0")
+            h.update(part.encode("utf-8"))
+        return h.hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.directory, self.prefix + key + self.suffix)
+
+    def load(self, key):
+        """Load the entry with the given key.
+
+        Returns None when there is no usable entry.
+        """
+        filename = self.filename(key)
+        try:
+            with open(filename, "rb") as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (
+            OSError,
+            pickle.UnpicklingError,
+            EOFError,
+            AttributeError,
+            ImportError,
+            ValueError,
+        ) as ex:  # Corrupt or incompatible entry
+            self.logger.warning("Removing unusable %s: %s", filename, ex)
+            self.remove(filename)
+            return None
+
+        if not isinstance(entry, dict) or entry.get("key") != key:
+            self.logger.warning("Removing mismatching %s", filename)
+            self.remove(filename)
+            return None
+
+        # Mark the entry as recently used:
+        with contextlib.suppress(OSError):
+            os.utime(filename)
+        self.logger.info("Loaded compiled module from %s", filename)
+        return entry["data"]
+
+    def save(self, key, data):
+        """Store an entry and remove old entries when the cache is full"""
+        filename = self.filename(key)
+        entry = {"key": key, "data": data}
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+
+            # Write to a temporary file first, such that other processes
+            # never read a partially written entry:
+            fd, tmp_filename = tempfile.mkstemp(
+                dir=self.directory, suffix=".tmp"
+            )
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_filename, filename)
+            except BaseException:
+                self.remove(tmp_filename)
+                raise
+        except OSError as ex:
+            self.logger.warning("Could not save %s: %s", filename, ex)
+            return
+        self.logger.info("Saved compiled module to %s", filename)
+        self.evict(keep=filename)
+
+    def entries(self):
+        """Get the filenames, sizes and last use times of the entries"""
+        result = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return result
+        for name in names:
+            if name.startswith(self.prefix) and name.endswith(self.suffix):
+                filename = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(filename)
+                except OSError:  # Removed by another process
+                    continue
+                result.append((filename, stat.st_size, stat.st_mtime))
+        return result
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until the total size
+        is at most the maximum size.
+
+        The entry with the given filename is kept, even when it is larger
+        than the maximum size by itself.
+        """
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        for filename, size, _ in entries:
+            if total <= self.max_size:
+                break
+            if filename != keep:
+                self.logger.debug("Evicting %s", filename)
+                self.remove(filename)
+                total -= size
+
+    def clear(self):
+        """Remove all entries"""
+        for filename, _, _ in self.entries():
+            self.remove(filename)
+
+    @staticmethod
+    def remove(filename):
+        with contextlib.suppress(OSError):
+            os.remove(filename)
@@ -7,18 +7,28 @@ The wasm runtime contains the following:
 - Implement function like sqrt, floor, bit rotations etc..
 """
 
+import warnings
+
 from ...utils.reporting import DummyReportGenerator
 from ..components import Import
 from ._base_instance import ModuleInstance
+from ._cache import ModuleCache
 from ._native_instance import native_instantiate
 from ._python_instance import python_instantiate
+from ._tiered_instance import tiered_instantiate
 from .runtime import create_runtime
 
 __all__ = ("instantiate",)
 
 
 def instantiate(
-    module, imports=None, target="native", reporter=None, cache_file=None
+    module,
+    imports=None,
+    target="native",
+    reporter=None,
+    cache_file=None,
+    cache_dir=None,
+    memory_checks=None,
 ) -> ModuleInstance:
     """Instantiate a wasm module.
 
@@ -28,8 +38,21 @@ def instantiate(
         target: Use 'native' to compile wasm to machine code.
                 Use 'python' to generate python code. This option is slower
                 but more reliable.
+                Use 'tiered' to start with python code, and to switch to
+                machine code when the module is used a lot.
         reporter: A reporter which can record detailed compilation information.
-        cache_file: a file to use as cache
+        cache_file: deprecated and ignored, use cache_dir instead.
+        cache_dir: a directory in which compiled modules are kept between
+                   runs. The compiled code is loaded from this directory
+                   when the same module was compiled before. The compiled
+                   code is stored as pickles, so this directory must be
+                   trusted.
+        memory_checks: how native code checks memory accesses. Use None
+                       for no checks, 'explicit' to compare each address
+                       with the memory size, or 'guard' to catch accesses
+                       beyond the memory with guard pages. Out of bounds
+                       accesses raise a WasmTrapException when checked.
+                       Python code always checks memory accesses.
 
     """
     if imports is None:
@@ -38,6 +61,13 @@ def instantiate(
     if reporter is None:
         reporter = DummyReportGenerator()
 
+    if cache_file is not None:
+        warnings.warn(
+            "The cache_file argument is ignored, use cache_dir instead",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+
     reporter.heading(2, "Wasm instantiation")
 
     if "wasm_rt" in imports:
@@ -60,10 +90,18 @@ def instantiate(
     for func_name, func in create_runtime().items():
         symbols[f"wasm_rt_{func_name}"] = func
 
+    cache = ModuleCache(cache_dir) if cache_dir else None
+
     if target == "native":
-        instance = native_instantiate(module, symbols, reporter, cache_file)
+        instance = native_instantiate(
+            module, symbols, reporter, cache, memory_checks
+        )
     elif target == "python":
-        instance = python_instantiate(module, symbols, reporter, cache_file)
+        instance = python_instantiate(module, symbols, reporter, cache)
+    elif target == "tiered":
+        instance = tiered_instantiate(
+            module, symbols, reporter, cache, memory_checks
+        )
     else:
         raise ValueError(f"Unknown instantiation target {target}")
 
@@ -1,11 +1,11 @@
 """Instantiate wasm as native code."""
 
 import logging
-import os
-import shelve
 
+from ...binutils.objectfile import deserialize
 from ...irutils import verify_module
 from ...utils.codepage import MemoryPage, load_obj
+from ...utils.memory_page import ReservedMemory
 from ..components import Table
 from ..util import PAGE_SIZE
 from ..wasm2ppci import wasm_to_ir
@@ -16,31 +16,38 @@ from ._base_instance import (
     ModuleInstance,
     TableInstance,
 )
+from ._traps import get_trap_handler
 
 logger = logging.getLogger("instantiate")
 
 
-def native_instantiate(module, imports, reporter, cache_file):
+def native_instantiate(module, imports, reporter, cache, memory_checks=None):
     """Load wasm module native"""
     from ...api import get_current_arch, ir_to_object
 
     logger.info("Instantiating wasm module as native code")
     arch = get_current_arch()
-    # key = (arch, module)
-    # TODO: think of clever caching trickery:
-    cache_file = None
-    if cache_file and os.path.exists(cache_file):
-        logger.info("Using cached object from %s", cache_file)
-        with shelve.open(cache_file) as s:
-            obj = s["obj"]
-            ppci_module = s["ppci_module"]
+    trap_handler = get_trap_handler() if memory_checks else None
+    if cache:
+        key = cache.make_key(
+            module,
+            "native",
+            arch=arch.make_id_str(),
+            memory_checks=memory_checks,
+        )
+        data = cache.load(key)
+    else:
+        data = None
+
+    if data:
+        obj = deserialize(data["obj"])
+        wasm_info = data["wasm_info"]
     else:
-        # TODO: use cache here to short circuit re-compilation
-        # hash(key)
-        # print(hash(key))
-        # hgkfdg
         ppci_module = wasm_to_ir(
-            module, arch.info.get_type_info("ptr"), reporter=reporter
+            module,
+            arch.info.get_type_info("ptr"),
+            reporter=reporter,
+            memory_checks=memory_checks,
         )
         verify_module(ppci_module)
 
@@ -49,20 +56,28 @@ def native_instantiate(module, imports, reporter, cache_file):
         # optimize(ppci_module, level=2, reporter=reporter)
 
         obj = ir_to_object([ppci_module], arch, debug=True, reporter=reporter)
-        if cache_file:
-            logger.info("Saving object to %s for later use", cache_file)
-            with shelve.open(cache_file) as s:
-                s["obj"] = obj
-                s["ppci_module"] = ppci_module
-    instance = NativeModuleInstance(obj, imports, ppci_module._wasm_info)
+        wasm_info = ppci_module._wasm_info
+        if cache:
+            cache.save(key, {"obj": obj.serialize(), "wasm_info": wasm_info})
+    instance = NativeModuleInstance(
+        obj, imports, wasm_info, memory_checks, trap_handler
+    )
     return instance
 
 
 class NativeModuleInstance(ModuleInstance):
-    """Wasm module loaded as natively compiled code"""
+    """Wasm module loaded as natively compiled code.
 
-    def __init__(self, obj, imports2, wasm_info):
+    With memory checks, calls into the module go through the trap
+    handler, which raises traps of the native code as exceptions.
+    """
+
+    def __init__(
+        self, obj, imports2, wasm_info, memory_checks=None, trap_handler=None
+    ):
         super().__init__(wasm_info)
+        self._memory_checks = memory_checks
+        self._trap_handler = trap_handler
         imports = {}
 
         imports["wasm_rt_table_grow"] = self.table_grow
@@ -78,6 +93,9 @@ class NativeModuleInstance(ModuleInstance):
         imports["wasm_rt_memory_copy"] = self.memory_copy
         imports["wasm_rt_memory_fill"] = self.memory_fill
 
+        if trap_handler:
+            imports["wasm_rt_trap"] = trap_handler.trap_address
+
         for name, imp_obj in imports2.items():
             assert name not in imports
             if isinstance(imp_obj, Table):
@@ -99,9 +117,23 @@ class NativeModuleInstance(ModuleInstance):
         self._code_module = load_obj(obj, imports=imports)
 
     def invoke(self, name, *args):
-        f = getattr(self._code_module, name)
+        f = self._get_function(name)
         f(*args)
 
+    def _get_function(self, name):
+        function = getattr(self._code_module, name)
+        if self._trap_handler:
+            function = NativeTrappingFunction(self, function)
+        return function
+
+    def get_memory_range(self):
+        """Get the reserved address range of the memory"""
+        if self._memories:
+            memory = self._memories[0]._memory
+            return (memory.addr, memory.addr + memory.reserve_size)
+        else:
+            return (0, 0)
+
     def memory_create(self, min_size, max_size):
         assert len(self._memories) == 0
         mem0 = NativeMemoryInstance(self, min_size, max_size)
@@ -129,33 +161,63 @@ class NativeModuleInstance(ModuleInstance):
         # TODO: too many assumptions made here ...
         self._code_module._data_page.write_fmt(baseptr, "Q", base_addr)
 
+    def set_mem_size(self, size):
+        """Set the memory size in bytes, which is checked by the code"""
+        if self._memory_checks == "explicit":
+            offset = self._code_module.get_symbol_offset("wasm_mem0_size")
+            self._code_module._data_page.write_fmt(offset, "Q", size)
+
     def get_func_by_index(self, index: int):
         exported_name = self._wasm_info.function_names[index]
-        return getattr(self._code_module, exported_name)
+        return self._get_function(exported_name)
 
     def create_global(self, index: int):
         ty, name = self._wasm_info.global_names[index]
         return NativeGlobalInstance(ty, name, self._code_module)
 
 
+class NativeTrappingFunction:
+    """A native function which raises the traps of the wasm code"""
+
+    def __init__(self, instance, function):
+        self._instance = instance
+        self._function = function
+        self._trampoline = instance._trap_handler.wrap(function)
+
+    def __call__(self, *args):
+        instance = self._instance
+        return instance._trap_handler.call(
+            self._trampoline,
+            self._function,
+            args,
+            instance.get_memory_range(),
+        )
+
+
 class NativeMemoryInstance(MemoryInstance):
-    """Native wasm memory emulation"""
+    """Native wasm memory emulation.
+
+    The address space for the maximum size of the memory is reserved up
+    front, such that the memory grows in place.
+
+    With guard pages, the reserved address space covers every address
+    wasm code can access: a 32 bit address plus a 32 bit offset. The
+    address space beyond the memory faults when it is accessed.
+    """
 
     def __init__(self, instance, min_size, max_size):
         super().__init__(min_size, max_size)
         self._instance = instance
-        self._memory_data_page = MemoryPage(min_size * PAGE_SIZE)
-        self._instance.set_mem_base_ptr(self._memory_data_page.addr)
+        if instance._memory_checks == "guard":
+            reserve_size = 2 * 0x100000000 + PAGE_SIZE
+        else:
+            reserve_size = min(max_size, 0x10000) * PAGE_SIZE
+        self._memory = ReservedMemory(reserve_size, min_size * PAGE_SIZE)
+        self._instance.set_mem_base_ptr(self._memory.addr)
+        self._instance.set_mem_size(self._memory.size)
 
     def grow(self, amount: int) -> int:
-        """Grow memory and return the old size.
-
-        Current strategy:
-        - claim new memory
-        - copy all data
-        - free old memory
-        - update wasm memory base pointer
-        """
+        """Grow memory and return the old size"""
         max_size = self.max_size
         old_size = self.size()
         new_size = old_size + amount
@@ -167,34 +229,26 @@ class NativeMemoryInstance(MemoryInstance):
         if max_size is not None and new_size > max_size:
             return -1
 
-        # Read old data:
-        self._memory_data_page.seek(0)
-        old_data = self._memory_data_page.read(old_size * PAGE_SIZE)
-
-        # Create new page and fill with old data:
-        self._memory_data_page = MemoryPage(new_size * PAGE_SIZE)
-        self._memory_data_page.seek(0)
-        self._memory_data_page.write(old_data)
-
-        # Update pointer:
-        self._instance.set_mem_base_ptr(self._memory_data_page.addr)
+        self._memory.commit(new_size * PAGE_SIZE)
+        self._instance.set_mem_size(self._memory.size)
         return old_size
 
     def size(self) -> int:
         """return memory size in pages"""
-        return self._memory_data_page.size // PAGE_SIZE
+        return self._memory.size // PAGE_SIZE
 
     def write(self, address: int, data: bytes):
         """Write some data to memory"""
-        self._memory_data_page.seek(address)
-        self._memory_data_page.write(data)
+        self._memory.write(address, data)
 
     def read(self, address: int, size: int) -> bytes:
-        self._memory_data_page.seek(address)
-        data = self._memory_data_page.read(size)
+        data = self._memory.read(address, size)
         assert len(data) == size
         return data
 
+    def view(self):
+        return self._memory.view()
+
 
 class NativeGlobalInstance(GlobalInstance):
     def __init__(self, ty, name, code_obj):
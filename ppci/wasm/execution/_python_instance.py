@@ -2,6 +2,7 @@
 
 import io
 import logging
+import marshal
 from types import ModuleType
 
 from ... import ir
@@ -45,29 +46,58 @@ def get_irpy_rt() -> ModuleType:
 
 
 def python_instantiate(
-    module, imports, reporter, cache_file
+    module, imports, reporter, cache, counters=False
 ) -> "PythonModuleInstance":
-    """Load wasm module as a PythonModuleInstance"""
-    from ...api import ir_to_python
+    """Load wasm module as a PythonModuleInstance.
 
+    When counters is True, the functions count their calls and loop
+    iterations.
+    """
     logger.info("Instantiating wasm module as python")
-    ptr_info = TypeInfo(4, 4)
-    ppci_module = wasm_to_ir(module, ptr_info, reporter=reporter)
-    verify_module(ppci_module)
-    f = io.StringIO()
-    ir_to_python([ppci_module], f, reporter=reporter, runtime=False)
-    pysrc = f.getvalue()
-    pycode = compile(pysrc, "<string>", "exec")
+    if cache:
+        key = cache.make_key(module, "python", counters=counters)
+        data = cache.load(key)
+    else:
+        data = None
+
+    if data:
+        pycode = marshal.loads(data["code"])
+        wasm_info = data["wasm_info"]
+    else:
+        pycode, wasm_info = compile_python(module, reporter, counters)
+        if cache:
+            code = marshal.dumps(pycode)
+            cache.save(key, {"code": code, "wasm_info": wasm_info})
+
     py_module = ModuleType("gen")
     rt_module = get_irpy_rt()
     rt = rt_module.rt.clone()
     py_module.rt = rt
     exec(pycode, py_module.__dict__)
 
-    instance = PythonModuleInstance(py_module, imports, ppci_module._wasm_info)
+    instance = PythonModuleInstance(py_module, imports, wasm_info)
     return instance
 
 
+def compile_python(module, reporter, counters=False):
+    """Compile a wasm module into a python code object.
+
+    Returns the code object and the information about the wasm module.
+    """
+    from ...api import ir_to_python
+
+    ptr_info = TypeInfo(4, 4)
+    ppci_module = wasm_to_ir(module, ptr_info, reporter=reporter)
+    verify_module(ppci_module)
+    f = io.StringIO()
+    ir_to_python(
+        [ppci_module], f, reporter=reporter, runtime=False, counters=counters
+    )
+    pysrc = f.getvalue()
+    pycode = compile(pysrc, "<string>", "exec")
+    return pycode, ppci_module._wasm_info
+
+
 class PythonModuleInstance(ModuleInstance):
     """Wasm module loaded a generated python module"""
 
@@ -189,6 +219,13 @@ class PythonModuleInstance(ModuleInstance):
         ty, name = self._wasm_info.global_names[index]
         return PythonGlobalInstance(ty, name, self)
 
+    @property
+    def counters(self):
+        """The number of calls and loop iterations per function, when the
+        functions count them.
+        """
+        return self._py_module.rt.counters
+
     def load_i32(self, address: int) -> int:
         return self._py_module.rt.load_i32(address)
 
@@ -252,6 +289,10 @@ class PythonMemoryInstance(MemoryInstance):
         assert len(data) == size
         return data
 
+    def view(self):
+        rt = self._module._py_module.rt
+        return memoryview(rt.heap)[self._mem0_start - rt.HEAP_START :]
+
 
 # TODO: we might implement the descriptor protocol in some way?
 class PythonGlobalInstance(GlobalInstance):
@@ -268,6 +309,8 @@ class PythonGlobalInstance(GlobalInstance):
         mp = {
             ir.i32: self.instance.load_i32,
             ir.i64: self.instance.load_i64,
+            ir.f32: self.instance._py_module.rt.load_f32,
+            ir.f64: self.instance._py_module.rt.load_f64,
         }
         f = mp[self.ty]
         return f(address)
@@ -277,6 +320,8 @@ class PythonGlobalInstance(GlobalInstance):
         mp = {
             ir.i32: self.instance.store_i32,
             ir.i64: self.instance.store_i64,
+            ir.f32: self.instance._py_module.rt.store_f32,
+            ir.f64: self.instance._py_module.rt.store_f64,
         }
         f = mp[self.ty]
         f(address, value)
@@ -0,0 +1,436 @@
+"""Instantiate wasm with tiered execution.
+
+The module starts running as python code, which is quickly generated.
+The python functions count their calls and loop iterations. When the
+module gets hot, it is compiled to native code in a background thread.
+
+The counters are checked at safe points: on calls from the host, and
+every so many calls and loop iterations of the python functions. Once
+the native code is compiled, it is initialized at the next safe point.
+
+When no function of the module is running, the state of the module is
+copied to the native instance, and the exported functions continue with
+the native code. When python functions are running, such as the start
+function of a WASI program, their calls to other functions of the
+module are redirected to the native code. The state is copied to the
+native instance before such a call, and back to the python instance
+after it.
+"""
+
+import ctypes
+import logging
+import threading
+import time
+
+from ...utils.reporting import DummyReportGenerator
+from ..util import PAGE_SIZE
+from ._base_instance import (
+    GlobalInstance,
+    MemoryInstance,
+    ModuleInstance,
+    TableInstance,
+)
+from ._native_instance import native_instantiate
+from ._python_instance import python_instantiate
+
+logger = logging.getLogger("instantiate")
+
+
+def tiered_instantiate(module, imports, reporter, cache, memory_checks=None):
+    """Load wasm module as a TieredModuleInstance"""
+    logger.info("Instantiating wasm module for tiered execution")
+    python_instance = python_instantiate(
+        module, dict(imports), reporter, cache, counters=True
+    )
+    return TieredModuleInstance(
+        module, python_instance, imports, cache, memory_checks
+    )
+
+
+class TieredModuleInstance(ModuleInstance):
+    """Wasm module which runs as python code until it is hot, and then
+    runs as native code.
+
+    The module is hot when the total number of calls and loop iterations
+    of its functions reaches the threshold. The tier is 'python', 'mixed'
+    while running python functions call native code, or 'native'.
+    """
+
+    threshold = 10000
+
+    # Minimal time in seconds between checks of the counters:
+    check_period = 0.01
+
+    def __init__(
+        self, module, python_instance, imports, cache, memory_checks=None
+    ):
+        super().__init__(python_instance._wasm_info)
+        self._module = module
+        self._imports = imports
+        self._cache = cache
+        self._memory_checks = memory_checks
+        self._python = python_instance
+        self._compiled = None  # The native instance, when compiled
+        self._native = None  # The native instance, when initialized
+        self._current = python_instance
+        self._depth = 0  # The number of running calls from the host
+        self._next_check = 0
+        self._thread = None
+        self._to_native = {}  # Native function addresses by python index
+        self._to_python = {}
+        self.tier = "python"
+
+        from ...api import is_platform_supported
+
+        # Only functions can be passed between the tiers:
+        self._can_tier_up = is_platform_supported() and all(
+            callable(obj) for obj in imports.values()
+        )
+
+        python_instance._py_module.rt.safe_point = self.check_tier
+
+    @property
+    def counters(self):
+        """The number of calls and loop iterations of the functions
+        while they run as python code.
+        """
+        return self._python.counters
+
+    def invoke(self, name, *args):
+        self._depth += 1
+        try:
+            self._current.invoke(name, *args)
+        finally:
+            self._depth -= 1
+
+    def call(self, function, args):
+        """Call an exported function from the host"""
+        if self._depth == 0:
+            self.check_tier()
+        self._depth += 1
+        try:
+            return function.get_function(self._current)(*args)
+        finally:
+            self._depth -= 1
+
+    def check_tier(self):
+        """Switch to native code when it is ready, or start compiling
+        native code when the module is hot.
+
+        This is called from the host, and from the running python code.
+        """
+        if self._compiled is not None and self._native is None:
+            self.init_native()
+
+        if self._native is not None:
+            if self._depth == 0:
+                if self.tier != "native":
+                    self.switch_tier()
+            elif self.tier == "python":
+                self.redirect_calls()
+        elif self._thread is None and self._can_tier_up:
+            now = time.perf_counter()
+            if now >= self._next_check:
+                self._next_check = now + self.check_period
+                hotness = sum(sum(c) for c in self.counters.values())
+                if hotness >= self.threshold:
+                    self.tier_up(wait=False)
+
+    def tier_up(self, wait=True):
+        """Compile the module to native code.
+
+        When wait is True, the native code is used when this function
+        returns, unless the module cannot be compiled. Otherwise the
+        code is compiled in the background, and used from the next safe
+        point onwards.
+        """
+        if self._thread is None:
+            logger.info("Compiling hot wasm module to native code")
+            self._thread = threading.Thread(
+                target=self._compile_native, daemon=True
+            )
+            self._thread.start()
+
+        if wait:
+            self._thread.join()
+            self.check_tier()
+
+    def _compile_native(self):
+        try:
+            compiled = native_instantiate(
+                self._module,
+                dict(self._imports),
+                DummyReportGenerator(),
+                self._cache,
+                self._memory_checks,
+            )
+        except Exception as ex:
+            logger.warning("Keeping wasm module as python code: %s", ex)
+        else:
+            self._compiled = compiled
+
+    def init_native(self):
+        """Initialize the compiled native code.
+
+        This runs on the thread of the host, since calls into native code
+        with memory checks use the process wide state of the trap handler.
+        """
+        module, native = self._module, self._compiled
+        try:
+            native.invoke("_run_init")
+            native.load_globals(module)
+            native.load_tables(module)
+            native.load_memory(module)
+        except Exception as ex:
+            logger.warning("Keeping wasm module as python code: %s", ex)
+            self._compiled = None
+            self._can_tier_up = False
+            return
+
+        # Tables refer to the functions by index in python code, and by
+        # address in native code:
+        rt = self._python._py_module.rt
+        code_module = native._code_module
+        for name, ptr in rt.f_ptrs_by_name.items():
+            if hasattr(code_module, name):
+                function = getattr(code_module, name)
+                address = ctypes.cast(function, ctypes.c_void_p).value
+                self._to_native[ptr] = address
+                self._to_python[address] = ptr
+        self._to_native[0] = self._to_python[0] = 0
+        self._native = native
+
+    def switch_tier(self):
+        """Copy the state of the python code to the native code, and
+        continue with the native code.
+        """
+        self.copy_state(self._python, self._native, self._to_native)
+        self._current = self._native
+        self.tier = "native"
+        logger.info("Switched wasm module to native code")
+
+    def redirect_calls(self):
+        """Let the running python code call native code.
+
+        The python functions call each other by name, and through the
+        function pointers of the runtime. Both are replaced by the native
+        functions.
+        """
+        py_module = self._python._py_module
+        for name in py_module.rt.f_ptrs_by_name:
+            if name in vars(py_module):
+                NativeCall(self, name).install()
+        self.tier = "mixed"
+        logger.info("Redirected calls of running python code to native code")
+
+    def copy_state(self, source, target, pointers):
+        """Copy memories, globals and tables from one tier to another.
+
+        The pointers translate the function pointers in the tables.
+        """
+        for memory, target_memory in zip(source._memories, target._memories):
+            size = memory.size()
+            if target_memory.size() < size:
+                target_memory.grow(size - target_memory.size())
+            n_bytes = size * PAGE_SIZE
+            target_memory.view()[:n_bytes] = memory.view()[:n_bytes]
+
+        for global_, target_global in zip(source._globals, target._globals):
+            target_global.write(global_.read())
+
+        for table, target_table in zip(source._tables, target._tables):
+            size = table.size()
+            if target_table.size() < size:
+                target_table.grow(0, size - target_table.size())
+            for index in range(size):
+                target_table.set_item(index, pointers[table.get_item(index)])
+
+    def load_globals(self, wasm_module):
+        self._python.load_globals(wasm_module)
+        self._globals = [
+            TieredGlobalInstance(self, index, global_)
+            for index, global_ in enumerate(self._python._globals)
+        ]
+
+    def load_tables(self, wasm_module):
+        self._python.load_tables(wasm_module)
+        self._tables = [
+            TieredTableInstance(self, index, table)
+            for index, table in enumerate(self._python._tables)
+        ]
+
+    def load_memory(self, wasm_module):
+        self._python.load_memory(wasm_module)
+        self._memories = [
+            TieredMemoryInstance(self, index, memory)
+            for index, memory in enumerate(self._python._memories)
+        ]
+
+    def memory_create(self, min_size, max_size):
+        self._python.memory_create(min_size, max_size)
+
+    def create_table(self, size, max_size):
+        return self._python.create_table(size, max_size)
+
+    def set_table_ptr(self, index, table):
+        self._python.set_table_ptr(index, table)
+
+    def create_elem(self, index: int, size: int):
+        return self._python.create_elem(index, size)
+
+    def get_func_by_index(self, index: int):
+        return TieredFunction(self, index)
+
+    def create_global(self, index: int):
+        return self._python.create_global(index)
+
+
+class TieredFunction:
+    """An exported function, which runs in the current tier"""
+
+    def __init__(self, instance, index):
+        self._instance = instance
+        self._index = index
+        self._functions = {}  # The function by instance of a tier
+
+    def __call__(self, *args):
+        return self._instance.call(self, args)
+
+    def get_function(self, tier_instance):
+        """Get the function as loaded in the instance of a tier"""
+        if tier_instance not in self._functions:
+            function = tier_instance.get_func_by_index(self._index)
+            self._functions[tier_instance] = function
+        return self._functions[tier_instance]
+
+
+class NativeCall:
+    """A call from running python code to native code.
+
+    The native code runs on the state of the python code, which is
+    copied to the native instance before the call, and back after it.
+    When copying the state takes longer than running the function as
+    python code would, the function is called as python code again.
+    """
+
+    # The number of calls after which the time spent is compared:
+    n_trial_calls = 16
+
+    # The assumed ratio of the run times of python and native code:
+    speedup = 10
+
+    def __init__(self, instance, name):
+        python_module = instance._python._py_module
+        self._instance = instance
+        self._name = name
+        self._index = python_module.rt.f_ptrs_by_name[name]
+        self._python_function = getattr(python_module, name)
+        self._function = instance._native._get_function(name)
+        self._n_calls = 0
+        self._copy_time = 0
+        self._call_time = 0
+
+    def install(self):
+        """Replace the python function by this call"""
+        python_module = self._instance._python._py_module
+        setattr(python_module, self._name, self)
+        python_module.rt.func_pointers[self._index] = self
+
+    def uninstall(self):
+        """Call the python function again"""
+        python_module = self._instance._python._py_module
+        setattr(python_module, self._name, self._python_function)
+        python_module.rt.func_pointers[self._index] = self._python_function
+
+    def __call__(self, *args):
+        instance = self._instance
+        python, native = instance._python, instance._native
+        start = time.perf_counter()
+        instance.copy_state(python, native, instance._to_native)
+        instance._current = native
+        call_start = time.perf_counter()
+        try:
+            return self._function(*args)
+        finally:
+            call_end = time.perf_counter()
+            instance._current = python
+            instance.copy_state(native, python, instance._to_python)
+            self._copy_time += call_start - start
+            self._copy_time += time.perf_counter() - call_end
+            self._call_time += call_end - call_start
+            self._n_calls += 1
+            if self._n_calls == self.n_trial_calls:
+                if self._copy_time > self.speedup * self._call_time:
+                    self.uninstall()
+
+
+class TieredMemoryInstance(MemoryInstance):
+    """Memory of the current tier"""
+
+    def __init__(self, instance, index, memory):
+        super().__init__(memory.min_size, memory.max_size)
+        self._instance = instance
+        self._index = index
+
+    def _get_memory(self):
+        return self._instance._current._memories[self._index]
+
+    def grow(self, amount: int) -> int:
+        return self._get_memory().grow(amount)
+
+    def size(self) -> int:
+        return self._get_memory().size()
+
+    def write(self, address, data):
+        self._get_memory().write(address, data)
+
+    def read(self, address, size):
+        return self._get_memory().read(address, size)
+
+    def view(self):
+        return self._get_memory().view()
+
+
+class TieredGlobalInstance(GlobalInstance):
+    """Global variable of the current tier"""
+
+    def __init__(self, instance, index, global_):
+        super().__init__(global_.ty, global_.name)
+        self._instance = instance
+        self._index = index
+
+    def _get_global(self):
+        return self._instance._current._globals[self._index]
+
+    def read(self):
+        return self._get_global().read()
+
+    def write(self, value):
+        self._get_global().write(value)
+
+
+class TieredTableInstance(TableInstance):
+    """Table of the current tier.
+
+    The items of the table are function pointers of the current tier.
+    """
+
+    def __init__(self, instance, index, table):
+        super().__init__(table._max_size)
+        self._instance = instance
+        self._index = index
+
+    def _get_table(self):
+        return self._instance._current._tables[self._index]
+
+    def size(self) -> int:
+        return self._get_table().size()
+
+    def grow(self, val, amount: int) -> int:
+        return self._get_table().grow(val, amount)
+
+    def get_item(self, index: int):
+        return self._get_table().get_item(index)
+
+    def set_item(self, index: int, value):
+        self._get_table().set_item(index, value)
@@ -0,0 +1,253 @@
+"""Turn traps of native wasm code into exceptions.
+
+Native code cannot raise python exceptions, so calls from the host into
+a native wasm module go through a small trampoline. The trampoline saves
+the stack pointer before calling the wasm function. When the wasm code
+traps, the stack pointer is restored and the trampoline returns to the
+host with a flag set, which is raised as a WasmTrapException.
+
+The wasm code traps by calling ``wasm_rt_trap``, for example when an
+explicit bounds check fails. Accesses to the guard pages after the
+memory of a module are caught by a SIGSEGV handler, which lets the
+faulting code continue at ``wasm_rt_trap``. Faults outside the memory
+of the module, or when no wasm code is running, are passed on to the
+previous handler of the signal.
+
+This is only implemented for x86_64 linux. Calls into wasm modules on
+multiple threads at the same time are not supported.
+"""
+
+import ctypes
+import io
+import logging
+import platform
+import signal
+import sys
+
+from ...binutils import layout
+from ...binutils.linker import link
+from ...utils.memory_page import MemoryPage
+from ._base_instance import WasmTrapException
+
+logger = logging.getLogger("wasm-traps")
+
+# Slots of the state shared between python and the trampoline:
+SAVED_SP = 0  # Stack pointer of the innermost running call, or 0
+TARGET = 1  # The wasm function to call
+TRAPPED = 2  # Set when the call trapped
+FAULT_LOW = 3  # Range of addresses in which faults are traps
+FAULT_HIGH = 4
+SIGACTION = 5  # Address of the sigaction function of libc
+OLD_ACTION = 6  # Address of the previous action of SIGSEGV
+INSTALLED = 7  # Cleared when the previous action is restored
+
+# Offset of the instruction pointer in the ucontext_t on x86_64 linux:
+UCONTEXT_RIP = 168
+
+SA_SIGINFO = 4
+SA_ONSTACK = 0x08000000
+
+trampoline_src = f"""
+section code
+global wasm_trap_state
+
+; Call the target function, leaving the argument registers as they are.
+; Save the callee saved registers, such that a trap can restore them.
+global wasm_trap_call
+wasm_trap_call:
+  push rbp
+  push rbx
+  push r12
+  push r13
+  push r14
+  push r15
+  mov r11, wasm_trap_state
+  mov r10, [r11, {SAVED_SP * 8}]
+  push r10
+  mov [r11, {SAVED_SP * 8}], rsp
+  mov r11, [r11, {TARGET * 8}]
+  call *r11
+  mov r11, wasm_trap_state
+  pop r10
+  mov [r11, {SAVED_SP * 8}], r10
+  pop r15
+  pop r14
+  pop r13
+  pop r12
+  pop rbx
+  pop rbp
+  ret
+
+; Return from the innermost call with the trapped flag set.
+global wasm_rt_trap
+wasm_rt_trap:
+  mov r11, wasm_trap_state
+  mov rsp, [r11, {SAVED_SP * 8}]
+  mov r10, 1
+  mov [r11, {TRAPPED * 8}], r10
+  xor rax, rax
+  pop r10
+  mov [r11, {SAVED_SP * 8}], r10
+  pop r15
+  pop r14
+  pop r13
+  pop r12
+  pop rbx
+  pop rbp
+  ret
+
+; SIGSEGV handler, with the signal info in rsi and context in rdx.
+global wasm_trap_handler
+wasm_trap_handler:
+  mov r11, wasm_trap_state
+  mov rax, [r11, {SAVED_SP * 8}]
+  cmp rax, 0
+  jz wasm_trap_chain
+  mov rax, [rsi, 16]
+  mov r10, [r11, {FAULT_LOW * 8}]
+  cmp rax, r10
+  jb wasm_trap_chain
+  mov r10, [r11, {FAULT_HIGH * 8}]
+  cmp rax, r10
+  jae wasm_trap_chain
+  mov rax, wasm_rt_trap
+  mov [rdx, {UCONTEXT_RIP}], rax
+  ret
+
+; Restore the previous action, which handles the fault when it happens
+; again after returning.
+wasm_trap_chain:
+  xor rax, rax
+  mov [r11, {INSTALLED * 8}], rax
+  mov rax, [r11, {SIGACTION * 8}]
+  mov rsi, [r11, {OLD_ACTION * 8}]
+  mov rdi, {int(signal.SIGSEGV)}
+  xor rdx, rdx
+  sub rsp, 8
+  call *rax
+  add rsp, 8
+  ret
+"""
+
+
+class Sigaction(ctypes.Structure):
+    """The struct sigaction of glibc on x86_64"""
+
+    _fields_ = [
+        ("sa_sigaction", ctypes.c_void_p),
+        ("sa_mask", ctypes.c_ulong * 16),
+        ("sa_flags", ctypes.c_int),
+        ("sa_restorer", ctypes.c_void_p),
+    ]
+
+
+def is_supported():
+    """Test if traps of native code can be handled on this platform"""
+    return sys.platform == "linux" and platform.machine() in (
+        "x86_64",
+        "AMD64",
+    )
+
+
+_trap_handler = None
+
+
+def get_trap_handler():
+    """Get the trap handler of this process"""
+    global _trap_handler
+    if _trap_handler is None:
+        if not is_supported():
+            raise NotImplementedError(
+                "Memory checks of native wasm code are not supported on "
+                f"{sys.platform} {platform.machine()}"
+            )
+        _trap_handler = TrapHandler()
+    return _trap_handler
+
+
+class TrapHandler:
+    """The trampoline and signal handler which turn traps into
+    exceptions.
+    """
+
+    def __init__(self):
+        from ...api import asm
+
+        self._state = (ctypes.c_uint64 * 8)()
+        obj = asm(io.StringIO(trampoline_src), "x86_64")
+        code_size = obj.get_section("code").size
+        self._code_page = MemoryPage(code_size)
+
+        memory_layout = layout.Layout()
+        code_memory = layout.Memory("codepage")
+        code_memory.location = self._code_page.addr
+        code_memory.size = code_size
+        code_memory.add_input(layout.Section("code"))
+        memory_layout.add_memory(code_memory)
+        state_address = ctypes.addressof(self._state)
+        obj = link(
+            [obj],
+            layout=memory_layout,
+            extra_symbols={"wasm_trap_state": state_address},
+        )
+        self._code_page.write(bytes(obj.get_section("code").data))
+
+        self.call_address = obj.get_symbol_value("wasm_trap_call")
+        self.trap_address = obj.get_symbol_value("wasm_rt_trap")
+        self._handler_address = obj.get_symbol_value("wasm_trap_handler")
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._sigaction = libc.sigaction
+        self._sigaction.argtypes = (
+            ctypes.c_int,
+            ctypes.POINTER(Sigaction),
+            ctypes.POINTER(Sigaction),
+        )
+        self._old_action = Sigaction()
+        self._state[SIGACTION] = ctypes.cast(
+            self._sigaction, ctypes.c_void_p
+        ).value
+        self._state[OLD_ACTION] = ctypes.addressof(self._old_action)
+        self.install()
+
+    def install(self):
+        """Install the signal handler, keeping the previous action"""
+        action = Sigaction()
+        action.sa_sigaction = self._handler_address
+        action.sa_flags = SA_SIGINFO | SA_ONSTACK
+        result = self._sigaction(
+            signal.SIGSEGV,
+            ctypes.byref(action),
+            ctypes.byref(self._old_action),
+        )
+        if result != 0:
+            raise OSError(ctypes.get_errno(), "Cannot install trap handler")
+        self._state[INSTALLED] = 1
+        logger.debug("Installed trap handler")
+
+    def wrap(self, function):
+        """Get a function with the signature of the given native
+        function, which calls it through the trampoline.
+        """
+        return type(function)(self.call_address)
+
+    def call(self, trampoline, function, args, memory_range):
+        """Call a native wasm function, and raise an exception when it
+        traps.
+
+        Faults within the given range of addresses are traps.
+        """
+        state = self._state
+        if not state[INSTALLED]:
+            self.install()
+        old_range = state[FAULT_LOW], state[FAULT_HIGH]
+        state[FAULT_LOW], state[FAULT_HIGH] = memory_range
+        state[TARGET] = ctypes.cast(function, ctypes.c_void_p).value
+        try:
+            result = trampoline(*args)
+        finally:
+            state[FAULT_LOW], state[FAULT_HIGH] = old_range
+        if state[TRAPPED]:
+            state[TRAPPED] = 0
+            raise WasmTrapException("out of bounds memory access")
+        return result
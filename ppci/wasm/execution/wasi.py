@@ -5,6 +5,7 @@ These are some of the WASI api functions implemented in python.
 See also: https://wasi.dev
 """
 
+import contextlib
 import logging
 import os
 import stat
@@ -93,8 +94,47 @@ def encode_strings(items):
     return blob, offsets
 
 
+def read_fd(fd, buffers):
+    """Read from a file descriptor into a list of buffers.
+
+    Use a single system call where possible. Returns the number of bytes
+    read.
+    """
+    if not buffers:
+        return 0
+    elif hasattr(os, "readv"):
+        return os.readv(fd, buffers)
+    total = 0
+    for buffer in buffers:
+        data = os.read(fd, len(buffer))
+        buffer[: len(data)] = data
+        total += len(data)
+        if len(data) < len(buffer):
+            break
+    return total
+
+
+def write_fd(fd, buffers):
+    """Write a list of buffers to a file descriptor.
+
+    Use a single system call where possible. Returns the number of bytes
+    written.
+    """
+    if not buffers:
+        return 0
+    elif hasattr(os, "writev"):
+        return os.writev(fd, buffers)
+    return sum(os.write(fd, buffer) for buffer in buffers)
+
+
 class WasiApi:
+    """Implementation of the WASI functions for an instance.
+
+    The functions access the memory of the instance in place.
+    """
+
     logger = logging.getLogger("wasi")
+    iovec = struct.Struct("<II")
 
     def __init__(self, args):
         self._instance = None
@@ -115,6 +155,12 @@ class WasiApi:
         }
         self._next_fd = 7
 
+    @contextlib.contextmanager
+    def _memory_view(self):
+        """Access the memory of the instance as a memoryview."""
+        with self._instance.exports["memory"].view() as view:
+            yield view
+
     def _write_mem_u8(self, address: int, value: int):
         self._write_mem_fmt(address, "<B", value)
 
@@ -128,12 +174,14 @@ class WasiApi:
         self._write_mem_fmt(address, "<Q", value)
 
     def _write_mem_fmt(self, address: int, fmt: str, value: int):
-        data = struct.pack(fmt, value)
-        self._write_mem_data(address, data)
+        with self._memory_view() as view:
+            struct.pack_into(fmt, view, address, value)
 
     def _write_mem_data(self, address, data: bytes):
-        memory = self._instance.exports["memory"]
-        memory.write(address, data)
+        with self._memory_view() as view:
+            if address + len(data) > len(view):
+                raise IndexError(f"Write of {len(data)} bytes at {address}")
+            view[address : address + len(data)] = data
 
     def _read_mem_u16(self, address: int) -> int:
         return self._read_mem_fmt(address, "<H")
@@ -145,13 +193,14 @@ class WasiApi:
         return self._read_mem_fmt(address, "<Q")
 
     def _read_mem_fmt(self, address: int, fmt: str):
-        size = struct.calcsize(fmt)
-        data = self._read_mem_data(address, size)
-        return struct.unpack(fmt, data)[0]
+        with self._memory_view() as view:
+            return struct.unpack_from(fmt, view, address)[0]
 
     def _read_mem_data(self, address: int, size: int) -> bytes:
-        memory = self._instance.exports["memory"]
-        return memory.read(address, size)
+        with self._memory_view() as view:
+            if address + size > len(view):
+                raise IndexError(f"Read of {size} bytes at {address}")
+            return bytes(view[address : address + size])
 
     def _read_string(self, address: int, size: int) -> str:
         data = self._read_mem_data(address, size)
@@ -291,14 +340,23 @@ class WasiApi:
         else:
             return EACCES
 
-    def _read_iovecs(self, iovs_address: int, iovs_len: int):
-        iovs = []
-        for nr in range(iovs_len):
-            ciovec_address = iovs_address + nr * 8
-            buf_addr = self._read_mem_u32(ciovec_address)
-            buf_size = self._read_mem_u32(ciovec_address + 4)
-            iovs.append((buf_addr, buf_size))
-        return iovs
+    def _get_buffers(self, view, iovs_address: int, iovs_len: int):
+        """Get views of the buffers of an array of iovecs.
+
+        Returns None when a buffer is not within the memory.
+        """
+        end = iovs_address + iovs_len * self.iovec.size
+        if end > len(view):
+            return None
+        buffers = []
+        for buf_addr, buf_size in self.iovec.iter_unpack(
+            view[iovs_address:end]
+        ):
+            if buf_addr + buf_size > len(view):
+                return None
+            if buf_size:
+                buffers.append(view[buf_addr : buf_addr + buf_size])
+        return buffers
 
     def fd_read(
         self, fd: ir.i32, iovs: ir.i32, iovs_len: ir.i32, nread: ir.i32
@@ -310,22 +368,27 @@ class WasiApi:
             py_f = fd
         elif fd in self._available_fd:
             py_f = self._available_fd[fd]
-            if not hasattr(py_f, "read"):
+            if not hasattr(py_f, "readinto"):
                 return EACCES
         else:
             return EBADF
 
-        total_bytes = 0
-        for buf_addr, buf_size in self._read_iovecs(iovs, iovs_len):
+        # Read directly into the memory of the instance:
+        with self._memory_view() as view:
+            buffers = self._get_buffers(view, iovs, iovs_len)
+            if buffers is None:
+                return EFAULT
+
             if isinstance(py_f, int):
-                data = os.read(py_f, buf_size)
+                total_bytes = read_fd(py_f, buffers)
             else:
-                data = py_f.read(buf_size)
-
-            assert len(data) <= buf_size
-            self._write_mem_data(buf_addr, data)
-            total_bytes += len(data)
-        self._write_mem_u32(nread, total_bytes)
+                total_bytes = 0
+                for buffer in buffers:
+                    size = py_f.readinto(buffer)
+                    total_bytes += size
+                    if size < len(buffer):
+                        break
+            struct.pack_into("<I", view, nread, total_bytes)
         return ESUCCESS
 
     def fd_seek(
@@ -351,8 +414,8 @@ class WasiApi:
         self._trace(f"fd_write(fd={fd=}, iovs_len={iovs_len=})")
 
         # Check fd:
-        if fd == 1 or fd == 2:
-            # Assume standard output / stderr:
+        if fd in (1, 2):
+            # Standard output and error are not buffered:
             py_f = fd
         elif fd in self._available_fd:
             py_f = self._available_fd[fd]
@@ -361,24 +424,19 @@ class WasiApi:
         else:
             return EACCES
 
-        total_bytes = 0
-
-        # Loop over all iovs:
-        for buf_addr, buf_size in self._read_iovecs(iovs, iovs_len):
-            self.logger.debug(
-                "Read %s bytes from address %s", buf_size, buf_addr
-            )
-            data = self._read_mem_data(buf_addr, buf_size)
-            total_bytes += len(data)
+        # Write directly from the memory of the instance:
+        with self._memory_view() as view:
+            buffers = self._get_buffers(view, iovs, iovs_len)
+            if buffers is None:
+                return EFAULT
 
             if isinstance(py_f, int):
-                os.write(py_f, data)
+                total_bytes = write_fd(py_f, buffers)
             else:
-                py_f.write(data)
-            # print(data.decode("ascii", errors="ignore"), end="")
-            # sys.stdout.write(data)
-
-        self._write_mem_u32(n_written, total_bytes)
+                total_bytes = 0
+                for buffer in buffers:
+                    total_bytes += py_f.write(buffer)
+            struct.pack_into("<I", view, n_written, total_bytes)
         return ESUCCESS
 
     def path_create_directory(
@@ -20,7 +20,10 @@ from .util import sanitize_name
 
 
 def wasm_to_ir(
-    wasm_module: components.Module, ptr_info, reporter=None
+    wasm_module: components.Module,
+    ptr_info,
+    reporter=None,
+    memory_checks=None,
 ) -> ir.Module:
     """Convert a WASM module into a PPCI native module.
 
@@ -28,11 +31,15 @@ def wasm_to_ir(
         wasm_module (ppci.wasm.Module): The wasm-module to compile
         ptr_info: :class:`ppci.arch.arch_info.TypeInfo` size and
                   alignment information for pointers.
+        memory_checks: how memory accesses are checked. None does not
+                  check them, 'explicit' compares each address with the
+                  size of the memory and 'guard' relies on guard pages
+                  after the memory to catch accesses out of bounds.
 
     Returns:
         An IR-module.
     """
-    compiler = WasmToIrCompiler(ptr_info)
+    compiler = WasmToIrCompiler(ptr_info, memory_checks=memory_checks)
     ppci_module = compiler.generate(wasm_module)
     if reporter:
         reporter.dump_ir(ppci_module)
@@ -56,12 +63,15 @@ class WasmToIrCompiler:
     logger = logging.getLogger("wasm2ir")
     verbose = False
 
-    def __init__(self, ptr_info):
+    def __init__(self, ptr_info, memory_checks=None):
         self.builder = irutils.Builder()
         self.blocknr = 0
         if not isinstance(ptr_info, TypeInfo):
             raise TypeError("Expected ptr_info to be TypeInfo")
+        if memory_checks not in (None, "explicit", "guard"):
+            raise ValueError(f"Invalid memory checks: {memory_checks}")
         self.ptr_info = ptr_info
+        self.memory_checks = memory_checks
         self._opcode_dispatch = {}
         self._fill_dispatch_table()
 
@@ -231,6 +241,8 @@ class WasmToIrCompiler:
         self.global_inits = []
 
         self.memory_base_address = None
+        self.memory_size_address = None
+        self.trap_function = None
 
         for definition in wasm_module:
             self.gen_definition(definition)
@@ -477,6 +489,16 @@ class WasmToIrCompiler:
         )
         self.builder.module.add_variable(self.memory_base_address)
 
+        if self.memory_checks == "explicit":
+            # The size of the memory in bytes, to check addresses against:
+            self.memory_size_address = ir.Variable(
+                "wasm_mem0_size",
+                ir.Binding.GLOBAL,
+                self.ptr_info.size,
+                self.ptr_info.alignment,
+            )
+            self.builder.module.add_variable(self.memory_size_address)
+
     def gen_init_procedure(self):
         """Generate an initialization procedure.
 
@@ -612,6 +634,7 @@ class WasmToIrCompiler:
         )
         self.stack = []
         self.block_stack = []
+        self.trap_block = None
 
         # Create correct debug signature for function:
 
@@ -1163,8 +1186,8 @@ class WasmToIrCompiler:
         itype, load_op = instruction.opcode.split(".")
         ir_typ = self.get_ir_type(itype)
         _, offset = instruction.args
-        address = self.get_memory_address(offset)
         if load_op == "load":
+            address = self.get_memory_address(offset, ir_typ.size)
             value = self.emit(ir.Load(address, "load", ir_typ))
         else:
             # Load different data-type and cast:
@@ -1176,6 +1199,7 @@ class WasmToIrCompiler:
                 "load32_u": ir.u32,
                 "load32_s": ir.i32,
             }[load_op]
+            address = self.get_memory_address(offset, load_ir_typ.size)
             value = self.emit(ir.Load(address, "load", load_ir_typ))
             value = self.emit(ir.Cast(value, "casted_load", ir_typ))
         self.push_value(value)
@@ -1187,8 +1211,8 @@ class WasmToIrCompiler:
         # ACHTUNG: alignment and offset are swapped in text:
         _, offset = instruction.args
         value = self.pop_value(ir_typ=ir_typ)
-        address = self.get_memory_address(offset)
         if store_op == "store":
+            address = self.get_memory_address(offset, ir_typ.size)
             self.emit(ir.Store(value, address))
         else:
             store_ir_typ = {
@@ -1197,19 +1221,63 @@ class WasmToIrCompiler:
                 "store32": ir.i32,
             }[store_op]
             value = self.emit(ir.Cast(value, "casted_value", store_ir_typ))
+            address = self.get_memory_address(offset, store_ir_typ.size)
             self.emit(ir.Store(value, address))
 
-    def get_memory_address(self, offset):
-        """Emit code to retrieve a memory address"""
+    def get_memory_address(self, offset, size):
+        """Emit code to retrieve the address of an access of size bytes.
+
+        With memory checks, the wasm address is unsigned. Explicit checks
+        trap when the access does not fit in the memory. With guard pages,
+        all addresses fall within the reserved address space of the
+        memory, and accesses beyond the memory fault.
+        """
         base = self.pop_value()
+        if self.memory_checks and base.ty is not ir.u32:
+            base = self.emit(ir.Cast(base, "unsigned", ir.u32))
         if base.ty is not ir.ptr:
             base = self.emit(ir.Cast(base, "cast", ir.ptr))
         offset = self.emit(ir.Const(offset, "offset", ir.ptr))
         address = self.emit(ir.add(base, offset, "address", ir.ptr))
+        if self.memory_checks == "explicit":
+            self.gen_bounds_check(address, size)
         mem0 = self.emit(ir.Load(self.memory_base_address, "mem0", ir.ptr))
         address = self.emit(ir.add(mem0, address, "address", ir.ptr))
         return address
 
+    def gen_bounds_check(self, address, size):
+        """Trap when an access of size bytes at address is out of bounds"""
+        size = self.emit(ir.Const(size, "size", ir.ptr))
+        end = self.emit(ir.add(address, size, "end", ir.ptr))
+        memory_size = self.emit(
+            ir.Load(self.memory_size_address, "mem0_size", ir.ptr)
+        )
+        in_bounds_block = self.new_block()
+        self.emit(
+            ir.CJump(
+                end, ">", memory_size, self.get_trap_block(), in_bounds_block
+            )
+        )
+        self.builder.set_block(in_bounds_block)
+
+    def get_trap_block(self):
+        """Get the block of the current function which traps.
+
+        The trap function does not return to the wasm code, it returns
+        from the call into the module instead.
+        """
+        if self.trap_block is None:
+            if self.trap_function is None:
+                self.trap_function = ir.ExternalProcedure("wasm_rt_trap", [])
+                self.builder.module.add_external(self.trap_function)
+            current_block = self.builder.block
+            self.trap_block = self.new_block()
+            self.builder.set_block(self.trap_block)
+            self.emit(ir.ProcedureCall(self.trap_function, []))
+            self.gen_dead_return()
+            self.builder.set_block(current_block)
+        return self.trap_block
+
     def gen_data_drop(self, instruction):
         pass
 
@@ -1516,6 +1584,11 @@ class WasmToIrCompiler:
         exception. Also we will return from the subroutine.
         """
         self._runtime_call("unreachable")
+        self.gen_dead_return()
+        self.builder.set_block(None)
+
+    def gen_dead_return(self):
+        """Return from a function after a call which does not return"""
         if isinstance(self.builder.function, ir.Procedure):
             self.emit(ir.Exit())
         else:
@@ -1525,7 +1598,6 @@ class WasmToIrCompiler:
                 ir.Const(0, "unreachable", self.builder.function.return_ty)
             )
             self.emit(ir.Return(v))
-        self.builder.set_block(None)
 
     def gen_instruction_fallback(self, instruction):
         opcode = instruction.opcode
@@ -17,6 +17,46 @@ class ArchiveFileTestCase(unittest.TestCase):
         lib2 = get_archive(f2)
         self.assertTrue(lib2)
 
+    def test_binary_save_load(self):
+        """Test that members of a binary archive are loaded when used."""
+        arch = get_arch("msp430")
+        obj1 = ObjectFile(arch)
+        obj1.create_section("foo").add_data(bytes(range(40)))
+        obj1.add_symbol(0, "bar", "global", 4, "foo", "func", 0)
+        obj2 = ObjectFile(arch)
+        lib = archive([obj1, obj2])
+        f = io.BytesIO()
+        lib.save(f)
+        f2 = io.BytesIO(f.getvalue())
+        lib2 = get_archive(f2)
+        self.assertNotIsInstance(lib2._members[0], ObjectFile)
+        self.assertEqual(obj1, lib2.get_member(0))
+        self.assertIsInstance(lib2._members[0], ObjectFile)
+        self.assertNotIsInstance(lib2._members[1], ObjectFile)
+        self.assertEqual([obj1, obj2], lib2.objs)
+
+        # Saving again does not change the archive:
+        f3 = io.BytesIO()
+        lib2.save(f3)
+        self.assertEqual(f.getvalue(), f3.getvalue())
+
+    def test_binary_save_load_empty(self):
+        """Test a binary archive without symbols."""
+        lib = archive([ObjectFile(get_arch("msp430"))])
+        f = io.BytesIO()
+        lib.save(f)
+        lib2 = get_archive(io.BytesIO(f.getvalue()))
+        self.assertEqual({}, lib2.symbol_index)
+
+    def test_load_json(self):
+        """Test loading an archive saved as json from a binary file."""
+        obj1 = ObjectFile(get_arch("msp430"))
+        obj1.create_section("foo").add_data(bytes(range(40)))
+        f = io.StringIO()
+        archive([obj1]).save(f)
+        f2 = io.BytesIO(f.getvalue().encode("utf-8"))
+        self.assertEqual([obj1], get_archive(f2).objs)
+
     def test_linking(self):
         """Test pull in of undefined symbols from libraries."""
         arch = get_arch("msp430")
@@ -48,6 +88,60 @@ class ArchiveFileTestCase(unittest.TestCase):
 
         link([obj1], libraries=[lib1, lib2])
 
+    def test_symbol_index(self):
+        """Test that the symbol index is saved with the archive."""
+        arch = get_arch("msp430")
+        obj1 = ObjectFile(arch)
+        obj1.create_section("foo")
+        obj1.add_symbol(0, "a", "global", 0, "foo", "func", 0)
+        obj1.add_symbol(1, "b", "global", None, None, "func", 0)
+        obj1.add_symbol(2, "c", "local", 0, "foo", "func", 0)
+        obj2 = ObjectFile(arch)
+        obj2.create_section("foo")
+        obj2.add_symbol(0, "b", "global", 0, "foo", "func", 0)
+        lib = archive([obj1, obj2])
+        self.assertEqual({"a": 0, "b": 1}, lib.symbol_index)
+
+        f = io.StringIO()
+        lib.save(f)
+        lib2 = get_archive(io.StringIO(f.getvalue()))
+        self.assertEqual({"a": 0, "b": 1}, lib2.symbol_index)
+
+        f = io.BytesIO()
+        lib.save(f)
+        lib3 = get_archive(io.BytesIO(f.getvalue()))
+        self.assertEqual({"a": 0, "b": 1}, lib3.symbol_index)
+        self.assertIs(None, lib3.find_symbol("c"))
+        self.assertEqual(obj2, lib3.find_symbol("b"))
+
+    def test_unused_members(self):
+        """Test that members which are not used when linking are not
+        loaded.
+        """
+        arch = get_arch("msp430")
+        obj1 = ObjectFile(arch)
+        obj1.create_section("foo")
+        obj1.add_symbol(0, "main", "global", 0, "foo", "func", 0)
+        obj1.add_symbol(1, "puts", "global", None, None, "func", 0)
+        obj2 = ObjectFile(arch)
+        obj2.create_section("foo").add_data(bytes(4))
+        obj2.add_symbol(0, "puts", "global", 2, "foo", "func", 0)
+        obj2.add_symbol(1, "write", "global", None, None, "func", 0)
+        obj3 = ObjectFile(arch)
+        obj3.create_section("foo")
+        obj3.add_symbol(0, "abort", "global", 0, "foo", "func", 0)
+        obj4 = ObjectFile(arch)
+        obj4.create_section("foo").add_data(bytes(2))
+        obj4.add_symbol(0, "write", "global", 0, "foo", "func", 0)
+        f = io.BytesIO()
+        archive([obj2, obj3, obj4]).save(f)
+        lib = get_archive(io.BytesIO(f.getvalue()))
+
+        obj = link([obj1], libraries=[lib])
+        self.assertEqual(2, obj.get_symbol_value("puts"))
+        self.assertEqual(4, obj.get_symbol_value("write"))
+        self.assertNotIsInstance(lib._members[1], ObjectFile)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,88 @@
+"""Test the disassembler"""
+
+import io
+import unittest
+
+from ppci import api
+from ppci.arch.data_instructions import DByte
+from ppci.binutils.disasm import Disassembler
+from ppci.binutils.outstream import FunctionOutputStream
+
+
+def disassemble(data, arch, address=0):
+    """Disassemble data into a list of instructions"""
+    instructions = []
+    disassembler = Disassembler(api.get_arch(arch))
+    outs = FunctionOutputStream(instructions.append)
+    disassembler.disasm(data, outs, address=address)
+    return instructions
+
+
+def assemble(source, arch):
+    """Assemble the source, and get the data of the code section"""
+    obj = api.asm(io.StringIO("section code\n" + source), arch)
+    return bytes(obj.get_section("code").data)
+
+
+class DisassemblerTestCase(unittest.TestCase):
+    def test_instructions(self):
+        data = assemble("l.add r1, r2, r3\nl.addi r4, r5, 7", "or1k")
+        instructions = disassemble(data, "or1k", address=0x100)
+        self.assertEqual(
+            ["l.add r1, r2, r3", "l.addi r4, r5, 7"],
+            [str(i) for i in instructions],
+        )
+        self.assertEqual([0x100, 0x104], [i.address for i in instructions])
+
+    def test_unknown_data(self):
+        """Data which is not an instruction is disassembled as bytes"""
+        data = assemble("add x1, x2, x3", "riscv") + bytes([1, 2])
+        instructions = disassemble(data, "riscv")
+        self.assertEqual("add x1, x2, x3", str(instructions[0]))
+        self.assertEqual(3, len(instructions))
+        self.assertIsInstance(instructions[1], DByte)
+        self.assertEqual(1, instructions[1].v)
+        self.assertEqual(5, instructions[2].address)
+
+    def test_sub_constructor(self):
+        data = assemble("cmp r4, r11, lsr 4", "arm")
+        instructions = disassemble(data, "arm")
+        self.assertEqual(
+            ["cmp R4, R11, lsr 4"], [str(i) for i in instructions]
+        )
+
+    def test_value_map(self):
+        """The constructor of an operand can be selected by the opcode"""
+        data = assemble("and #0x10\nbit $20\nand ($44,X)", "mcs6500")
+        instructions = disassemble(data, "mcs6500")
+        self.assertEqual(
+            ["and #16", "bit 32", "and (68,x)"],
+            [str(i) for i in instructions],
+        )
+
+    def test_compiled_code(self):
+        """Disassembled code encodes to the same data"""
+        source = """
+        int f(int *a, int n) {
+            int s = 0;
+            for (int i = 0; i < n; i++) {
+                s += a[i] * n - (s >> 2);
+            }
+            return s;
+        }
+        """
+        archs = ["arm", "microblaze", "mips", "msp430", "or1k", "xtensa"]
+        for arch in archs:
+            with self.subTest(arch=arch):
+                obj = api.cc(io.StringIO(source), arch)
+                data = bytes(obj.get_section("code").data)
+                instructions = disassemble(data, arch)
+                self.assertFalse(
+                    all(isinstance(i, DByte) for i in instructions)
+                )
+                encoded = b"".join(i.encode() for i in instructions)
+                self.assertEqual(data, encoded)
+
+
+if __name__ == "__main__":
+    unittest.main()
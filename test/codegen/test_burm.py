@@ -1,6 +1,7 @@
 import argparse
 import io
 import os
+import tempfile
 import unittest
 
 from ppci.codegen import burg
@@ -71,6 +72,10 @@ class TreeTestCase(unittest.TestCase):
         self.assertTrue(t1.structural_equal(t2))
 
 
+class Ctx:
+    pass
+
+
 class TreeMatchingTestCase(unittest.TestCase):
     """Verify tree matching functions"""
 
@@ -160,6 +165,59 @@ class TreeMatchingTestCase(unittest.TestCase):
         v = selector.gen(context, tree)
         self.assertEqual((1, "+", 2), v)
 
+    @staticmethod
+    def make_system():
+        system = BurgSystem()
+        for terminal in ["ADD", "VAL"]:
+            system.add_terminal(terminal)
+        system.add_rule(
+            "stm",
+            Tree("ADD", Tree("reg"), Tree("reg")),
+            2,
+            None,
+            lambda ctx, tree, c0, c1: (c0, "+", c1),
+        )
+        system.add_rule(
+            "stm",
+            Tree("ADD", Tree("reg"), Tree("VAL")),
+            1,
+            lambda tree: tree[1].value < 10,
+            lambda ctx, tree, c0: (c0, "+#", tree[1].value),
+        )
+        system.add_rule(
+            "reg", Tree("VAL"), 1, None, lambda ctx, tree: tree.value
+        )
+        system.check()
+        return system
+
+    def test_acceptance(self):
+        """Check that acceptance conditions are evaluated per tree"""
+        selector = TreeSelector(self.make_system())
+        tree = Tree("ADD", Tree("VAL", value=1), Tree("VAL", value=2))
+        self.assertEqual((1, "+#", 2), selector.gen(Ctx(), tree))
+        tree = Tree("ADD", Tree("VAL", value=1), Tree("VAL", value=20))
+        self.assertEqual((1, "+", 20), selector.gen(Ctx(), tree))
+        tree = Tree("ADD", Tree("VAL", value=3), Tree("VAL", value=4))
+        self.assertEqual((3, "+#", 4), selector.gen(Ctx(), tree))
+
+        # Equal subtrees share their state:
+        self.assertIs(tree[0].state, tree[1].state)
+
+    def test_cached_tables(self):
+        """Check that state tables are reused from the cache directory"""
+        tree = Tree("ADD", Tree("VAL", value=1), Tree("VAL", value=2))
+        with tempfile.TemporaryDirectory() as cache_dir:
+            selector = TreeSelector(self.make_system(), cache_dir=cache_dir)
+            self.assertEqual((1, "+#", 2), selector.gen(Ctx(), tree))
+            self.assertTrue(selector.state_table.modified)
+            selector.save_tables()
+            self.assertTrue(os.path.exists(selector.cache_file))
+
+            selector = TreeSelector(self.make_system(), cache_dir=cache_dir)
+            self.assertTrue(selector.state_table.transitions)
+            self.assertEqual((1, "+#", 2), selector.gen(Ctx(), tree))
+            self.assertFalse(selector.state_table.modified)
+
 
 if __name__ == "__main__":
     unittest.main()
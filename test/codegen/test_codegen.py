@@ -1,18 +1,46 @@
 #!/usr/bin/python
 
 import io
+import multiprocessing
+import os
+import tempfile
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
 from ppci import ir
-from ppci.api import get_arch
+from ppci.api import (
+    c_to_ir,
+    get_arch,
+    get_current_arch,
+    ir_to_assembly,
+    ir_to_object,
+    is_platform_supported,
+    link,
+    optimize,
+)
+from ppci.arch.encoding import Instruction
 from ppci.arch.example import ExampleArch
+from ppci.arch.riscv.instructions import Addi, Lw, Sw
+from ppci.arch.riscv.registers import FP, RiscvRegister
 from ppci.binutils.debuginfo import DebugDb
+from ppci.binutils.outstream import DummyOutputStream, FunctionOutputStream
+from ppci.codegen import CodeGenerator
+from ppci.codegen.instructionscheduler import ScheduleUnit
+from ppci.codegen.instructionselector import (
+    TreeSelector,
+    create_burg_system,
+    get_tree_selector,
+)
 from ppci.codegen.irdag import (
     FunctionInfo,
     SelectionGraphBuilder,
     prepare_function_info,
 )
 from ppci.irutils import Builder, Writer
+from ppci.utils.cache import get_cache_dir
+from ppci.utils.codepage import load_obj
+from ppci.utils.reporting import DummyReportGenerator, TextReportGenerator
 
 
 def print_module(m):
@@ -199,5 +227,377 @@ class IrDagTestCase(unittest.TestCase):
         # self.assertTrue(sg_value.vreg)
 
 
+@unittest.skipUnless(
+    "fork" in multiprocessing.get_all_start_methods(), "Requires fork"
+)
+class ParallelCodegenTestCase(unittest.TestCase):
+    """Check that parallel code generation yields identical objects"""
+
+    src = """
+    int g;
+    int add(int a, int b) { return a + b + g; }
+    int mul(int a, int b) { return a * b; }
+    int loop(int n) {
+        int s = 0;
+        for (int i = 0; i < n; i++) { s = add(s, mul(i, 3)); }
+        return s;
+    }
+    void set(int v) { g = v; }
+    """
+
+    def compile(self, arch, jobs):
+        ir_module = c_to_ir(io.StringIO(self.src), arch)
+        optimize(ir_module, level=2)
+        obj = ir_to_object([ir_module], arch, jobs=jobs)
+        f = io.StringIO()
+        obj.save(f)
+        return f.getvalue()
+
+    def test_identical_objects(self):
+        for arch in ["arm", "riscv", "x86_64"]:
+            with self.subTest(arch=arch):
+                serial = self.compile(arch, None)
+                parallel = self.compile(arch, 2)
+                self.assertEqual(serial, parallel)
+
+    def test_reporter_is_serial(self):
+        """The workers do not report, so generate serially for a
+        reporter which collects instructions.
+        """
+        ir_module = c_to_ir(io.StringIO(self.src), "riscv")
+        f = io.StringIO()
+        with mock.patch(
+            "ppci.codegen.codegen.generate_functions",
+            side_effect=AssertionError("generated in parallel"),
+        ), TextReportGenerator(f) as reporter:
+            ir_to_object([ir_module], "riscv", reporter=reporter, jobs=2)
+        self.assertIn("loop_block0:", f.getvalue())
+
+
+class LinearScanCodegenTestCase(unittest.TestCase):
+    """Generate code using the linear scan register allocator"""
+
+    src = """
+    int g[20];
+    int f(int a, int b) {
+        int v0 = g[0] + a, v1 = g[1] + b, v2 = g[2] * a, v3 = g[3] * b;
+        int v4 = g[4] - a, v5 = g[5] - b, v6 = g[6] + v0, v7 = g[7] + v1;
+        int v8 = g[8] + v2, v9 = g[9] + v3, v10 = g[10] + v4;
+        int v11 = g[11] + v5, v12 = g[12] + v6, v13 = g[13] + v7;
+        for (int i = 0; i < a; i++) { v0 += f(v1, v2); v3 += v0; }
+        return v0 + v1 + v2 + v3 + v4 + v5 + v6 + v7 + v8 + v9 + v10
+            + v11 + v12 + v13;
+    }
+    """
+
+    def test_spilling(self):
+        for arch in ["arm", "riscv", "x86_64"]:
+            with self.subTest(arch=arch):
+                ir_module = c_to_ir(io.StringIO(self.src), arch)
+                obj = ir_to_object([ir_module], arch, regalloc="linear")
+                self.assertTrue(obj.get_section("code").data)
+
+    # More values are live across the loop than there are registers:
+    exec_src = (
+        """
+    int g(int x, int y) { return x * 7 - y; }
+    int f(int a, int b) {
+    """
+        + "".join(
+            f"    int v{i} = a * {i + 3} + b * {i + 5} - {i};\n"
+            for i in range(24)
+        )
+        + """
+        for (int i = 0; i < a; i++) {
+            v0 += g(v1, i) ^ v23;
+            v12 -= v0 + v11;
+            v23 += v12 * i;
+        }
+        return
+    """
+        + " + ".join(f"v{i} * {i + 1}" for i in range(24))
+        + """;
+    }
+    """
+    )
+
+    @unittest.skipUnless(is_platform_supported(), "skipping codepage tests")
+    def test_execution(self):
+        """Code with spills gives the same results for both allocators"""
+        arch = get_current_arch()
+        modules = {}
+        for regalloc in ["coloring", "linear"]:
+            ir_module = c_to_ir(io.StringIO(self.exec_src), arch)
+            code_generator = CodeGenerator(
+                arch, DummyReportGenerator(), regalloc=regalloc
+            )
+            code_generator.generate(ir_module, DummyOutputStream())
+            stats = code_generator.register_allocator.statistics["f"]
+            self.assertGreater(stats.spilled_registers, 0)
+
+            obj = ir_to_object(
+                [ir_module], arch, debug=True, regalloc=regalloc
+            )
+            modules[regalloc] = load_obj(obj)
+
+        for a, b in [(0, 0), (1, 2), (5, -3), (13, 1000), (-4, 77)]:
+            with self.subTest(a=a, b=b):
+                self.assertEqual(
+                    modules["coloring"].f(a, b), modules["linear"].f(a, b)
+                )
+
+    def test_unknown_allocator(self):
+        with self.assertRaises(ValueError):
+            CodeGenerator(get_arch("arm"), None, regalloc="magic")
+
+    def test_statistics(self):
+        """Both allocators record spill statistics per function"""
+        arch = get_arch("msp430")
+        for regalloc in ["coloring", "linear"]:
+            with self.subTest(regalloc=regalloc):
+                ir_module = c_to_ir(io.StringIO(self.src), arch)
+                code_generator = CodeGenerator(
+                    arch, DummyReportGenerator(), regalloc=regalloc
+                )
+                code_generator.generate(ir_module, DummyOutputStream())
+                stats = code_generator.register_allocator.statistics["f"]
+                self.assertGreater(stats.spill_rounds, 0)
+                self.assertGreater(stats.spilled_registers, 0)
+
+
+class SharedTablesTestCase(unittest.TestCase):
+    """Check that code generators share their selection tables"""
+
+    def test_same_arch(self):
+        cg1 = CodeGenerator(get_arch("riscv"), None)
+        cg2 = CodeGenerator(get_arch("riscv"), None, regalloc="linear")
+        self.assertIs(
+            cg1.instruction_selector.tree_selector,
+            cg2.instruction_selector.tree_selector,
+        )
+        self.assertIs(
+            cg1.register_allocator.cls_regs, cg2.register_allocator.cls_regs
+        )
+
+    def test_different_options(self):
+        cg1 = CodeGenerator(get_arch("riscv"), None)
+        cg2 = CodeGenerator(get_arch("riscv"), None, optimize_for="speed")
+        cg3 = CodeGenerator(get_arch("riscv:rvc"), None)
+        selectors = {
+            id(cg.instruction_selector.tree_selector) for cg in (cg1, cg2, cg3)
+        }
+        self.assertEqual(3, len(selectors))
+
+    def test_threads(self):
+        arch = get_arch("arm")
+        with ThreadPoolExecutor(4) as executor:
+            selectors = executor.map(
+                lambda _: get_tree_selector(arch, (5, 6, 7)), range(8)
+            )
+            self.assertEqual(1, len(set(map(id, selectors))))
+
+    def test_no_cache_dir(self):
+        """Selection tables are only written to disk when asked for"""
+        with mock.patch.dict(os.environ):
+            os.environ.pop("PPCI_CACHE_DIR", None)
+            self.assertIsNone(get_cache_dir())
+            os.environ["PPCI_CACHE_DIR"] = ""
+            self.assertIsNone(get_cache_dir())
+        selector = TreeSelector(create_burg_system(get_arch("riscv")))
+        self.assertIsNone(selector.cache_file)
+
+    def test_cache_dir(self):
+        """Selection tables are saved in and loaded from the cache dir"""
+        arch = get_arch("riscv")
+        src = "int f(int a, int b) { return a * b + 3; }"
+        with tempfile.TemporaryDirectory() as cache_dir, mock.patch.dict(
+            os.environ, {"PPCI_CACHE_DIR": cache_dir}
+        ):
+            self.assertEqual(cache_dir, get_cache_dir())
+            code_generator = CodeGenerator(arch, DummyReportGenerator())
+            selector = TreeSelector(
+                create_burg_system(arch), cache_dir=get_cache_dir()
+            )
+            code_generator.instruction_selector.tree_selector = selector
+            ir_module = c_to_ir(io.StringIO(src), arch)
+            code_generator.generate(ir_module, DummyOutputStream())
+            self.assertTrue(os.path.exists(selector.cache_file))
+            self.assertEqual(cache_dir, os.path.dirname(selector.cache_file))
+
+            selector = TreeSelector(
+                create_burg_system(arch), cache_dir=get_cache_dir()
+            )
+            self.assertTrue(selector.state_table.transitions)
+            self.assertFalse(selector.state_table.modified)
+
+
+class LiteralPoolTestCase(unittest.TestCase):
+    """Check that literal pools stay within reach of the loads"""
+
+    def compile(self, arch, n):
+        lines = ["void f(int *p) {"]
+        for i in range(n):
+            lines.append(f"    p[{i % 7}] = p[{i % 5}] + {100000 + i * 7919};")
+        lines.append("}")
+        ir_module = c_to_ir(io.StringIO("\n".join(lines)), arch)
+        optimize(ir_module, level=2)
+        return ir_module
+
+    def test_large_functions(self):
+        for arch, n in [("arm:thumb", 100), ("arm", 300)]:
+            with self.subTest(arch=arch):
+                ir_module = self.compile(arch, n)
+                obj = ir_to_object([ir_module], arch)
+                link([obj])
+                text = ir_to_assembly([self.compile(arch, n)], arch)
+                self.assertIn("pool_end", text)
+
+    def test_small_function(self):
+        text = ir_to_assembly([self.compile("arm:thumb", 10)], "arm:thumb")
+        self.assertNotIn("pool_end", text)
+
+    def test_inline_assembly(self):
+        """The size of inline assembly counts towards the pool range"""
+        code = "\\n".join(["add r1, r1, r2"] * 600)
+        src = f"""
+        void f(int *p) {{
+            p[0] = 123456;
+            asm ("{code}" : : );
+            p[1] = 234567;
+        }}
+        """
+        ir_module = c_to_ir(io.StringIO(src), "arm:thumb")
+        text = ir_to_assembly([ir_module], "arm:thumb")
+        lines = [line.strip() for line in text.splitlines()]
+
+        def find_load(label):
+            for index, line in enumerate(lines):
+                if line.startswith("ldr") and line.endswith(label):
+                    return index
+            self.fail(f"No load of {label}")
+
+        load = find_load("f_literal_0")
+        pool = lines.index("f_literal_0:")
+        self.assertLess(load, pool)
+        self.assertLess(pool, find_load("f_literal_1"))
+
+        # All instructions between the load and the literal are 2 bytes:
+        arch = get_arch("arm:thumb")
+        self.assertLess(2 * (pool - load), arch.literal_pool_range)
+
+    def test_no_block_split(self):
+        """Targets without literal pool range keep large blocks"""
+        text = ir_to_assembly([self.compile("riscv", 250)], "riscv")
+        self.assertNotIn("splitted_block", text)
+
+
+class InstructionSchedulerTestCase(unittest.TestCase):
+    """Test the list scheduler for in-order targets"""
+
+    source = (
+        """
+    int dot(int *a, int *b, int *c) {
+        int s = 0;
+    """
+        + "".join(f"    s += a[{i}] * b[{i}] + c[{i}];\n" for i in range(8))
+        + """
+        return s;
+    }
+    """
+    )
+
+    def generate(self, arch, schedule):
+        """Generate the test function, and estimate its cycles"""
+        arch = get_arch(arch)
+        ir_module = c_to_ir(io.StringIO(self.source), arch)
+        optimize(ir_module, level=2)
+        code_generator = CodeGenerator(
+            arch, DummyReportGenerator(), optimize_for="speed"
+        )
+        scheduler = code_generator.instruction_scheduler
+        if not schedule:
+            code_generator.instruction_selector.scheduler = None
+        items = []
+        code_generator.generate(ir_module, FunctionOutputStream(items.append))
+        instructions = [i for i in items if isinstance(i, Instruction)]
+        return scheduler.count_cycles(instructions)
+
+    def test_selected_for_speed(self):
+        for arch, opt, scheduled in [
+            ("riscv", "speed", True),
+            ("riscv", "size", False),
+            ("xtensa", "speed", True),
+            ("x86_64", "speed", False),
+        ]:
+            with self.subTest(arch=arch, opt=opt):
+                code_generator = CodeGenerator(
+                    get_arch(arch), DummyReportGenerator(), optimize_for=opt
+                )
+                self.assertEqual(
+                    scheduled, code_generator.instruction_scheduler is not None
+                )
+
+    def test_fewer_cycles(self):
+        for arch in ["riscv", "or1k"]:
+            with self.subTest(arch=arch):
+                self.assertLess(
+                    self.generate(arch, True), self.generate(arch, False)
+                )
+
+    def test_memory_order(self):
+        """Loads may pass each other, but not a store"""
+        scheduler = CodeGenerator(
+            get_arch("riscv"), DummyReportGenerator(), optimize_for="speed"
+        ).instruction_scheduler
+        v1, v2, v3 = (RiscvRegister(f"v{i}") for i in range(1, 4))
+        load1 = Lw(v1, 0, FP)
+        add = Addi(v2, v1, 1)
+        load2 = Lw(v3, 4, FP)
+        store = Sw(v2, 8, FP)
+        load3 = Lw(v1, 8, FP)
+        units = [
+            ([load1], ScheduleUnit.LOAD),
+            ([add], ScheduleUnit.PURE),
+            ([load2], ScheduleUnit.LOAD),
+            ([store], ScheduleUnit.ORDERED),
+            ([load3], ScheduleUnit.LOAD),
+        ]
+        self.assertEqual(
+            [load1, load2, add, store, load3], scheduler.schedule(units)
+        )
+
+
+class StreamingEmissionTestCase(unittest.TestCase):
+    """Test that instructions are only kept when they are reported"""
+
+    source = "int add(int a, int b) { return a + b; }"
+
+    def test_dummy_reporter(self):
+        class Reporter(DummyReportGenerator):
+            def dump_instructions(self, instructions, arch):
+                raise AssertionError("Instructions are not collected")
+
+        ir_module = c_to_ir(io.StringIO(self.source), "riscv")
+        obj = ir_to_object([ir_module], "riscv", reporter=Reporter())
+        self.assertTrue(obj.byte_size)
+
+    def test_text_reporter(self):
+        f = io.StringIO()
+        reporter = TextReportGenerator(f)
+        ir_module = c_to_ir(io.StringIO(self.source), "riscv")
+        ir_to_object([ir_module], "riscv", reporter=reporter)
+        self.assertIn("add:", f.getvalue())
+
+    def test_debug_db_not_extended(self):
+        """Without debug info, the code generator does not add mappings
+        to the debug database of the module, which would keep all
+        instructions alive.
+        """
+        ir_module = c_to_ir(io.StringIO(self.source), "riscv")
+        n_mappings = len(ir_module.debug_db.mappings)
+        ir_to_object([ir_module], "riscv")
+        self.assertEqual(n_mappings, len(ir_module.debug_db.mappings))
+
+
 if __name__ == "__main__":
     unittest.main()
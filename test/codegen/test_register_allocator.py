@@ -1,7 +1,8 @@
+import io
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
-from ppci.api import get_arch
+from ppci.api import c_to_ir, get_arch, ir_to_assembly, optimize
 from ppci.arch.arch import Frame
 from ppci.arch.example import (
     R0,
@@ -21,6 +22,14 @@ from ppci.arch.x86_64.registers import (
     XmmRegisterSingle,
     xmm6,
 )
+from ppci.codegen.interferencegraph import (
+    CompactInterferenceGraph,
+    InterferenceGraph,
+)
+from ppci.codegen.linearscan import (
+    LinearScanRegisterAllocator,
+    LiveInterval,
+)
 from ppci.codegen.registerallocator import GraphColoringRegisterAllocator
 
 
@@ -188,5 +197,153 @@ class GraphColoringRegisterAllocatorTestCase(unittest.TestCase):
         assert frame.is_used(xmm6, arch.info.alias)
 
 
+class SetGraphColoringRegisterAllocatorTestCase(
+    GraphColoringRegisterAllocatorTestCase
+):
+    """Run the same cases using the interference graph with sets."""
+
+    def setUp(self):
+        super().setUp()
+        self.register_allocator.interference_graph_class = InterferenceGraph
+
+
+class InterferenceGraphClassTestCase(unittest.TestCase):
+    """The choice of interference graph does not change the allocation."""
+
+    source = """
+    int f(int a, int b, int c) {
+        int v0 = a + b, v1 = a * c, v2 = b - c, v3 = a - b, v4 = b * c;
+        int v5 = a - c, v6 = a + 7, v7 = b + 9, v8 = c * 3, v9 = a | c;
+        for (int i = 0; i < a; i++) {
+            if (v3 > i) v0 += v7; else v4 -= v1;
+            if (v8 < v2) v5 -= v9; else v6 += v0;
+            v1 = v2 * v5 + v6;
+            v9 = f(v4, v8, i) + v3;
+        }
+        return v0 + v1 + v2 + v3 + v4 + v5 + v6 + v7 + v8 + v9;
+    }
+    """
+
+    def compile(self, arch, graph_class):
+        with patch.object(
+            GraphColoringRegisterAllocator,
+            "interference_graph_class",
+            graph_class,
+        ):
+            ir_module = c_to_ir(io.StringIO(self.source), arch)
+            optimize(ir_module, level=2)
+            return ir_to_assembly([ir_module], arch)
+
+    def test_same_allocation(self):
+        for arch in ("arm", "msp430", "riscv", "x86_64"):
+            with self.subTest(arch=arch):
+                self.assertEqual(
+                    self.compile(arch, InterferenceGraph),
+                    self.compile(arch, CompactInterferenceGraph),
+                )
+
+
+class LinearScanRegisterAllocatorTestCase(unittest.TestCase):
+    """Use the example target to test the linear scan allocator."""
+
+    def setUp(self):
+        arch = get_arch("example")
+        self.register_allocator = LinearScanRegisterAllocator(arch, None, None)
+
+    def conflict(self, ta, tb):
+        self.assertNotEqual(ta.color, tb.color)
+
+    def test_register_allocation(self):
+        f = Frame("tst")
+        t1 = ExampleRegister("t1")
+        t2 = ExampleRegister("t2")
+        t3 = ExampleRegister("t3")
+        t4 = ExampleRegister("t4")
+        t5 = ExampleRegister("t5")
+        f.instructions.append(Def(t1))
+        f.instructions.append(Def(t2))
+        f.instructions.append(Def(t3))
+        f.instructions.append(Add(t4, t1, t2))
+        f.instructions.append(Add(t5, t4, t3))
+        f.instructions.append(Use(t5))
+        self.register_allocator.alloc_frame(f)
+        self.conflict(t1, t2)
+        self.conflict(t2, t3)
+        self.conflict(t1, t3)
+        self.conflict(t4, t3)
+        self.assertTrue(all(r.is_colored for r in (t1, t2, t3, t4, t5)))
+
+    def test_move_is_removed(self):
+        """A move between registers which share a register is removed"""
+        f = Frame("tst")
+        t1 = ExampleRegister("t1")
+        t2 = ExampleRegister("t2")
+        move = Mov(t2, t1, ismove=True)
+        f.instructions.append(Def(t1))
+        f.instructions.append(move)
+        f.instructions.append(Use(t2))
+        self.register_allocator.alloc_frame(f)
+        self.assertEqual(t1.color, t2.color)
+        self.assertNotIn(move, f.instructions)
+
+    def test_precolored(self):
+        """A virtual register cannot use a live physical register"""
+        f = Frame("tst")
+        t1 = ExampleRegister("t1")
+        f.instructions.append(Def(R0))
+        f.instructions.append(Def(t1))
+        f.instructions.append(Add(R1, t1, R0))
+        f.instructions.append(Use(R1))
+        self.register_allocator.alloc_frame(f)
+        self.conflict(t1, R0)
+        self.assertIn(R0, f.used_regs)
+
+    def test_clobbered_not_used(self):
+        """Registers which are only clobbered need not be saved"""
+        f = Frame("tst")
+        t1 = ExampleRegister("t1")
+        call = Use(t1)
+        call.clobbers = [R10]
+        f.instructions.append(Def(t1))
+        f.instructions.append(call)
+        self.register_allocator.alloc_frame(f)
+        self.assertNotIn(R10, f.used_regs)
+        self.assertIn(t1.get_real(), f.used_regs)
+
+    def test_blocked_without_victims(self):
+        """A register which is blocked through an alias of an active
+        register, but not by an interval of its own, is not selected.
+        """
+        allocator = self.register_allocator
+        allocator.spill_temps = set()
+        allocator.fixed = {}
+        allocator.alias = {R0: (R0, R1)}
+        allocator.cls_regs = {ExampleRegister: [R1]}
+        other = LiveInterval(ExampleRegister("t1"))
+        other.add_point(0)
+        other.add_point(10)
+        other.reg = R0
+        current = LiveInterval(ExampleRegister("t2"))
+        current.add_point(2)
+        current.add_point(4)
+        self.assertEqual(
+            (None, ()), allocator.select_victims(current, [other])
+        )
+
+    def test_constrained_move_by_alias(self):
+        """Aliased physical registers block a preferred register"""
+        f = Frame("tst")
+        t3 = ExampleRegister("t3")
+        move = Mov(t3, R10, ismove=True)
+        f.instructions.append(Def(R10))
+        f.instructions.append(move)
+        f.instructions.append(DefHalf(R10l))
+        f.instructions.append(UseHalf(R10l))
+        f.instructions.append(Use(t3))
+        self.register_allocator.alloc_frame(f)
+        self.assertNotEqual(R10.color, t3.color)
+        self.assertIn(move, f.instructions)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,12 +1,33 @@
 #!/usr/bin/python
 
+import random
 import unittest
 
-from ppci.arch.example import Add, Cmp, Def, DefUse, ExampleRegister, Use, Use3
+from ppci.arch.example import (
+    R0,
+    Add,
+    Cmp,
+    Def,
+    DefUse,
+    ExampleRegister,
+    Use,
+    Use3,
+)
 from ppci.arch.generic_instructions import Nop
 from ppci.codegen.flowgraph import FlowGraph
-from ppci.codegen.interferencegraph import InterferenceGraph
-from ppci.graph import DiGraph, DiNode, Graph, MaskableGraph, Node
+from ppci.codegen.interferencegraph import (
+    CompactInterferenceGraph,
+    InterferenceGraph,
+    RegisterInterference,
+)
+from ppci.graph import (
+    CompactGraph,
+    DiGraph,
+    DiNode,
+    Graph,
+    MaskableGraph,
+    Node,
+)
 
 
 class GraphTestCase(unittest.TestCase):
@@ -105,6 +126,95 @@ class GraphTestCase(unittest.TestCase):
         self.assertEqual(1, n1.degree)
 
 
+class CompactGraphTestCase(unittest.TestCase):
+    """Check that the compact graph behaves exactly like the maskable
+    graph, including the order of nodes and neighbours.
+    """
+
+    def test_degree_mask_unmask_combine(self):
+        g = CompactGraph()
+        n1 = Node(g)
+        n2 = Node(g)
+        n3 = Node(g)
+        n4 = Node(g)
+        g.add_edge(n1, n2)
+        g.add_edge(n1, n3)
+        g.add_edge(n1, n4)
+        g.add_edge(n2, n4)
+        self.assertEqual(3, n1.degree)
+        self.assertTrue(g.has_edge(n4, n1))
+        g.mask_node(n2)
+        g.mask_node(n3)
+        g.mask_node(n4)
+        self.assertEqual(0, n1.degree)
+        self.assertFalse(g.has_edge(n1, n4))
+        self.assertTrue(g.has_edge(n4, n1))
+        g.unmask_node(n3)
+        g.combine(n3, n4)
+        g.combine(n3, n2)
+        self.assertEqual(1, n1.degree)
+        self.assertTrue(g.has_edge(n1, n3))
+        self.assertEqual(1, g.get_number_of_edges())
+        self.assertEqual((n3,), tuple(g.adjecent(n1)))
+        self.assertEqual((n1,), tuple(g.adjecent(n3)))
+        self.assertEqual([n1, n3], list(g.nodes))
+
+    def test_random_operations(self):
+        rng = random.Random(7)
+        g1 = MaskableGraph()
+        g2 = CompactGraph()
+        nodes1 = [Node(g1) for _ in range(40)]
+        nodes2 = [Node(g2) for _ in range(40)]
+        for _ in range(120):
+            i, j = rng.randrange(40), rng.randrange(40)
+            g1.add_edge(nodes1[i], nodes1[j])
+            g2.add_edge(nodes2[i], nodes2[j])
+
+        for _ in range(400):
+            unmasked = [i for i, n in enumerate(nodes1) if n in g1.nodes]
+            masked = [i for i, n in enumerate(nodes1) if g1.is_masked(n)]
+            operation = rng.randrange(4)
+            if operation == 0 and len(unmasked) > 1:
+                i = rng.choice(unmasked)
+                g1.mask_node(nodes1[i])
+                g2.mask_node(nodes2[i])
+            elif operation == 1 and masked:
+                i = rng.choice(masked)
+                g1.unmask_node(nodes1[i])
+                g2.unmask_node(nodes2[i])
+            elif operation == 2 and len(unmasked) > 2:
+                i, j = rng.sample(unmasked, 2)
+                if not g1.has_edge(nodes1[i], nodes1[j]):
+                    g1.combine(nodes1[i], nodes1[j])
+                    g2.combine(nodes2[i], nodes2[j])
+                    del nodes1[j]
+                    del nodes2[j]
+            elif operation == 3 and len(unmasked) > 1:
+                i, j = rng.sample(unmasked, 2)
+                g1.add_edge(nodes1[i], nodes1[j])
+                g2.add_edge(nodes2[i], nodes2[j])
+            self.check_same(g1, nodes1, g2, nodes2)
+
+    def check_same(self, g1, nodes1, g2, nodes2):
+        self.assertEqual(len(nodes1), len(nodes2))
+        index1 = {n: i for i, n in enumerate(nodes1)}
+        index2 = {n: i for i, n in enumerate(nodes2)}
+        self.assertEqual(
+            [index1[n] for n in g1.nodes], [index2[n] for n in g2.nodes]
+        )
+        self.assertEqual(g1.get_number_of_edges(), g2.get_number_of_edges())
+        for n1, n2 in zip(nodes1, nodes2):
+            self.assertEqual(g1.is_masked(n1), g2.is_masked(n2))
+            self.assertEqual(
+                [index1[m] for m in g1.adjecent(n1)],
+                [index2[m] for m in g2.adjecent(n2)],
+            )
+            self.assertEqual(n1.degree, n2.degree)
+            for m1, m2 in zip(nodes1, nodes2):
+                if n1 in g1.nodes and m1 in g1.nodes:
+                    self.assertEqual(g1.has_edge(n1, m1), g2.has_edge(n2, m2))
+
+
 class DigraphTestCase(unittest.TestCase):
     def test_successor(self):
         g = DiGraph()
@@ -322,13 +432,88 @@ class InterferenceGraphTestCase(unittest.TestCase):
         instrs.append(Use(t2))
         cfg = FlowGraph(instrs)
         cfg.calculate_liveness()
+        for graph_class in (InterferenceGraph, CompactInterferenceGraph):
+            ig = graph_class()
+            ig.calculate_interference(cfg)
+            self.assertTrue(ig.interfere(t1, t3))
+            ig.combine(ig.get_node(t4), ig.get_node(t3))
+            self.assertIs(ig.get_node(t4), ig.get_node(t3))
+            self.assertTrue(ig.interfere(t1, t4))
+            self.assertFalse(ig.interfere(t1, t1))
+
+            # For repr called:
+            self.assertTrue(str(ig.get_node(t4)))
+
+    def test_instruction_liveness(self):
+        """Test liveness of instructions within a single node"""
+        t1 = ExampleRegister("t1")
+        t2 = ExampleRegister("t2")
+        t3 = ExampleRegister("t3")
+        i1 = Def(t1)
+        i2 = Def(t2)
+        i3 = DefUse(t3, t1)
+        i4 = Use3(t1, t2, t3)
+        cfg = FlowGraph([i1, i2, i3, i4])
+        cfg.calculate_liveness()
+        self.assertEqual(1, len(cfg))
+        gen, kill, live_in, live_out = cfg.get_liveness(i3)
+        self.assertEqual({t1}, gen)
+        self.assertEqual({t3}, kill)
+        self.assertEqual({t1, t2}, live_in)
+        self.assertEqual({t1, t2, t3}, live_out)
+        self.assertEqual([(i2, i3), (i3, i4)], cfg.live_ranges(t2))
+
+    def test_update_after_spill(self):
+        """Updating liveness and interference after spilling gives the
+        same result as calculating them again.
+        """
+        t1 = ExampleRegister("t1")
+        t2 = ExampleRegister("t2")
+        t3 = ExampleRegister("t3")
+        t4 = ExampleRegister("t4")
+        t5 = ExampleRegister("t5")
+        t6 = ExampleRegister("t6")
+        i1 = DefUse(t1, t4)
+        i3 = DefUse(t3, t2)
+        i2 = Def(t2, jumps=[i3])
+        i4 = DefUse(t4, t1, jumps=[i1])
+        instrs = [i1, i2, i3, i4]
+        cfg = FlowGraph(instrs)
+        cfg.calculate_liveness()
+        interference = RegisterInterference(cfg)
+
+        # Spill t1, using R0 as frame pointer:
+        i1.replace_register(t1, t5)
+        store = Cmp(t5, R0)
+        i4.replace_register(t1, t6)
+        load = DefUse(t6, R0)
+        instrs = [i1, store, i2, i3, load, i4]
+        nodes = cfg.update(instrs, [t1])
+        interference.update(nodes, [t1])
         ig = InterferenceGraph()
-        ig.calculate_interference(cfg)
-        ig.combine(ig.get_node(t4), ig.get_node(t3))
-        self.assertIs(ig.get_node(t4), ig.get_node(t3))
-
-        # For repr called:
-        self.assertTrue(str(ig.get_node(t4)))
+        ig.add_interference(interference)
+
+        cfg2 = FlowGraph(instrs)
+        cfg2.calculate_liveness()
+        ig2 = InterferenceGraph()
+        ig2.calculate_interference(cfg2)
+
+        for ins in instrs:
+            self.assertEqual(cfg2.get_liveness(ins), cfg.get_liveness(ins))
+        self.assertEqual(self.edges(ig2), self.edges(ig))
+        self.assertFalse(ig.has_node(t1))
+        self.assertTrue(ig.interfere(R0, t2))
+        self.assertEqual([load], ig.defs(t6))
+
+    @staticmethod
+    def edges(ig):
+        return {
+            (tmp, tmp2)
+            for node in ig
+            for tmp in node.temps
+            for node2 in ig.adjecent(node)
+            for tmp2 in node2.temps
+        }
 
 
 if __name__ == "__main__":
@@ -2,8 +2,12 @@ import io
 import unittest
 from unittest.mock import Mock
 
-from ppci import api, irutils
-from ppci.lang.python import load_py, python_to_ir
+from ppci import api, ir, irutils, wasm
+from ppci.arch.arch_info import TypeInfo
+from ppci.graph.cfg import ir_function_to_graph
+from ppci.lang.python import ir_to_python, load_py, python_to_ir
+from ppci.lang.python.ir2py import irpy_runtime_code
+from ppci.lang.python.ranges import ValueRanges
 from ppci.utils.reporting import html_reporter
 
 from ..helper_util import make_filename
@@ -141,5 +145,217 @@ class PythonToIrCompilerTestCase(unittest.TestCase):
         self.do(src7)
 
 
+ir_loop = """module m;
+global function i32 sum(i32 n) {
+  block0: {
+    i32 zero = 0;
+    jmp block2;
+  }
+  block1: {
+    i32 s2 = s + i;
+    i32 one = 1;
+    i32 i2 = i + one;
+    jmp block2;
+  }
+  block2: {
+    i32 s = phi block0: zero, block1: s2;
+    i32 i = phi block0: zero, block1: i2;
+    cjmp i < n ? block1 : block3;
+  }
+  block3: {
+    return s;
+  }
+}
+"""
+
+# Both blocks of the loop can be entered from the first block:
+ir_irreducible = """module m;
+global function i32 count(i32 n) {
+  block0: {
+    i32 zero = 0;
+    i32 one = 1;
+    cjmp n < zero ? block1 : block2;
+  }
+  block1: {
+    i32 a = phi block0: zero, block2: b2;
+    i32 a2 = a + one;
+    cjmp a2 < n ? block2 : block3;
+  }
+  block2: {
+    i32 b = phi block0: one, block1: a2;
+    i32 b2 = b + one;
+    cjmp b2 < n ? block1 : block3;
+  }
+  block3: {
+    i32 c = phi block1: a2, block2: b2;
+    return c;
+  }
+}
+"""
+
+# Leaving both loops with br 2 or br_if $found, and continuing the outer
+# loop from the inner loop, need multi-level exits:
+wasm_nested_exit = """
+(module
+  (func (export "find") (param $n i32) (param $m i32) (result i32)
+    (local $i i32) (local $j i32)
+    (block $found
+      (block $not_found
+        (loop $outer
+          (local.set $j (i32.const 0))
+          (loop $inner
+            (br_if 2 (i32.gt_s (local.get $j) (local.get $m)))
+            (br_if $found
+              (i32.eq (i32.mul (local.get $i) (local.get $j)) (local.get $m)))
+            (local.set $j (i32.add (local.get $j) (i32.const 1)))
+            (br_if $inner (i32.lt_s (local.get $j) (local.get $n))))
+          (local.set $i (i32.add (local.get $i) (i32.const 1)))
+          (br_if $not_found (i32.ge_s (local.get $i) (local.get $n)))
+          (br $outer)))
+      (return (i32.const -1)))
+    (i32.add (i32.mul (local.get $i) (i32.const 100)) (local.get $j)))
+  (func (export "skip") (param $n i32) (result i32)
+    (local $i i32) (local $j i32) (local $s i32)
+    (block $done
+      (loop $outer
+        (local.set $i (i32.add (local.get $i) (i32.const 1)))
+        (br_if $done (i32.gt_s (local.get $i) (local.get $n)))
+        (local.set $j (i32.const 0))
+        (loop $inner
+          (local.set $j (i32.add (local.get $j) (i32.const 1)))
+          (br_if $outer (i32.eq (local.get $j) (local.get $i)))
+          (br_if $done (i32.gt_s (local.get $s) (i32.const 100)))
+          (local.set $s (i32.add (local.get $s) (local.get $j)))
+          (br $inner))))
+    (local.get $s)))
+"""
+
+
+class IrToPythonTestCase(unittest.TestCase):
+    """Check the generation of python code from ir"""
+
+    def compile(self, src, counters=False):
+        ir_module = irutils.read_module(io.StringIO(src))
+        f = io.StringIO()
+        ir_to_python([ir_module], f, counters=counters)
+        namespace = {}
+        exec(f.getvalue(), namespace)
+        return f.getvalue(), namespace
+
+    def test_structured_loop(self):
+        """Reducible control flow is generated as a while loop"""
+        code, namespace = self.compile(ir_loop)
+        self.assertIn("while True:", code)
+        self.assertNotIn("_irpy_current_block", code)
+
+        # The loop counter cannot overflow, but the sum can:
+        self.assertNotIn("i2 = (", code)
+        self.assertIn("s2 = (", code)
+        self.assertEqual(0, namespace["sum"](0))
+        self.assertEqual(45, namespace["sum"](10))
+
+    def test_structured_wasm_exits(self):
+        """Jumps out of nested wasm blocks need no block switch"""
+        ir_module = wasm.wasm_to_ir(
+            wasm.Module(wasm_nested_exit), TypeInfo(4, 4)
+        )
+        f = io.StringIO()
+        ir_to_python([ir_module], f)
+        code = f.getvalue()
+        self.assertNotIn("_irpy_current_block", code)
+        self.assertIn("_irpy_exit = ", code)
+        namespace = {}
+        exec(code, namespace)
+        find = namespace["find"]
+        self.assertEqual(304, find(5, 12))
+        self.assertEqual(-1, find(3, 100))
+        self.assertEqual(-1, find(5, 2))
+        skip = namespace["skip"]
+        self.assertEqual(20, skip(5))
+        self.assertEqual(105, skip(20))
+
+    def test_irreducible_fallback(self):
+        """Irreducible control flow is generated as a block switch"""
+        code, namespace = self.compile(ir_irreducible)
+        self.assertIn("_irpy_current_block < ", code)
+        self.assertEqual(2, namespace["count"](1))
+        self.assertEqual(10, namespace["count"](10))
+
+    def test_counters(self):
+        """Functions count their calls and loop iterations"""
+        _, namespace = self.compile(ir_loop, counters=True)
+        counters = namespace["rt"].counters["sum"]
+        self.assertEqual([0, 0], counters)
+        namespace["sum"](10)
+        namespace["sum"](5)
+        self.assertEqual([2, 17], counters)
+
+        _, namespace = self.compile(ir_irreducible, counters=True)
+        namespace["count"](10)
+        self.assertEqual(1, namespace["rt"].counters["count"][0])
+
+    def test_safe_points(self):
+        """Counting functions call the safe point every 1024 counts"""
+        _, namespace = self.compile(ir_loop, counters=True)
+        rt = namespace["rt"]
+        rt.safe_point = Mock()
+        namespace["sum"](3000)
+        self.assertEqual(3001, rt.counters["sum"][1])
+        self.assertEqual(2, rt.safe_point.call_count)
+
+    def make_runtime(self, checks):
+        f = io.StringIO()
+        irpy_runtime_code(f, checks=checks)
+        namespace = {}
+        exec(f.getvalue(), namespace)
+        return f.getvalue(), namespace["rt"]
+
+    def test_memory_access(self):
+        _, rt = self.make_runtime(True)
+        rt.heap.extend(bytes(8))
+        address = rt.HEAP_START + 4
+        rt.store_i32(address, -5)
+        self.assertEqual(-5, rt.load_i32(address))
+        self.assertEqual(0xFFFFFFFB, rt.load_u32(address))
+        self.assertEqual(bytes([0xFB, 0xFF]), rt.read_mem(address, 2))
+        with self.assertRaises(AssertionError):
+            rt.load_i32(address + 2)
+
+    def test_memory_access_without_checks(self):
+        code, rt = self.make_runtime(False)
+        self.assertNotIn("assert", code)
+        alloc = rt.alloca(8)
+        rt.store_f64(alloc[0], 2.5)
+        self.assertEqual(2.5, rt.load_f64(alloc[0]))
+        rt.free(8)
+        self.assertEqual(0, len(rt.stack))
+
+        # Negative addresses do not wrap around to the end of the stack:
+        rt.alloca(8)
+        with self.assertRaises(IndexError):
+            rt.load_i32(-4)
+        with self.assertRaises(IndexError):
+            rt.write_mem(-4, bytes(4))
+
+
+class ValueRangesTestCase(unittest.TestCase):
+    """Check the value range analysis of the python backend"""
+
+    def test_loop_counter(self):
+        ir_module = irutils.read_module(io.StringIO(ir_loop))
+        ir_function = ir_module["sum"]
+        ranges = ValueRanges(ir_function, *ir_function_to_graph(ir_function))
+        values = {
+            ins.name: ins
+            for block in ir_function.blocks
+            for ins in block
+            if isinstance(ins, ir.Value)
+        }
+        self.assertEqual((0, 2**31 - 1), ranges.ranges[values["i"]])
+        self.assertEqual((1, 2**31 - 1), ranges.raw_ranges[values["i2"]])
+        self.assertFalse(ranges.needs_wrap(values["i2"]))
+        self.assertTrue(ranges.needs_wrap(values["s2"]))
+
+
 if __name__ == "__main__":
     unittest.main()
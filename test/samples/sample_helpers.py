@@ -163,7 +163,7 @@ def build(
 
     # Save object:
     obj_file = base_filename.with_suffix(".oj")
-    with obj_file.open("w") as f:
+    with obj_file.open("wb") as f:
         obj.save(f)
 
     if elf_format:
@@ -2,11 +2,20 @@ import io
 import unittest
 from unittest.mock import patch
 
-from ppci.api import get_arch, link
+from ppci.api import cc, get_arch, link
 from ppci.arch.example import R0, R1, ExampleArch, Mov
-from ppci.binutils import layout
-from ppci.binutils.objectfile import Image, ObjectFile, deserialize, serialize
+from ppci.arch.generic_instructions import Label
+from ppci.arch.riscv.rvc_instructions import CB, CJ
+from ppci.binutils import debuginfo, layout
+from ppci.binutils.objectfile import (
+    OBJECT_MAGIC,
+    Image,
+    ObjectFile,
+    deserialize,
+    serialize,
+)
 from ppci.binutils.outstream import (
+    BinaryOutputStream,
     DummyOutputStream,
     TextOutputStream,
     binary_and_logging_stream,
@@ -70,6 +79,34 @@ class LinkerTestCase(unittest.TestCase):
         object2.add_symbol(0, "a", "global", 24, ".text", "object", 0)
         link([object1, object2])
 
+    def make_jumps(self, jump, n):
+        """Make an object file with a jump over n jumps to the next
+        instruction.
+        """
+        obj = ObjectFile(get_arch("riscv:rvc"))
+        stream = BinaryOutputStream(obj)
+        stream.select_section("code")
+        stream.emit(jump("end"))
+        for i in range(n):
+            stream.emit(jump(f"l{i}"))
+            stream.emit(Label(f"l{i}"))
+        stream.emit(Label("end"))
+        return obj
+
+    def test_relaxation(self):
+        """Test that jumps are relaxed until no jump can be relaxed.
+
+        The first jump is only in range of a short jump after the other
+        jumps are relaxed.
+        """
+        obj = link([self.make_jumps(CB, 520)])
+        expected = link([self.make_jumps(CJ, 520)])
+        self.assertEqual(1042, obj.get_section("code").size)
+        self.assertEqual(
+            expected.get_section("code").data, obj.get_section("code").data
+        )
+        self.assertEqual({"bc_imm11"}, {r.reloc_type for r in obj.relocations})
+
     def test_symbol_values(self):
         """Check if values are correctly resolved"""
         arch = get_arch("arm")
@@ -178,6 +215,47 @@ class ObjectFileTestCase(unittest.TestCase):
         object3 = deserialize(serialize(object1))
         self.assertEqual(object3, object1)
 
+    def test_binary_save_and_load(self):
+        object1, object2 = self.make_twins()
+        object1.entry_symbol_id = 0
+        f1 = io.BytesIO()
+        object1.save(f1)
+        self.assertTrue(f1.getvalue().startswith(OBJECT_MAGIC))
+        f2 = io.BytesIO(f1.getvalue())
+        object3 = ObjectFile.load(f2)
+        self.assertEqual(object3, object1)
+        self.assertEqual(0, object3.entry_symbol_id)
+        self.assertIsNone(object3.get_symbol("A").value)
+
+    def test_binary_debug_info(self):
+        """Test that debug information is decoded when it is used."""
+        source = io.StringIO("int f(int a) { return a + 1; }")
+        object1 = cc(source, "riscv", debug=True)
+        f1 = io.BytesIO()
+        object1.save(f1)
+        object2 = ObjectFile.load(io.BytesIO(f1.getvalue()))
+        self.assertIsNone(object2._debug_info)
+
+        # Saving again keeps the debug information as it is:
+        f2 = io.BytesIO()
+        object2.save(f2)
+        self.assertEqual(f1.getvalue(), f2.getvalue())
+        self.assertEqual(
+            debuginfo.serialize(object1.debug_info),
+            debuginfo.serialize(object2.debug_info),
+        )
+
+    def test_load_json_from_binary_file(self):
+        """Test that objects saved as json can be loaded from a file
+        opened in binary mode.
+        """
+        object1, object2 = self.make_twins()
+        f1 = io.StringIO()
+        object1.save(f1)
+        f2 = io.BytesIO(f1.getvalue().encode("utf-8"))
+        object3 = ObjectFile.load(f2)
+        self.assertEqual(object3, object1)
+
     def test_overlapping_sections(self):
         """Check that overlapping sections are detected"""
         obj = ObjectFile(get_arch("msp430"))
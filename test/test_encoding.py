@@ -1,12 +1,15 @@
+import io
 import unittest
 
+from ppci import api
 from ppci.arch.arm import arm_instructions
 from ppci.arch.arm import registers as arm_registers
 from ppci.arch.arm.arm_instructions import ArmToken
 from ppci.arch.avr import instructions as avr_instructions
 from ppci.arch.avr import registers as avr_registers
-from ppci.arch.encoding import Syntax
-from ppci.arch.token import Token, bit_range
+from ppci.arch.encoding import Instruction, Operand, Syntax
+from ppci.arch.token import Token, bit_concat, bit_range
+from ppci.binutils.outstream import FunctionOutputStream
 
 
 class TokenTestCase(unittest.TestCase):
@@ -35,6 +38,106 @@ class TokenTestCase(unittest.TestCase):
         self.assertEqual(0x0D10, my_token.bit_value)
 
 
+class MyToken(Token):
+    class Info:
+        size = 16
+
+    op = bit_range(12, 16)
+    hi = bit_range(8, 12)
+    lo = bit_range(0, 8)
+    imm12 = bit_concat(hi, lo)
+
+
+class MyImm(Instruction):
+    tokens = [MyToken]
+    imm = Operand("imm", int)
+    syntax = Syntax(["imm", " ", imm])
+    patterns = {"op": 5, "hi": 0, "lo": imm}
+
+
+class MyImm12(Instruction):
+    tokens = [MyToken]
+    imm = Operand("imm", int)
+    syntax = Syntax(["imm12", " ", imm])
+    patterns = {"op": 6, "imm12": imm}
+
+
+class MySub(MyImm):
+    syntax = Syntax(["sub", " ", MyImm.imm])
+    patterns = {"op": 7, "hi": 1, "lo": MyImm.imm}
+
+    def encode(self):
+        return super().encode()
+
+
+class EncodeTestCase(unittest.TestCase):
+    """Test the encoders which are generated for instruction classes"""
+
+    def test_generated_encoder(self):
+        self.assertEqual(bytes([0x12, 0x50]), MyImm(0x12).encode())
+        self.assertEqual("encode_MyImm", MyImm.encode.__name__)
+
+    def test_negative_value(self):
+        """Negative values wrap around, like when setting the token"""
+        self.assertEqual(bytes([0xFE, 0x50]), MyImm(-2).encode())
+
+    def test_value_too_large(self):
+        with self.assertRaisesRegex(ValueError, "cannot be fit"):
+            MyImm(0x100).encode()
+
+    def test_concatenated_field(self):
+        instruction = MyImm12(0x1234)
+        self.assertEqual(bytes([0x34, 0x62]), instruction.encode())
+        self.assertEqual(Instruction.encode(instruction), instruction.encode())
+
+    def test_super_encode(self):
+        """A subclass can use the encode method of its base class"""
+        self.assertEqual(bytes([0x12, 0x50]), MyImm(0x12).encode())
+        self.assertEqual(bytes([0x12, 0x71]), MySub(0x12).encode())
+
+    def test_same_as_generic_encoder(self):
+        instruction = avr_instructions.Add(avr_registers.r1, avr_registers.r18)
+        self.assertEqual(Instruction.encode(instruction), instruction.encode())
+
+    def test_sub_constructor(self):
+        """Instructions with sub constructors are encoded per shape"""
+        shifts = [arm_instructions.ShiftLsr(4), arm_instructions.NoShift()]
+        for shift in shifts:
+            instruction = arm_instructions.Cmp2(
+                arm_registers.R4, arm_registers.R11, shift
+            )
+            self.assertEqual(
+                Instruction.encode(instruction), instruction.encode()
+            )
+
+    def test_same_as_generic_encoder_on_archs(self):
+        """Compiled code is encoded the same as with the generic encoder"""
+        source = """
+        int f(int *a, int n, char c) {
+            int s = 0;
+            for (int i = 0; i < n; i++) {
+                s += a[i] * c - (s >> 2);
+                if (s > 100) s -= a[i + 1];
+            }
+            return s;
+        }
+        """
+        for arch in ["arm", "microblaze", "mips", "msp430", "or1k", "riscv"]:
+            with self.subTest(arch=arch):
+                ir_module = api.c_to_ir(io.StringIO(source), arch)
+                instructions = []
+                api.ir_to_stream(
+                    ir_module, arch, FunctionOutputStream(instructions.append)
+                )
+                for instruction in instructions:
+                    encode = type(instruction).encode
+                    if not getattr(encode, "encodes_patterns", False):
+                        continue  # Hand written encoder
+                    self.assertEqual(
+                        Instruction.encode(instruction), instruction.encode()
+                    )
+
+
 class SyntaxTestCase(unittest.TestCase):
     def test_lower_case(self):
         """A TypeError is raised when syntax contains mixed casing"""
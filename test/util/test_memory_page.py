@@ -1,6 +1,6 @@
 import unittest
 
-from ppci.utils.memory_page import MemoryPage
+from ppci.utils.memory_page import MemoryPage, ReservedMemory
 
 
 class MemoryPageTestCase(unittest.TestCase):
@@ -17,3 +17,25 @@ class MemoryPageTestCase(unittest.TestCase):
         p.seek(8)
         data = p.read(6)
         self.assertEqual(data, bytes([9, 88, 89, 92, 13, 0]))
+
+
+class ReservedMemoryTestCase(unittest.TestCase):
+    def test_grow_in_place(self):
+        memory = ReservedMemory(1024 * 1024, 100)
+        addr = memory.addr
+        memory.write(10, bytes([1, 2, 3]))
+        memory.commit(300000)
+        self.assertEqual(addr, memory.addr)
+        self.assertGreaterEqual(memory.size, 300000)
+        self.assertEqual(memory.read(9, 5), bytes([0, 1, 2, 3, 0]))
+        memory.write(299990, bytes([7, 8]))
+        self.assertEqual(memory.read(299990, 2), bytes([7, 8]))
+
+    def test_bounds(self):
+        memory = ReservedMemory(1024 * 1024, 100)
+        with self.assertRaises(IndexError):
+            memory.read(memory.size - 2, 4)
+        with self.assertRaises(IndexError):
+            memory.write(-1, bytes([1]))
+        with self.assertRaises(ValueError):
+            memory.commit(2 * 1024 * 1024)
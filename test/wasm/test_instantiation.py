@@ -1,11 +1,17 @@
 """Test the ppci.wasm.instantiate function"""
 
 import math
+import os
+import tempfile
 import unittest
+from unittest import mock
 
-from ppci.api import is_platform_supported
+from ppci import ir
+from ppci.api import get_current_arch, is_platform_supported
 from ppci.utils.reporting import html_reporter
-from ppci.wasm import Module, instantiate
+from ppci.wasm import Module, WasmTrapException, instantiate, wasm_to_ir
+from ppci.wasm.execution import _traps as traps
+from ppci.wasm.execution._cache import ModuleCache
 
 from ..helper_util import make_filename
 
@@ -134,3 +140,289 @@ class WasmInstantiationTestCase(unittest.TestCase):
         self.assertEqual(b"abcd", instance.exports.mem0ry[0:4])
         instance.exports.mem0ry[1:3] = bytes([1, 2])
         self.assertEqual(b"a\x01\x02d", instance.exports.mem0ry[0:4])
+
+    @unittest.skipUnless(is_platform_supported(), "native code not supported")
+    def test_native_memory_grow(self):
+        """Native memory grows in place and keeps its data"""
+        module = Module(
+            """
+            (module
+              (memory (export "memory") 1 4)
+              (func (export "grow") (param i32) (result i32)
+                (memory.grow (local.get 0)))
+              (func (export "load") (param i32) (result i32)
+                (i32.load (local.get 0)))
+              (func (export "store") (param i32 i32)
+                (i32.store (local.get 0) (local.get 1)))
+            )
+            """
+        )
+        instance = instantiate(module, target="native")
+        memory = instance._memories[0]
+        addr = memory._memory.addr
+        instance.exports.store(100, 1234)
+        self.assertEqual(1, instance.exports.grow(2))
+        self.assertEqual(3, memory.size())
+        self.assertEqual(addr, memory._memory.addr)
+        self.assertEqual(1234, instance.exports.load(100))
+        instance.exports.store(3 * 65536 - 4, 5678)
+        self.assertEqual(5678, instance.exports.load(3 * 65536 - 4))
+        self.assertEqual(-1, instance.exports.grow(2))
+        self.assertEqual(3, memory.size())
+
+
+checked_src = """
+(module
+  (memory (export "memory") 1 4)
+  (func (export "grow") (param i32) (result i32)
+    (memory.grow (local.get 0)))
+  (func (export "load") (param i32) (result i32)
+    (i32.load (local.get 0)))
+  (func (export "load_offset") (param i32) (result i32)
+    (i32.load offset=65532 (local.get 0)))
+  (func (export "store") (param i32 i32)
+    (i32.store (local.get 0) (local.get 1)))
+)
+"""
+
+
+@unittest.skipUnless(traps.is_supported(), "traps not supported")
+class MemoryChecksTestCase(unittest.TestCase):
+    def test_explicit_checks(self):
+        self.check_memory_checks("explicit")
+
+    def test_guard_pages(self):
+        self.check_memory_checks("guard")
+
+    def check_memory_checks(self, memory_checks):
+        module = Module(checked_src)
+        instance = instantiate(
+            module, target="native", memory_checks=memory_checks
+        )
+        exports = instance.exports
+        exports.store(100, 1234)
+        self.assertEqual(1234, exports.load(100))
+        self.assertEqual(0, exports.load(65532))
+        self.assertEqual(0, exports.load_offset(0))
+        for address in (65533, -1, 0x7FFFFFFF):
+            with self.assertRaises(WasmTrapException):
+                exports.load(address)
+        with self.assertRaises(WasmTrapException):
+            exports.load_offset(1)
+        with self.assertRaises(WasmTrapException):
+            exports.store(65536, 5)
+
+        # The memory is usable after a trap, and checks use the new size:
+        self.assertEqual(1, exports.grow(1))
+        exports.store(65536, 5)
+        self.assertEqual(5, exports.load(65536))
+        self.assertEqual(1234, exports.load(100))
+        with self.assertRaises(WasmTrapException):
+            exports.load(2 * 65536)
+
+    def test_no_checks_in_guard_mode(self):
+        """Guard pages replace the compare and branch of each access"""
+        module = Module(checked_src)
+        ptr_info = get_current_arch().info.get_type_info("ptr")
+        n_jumps = {}
+        for memory_checks in (None, "explicit", "guard"):
+            ir_module = wasm_to_ir(
+                module, ptr_info, memory_checks=memory_checks
+            )
+            n_jumps[memory_checks] = sum(
+                isinstance(instruction, ir.CJump)
+                for function in ir_module.functions
+                for block in function
+                for instruction in block
+            )
+        self.assertEqual(n_jumps[None], n_jumps["guard"])
+        self.assertEqual(n_jumps[None] + 3, n_jumps["explicit"])
+
+
+class ModuleCacheTestCase(unittest.TestCase):
+    def test_python_cache(self):
+        self.check_cache("python", "_python_instance.compile_python")
+
+    @unittest.skipUnless(is_platform_supported(), "native code not supported")
+    def test_native_cache(self):
+        self.check_cache("native", "_native_instance.wasm_to_ir")
+
+    def check_cache(self, target, compiler):
+        module = Module(src)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            instance = instantiate(module, target=target, cache_dir=cache_dir)
+            self.assertEqual(6.0, instance.exports["f64.mul_sqrts"](4, 9))
+            self.assertEqual(1, len(os.listdir(cache_dir)))
+
+            # The second time, the module is not compiled:
+            with mock.patch(
+                "ppci.wasm.execution." + compiler,
+                side_effect=AssertionError("compiled again"),
+            ):
+                instance = instantiate(
+                    module, target=target, cache_dir=cache_dir
+                )
+            self.assertEqual(6.0, instance.exports["f64.mul_sqrts"](4, 9))
+
+    def test_corrupt_entry(self):
+        """Unusable entries are removed"""
+        module = Module(src)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ModuleCache(cache_dir)
+            key = cache.make_key(module, "python", counters=False)
+            self.assertNotEqual(key, cache.make_key(module, "native"))
+            with open(cache.filename(key), "wb") as f:
+                f.write(b"garbage")
+            with self.assertLogs("wasm-cache", level="WARNING"):
+                self.assertIsNone(cache.load(key))
+            self.assertFalse(os.path.exists(cache.filename(key)))
+
+            instance = instantiate(
+                module, target="python", cache_dir=cache_dir
+            )
+            self.assertEqual(6.0, instance.exports["f64.mul_sqrts"](4, 9))
+            self.assertTrue(os.path.exists(cache.filename(key)))
+
+    def test_eviction(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ModuleCache(cache_dir, max_size=2500)
+            for n in range(5):
+                cache.save(str(n), bytes(1000))
+                os.utime(cache.filename(str(n)), (n, n))
+            self.assertEqual(2, len(cache.entries()))
+            self.assertIsNone(cache.load("0"))
+            self.assertEqual(bytes(1000), cache.load("3"))
+            self.assertEqual(bytes(1000), cache.load("4"))
+
+    def test_cache_file_deprecated(self):
+        with self.assertWarns(DeprecationWarning):
+            instantiate(Module(src), target="python", cache_file="x.cache")
+
+
+tiered_src = """
+(module
+  (type $t (func (param i32) (result i32)))
+  (memory (export "memory") 1)
+  (global $counter (export "counter") (mut i32) (i32.const 0))
+  (table 2 funcref)
+  (elem (i32.const 0) $double $square)
+  (func $double (type $t) (i32.mul (local.get 0) (i32.const 2)))
+  (func $square (type $t) (i32.mul (local.get 0) (local.get 0)))
+  (func (export "apply") (param i32 i32) (result i32)
+    (global.set $counter (i32.add (global.get $counter) (i32.const 1)))
+    (i32.store (i32.const 16) (global.get $counter))
+    (call_indirect (type $t) (local.get 1) (local.get 0)))
+  (func (export "loop") (param i32) (result i32)
+    (local i32)
+    (block
+      (loop
+        (br_if 1 (i32.ge_s (local.get 1) (local.get 0)))
+        (local.set 1 (i32.add (local.get 1) (i32.const 1)))
+        (br 0)))
+    (local.get 1))
+)
+"""
+
+# A long running function, which calls a host function and another wasm
+# function in its loop:
+tiered_run_src = """
+(module
+  (import "env" "tick" (func $tick))
+  (memory (export "memory") 1)
+  (global $total (export "total") (mut i32) (i32.const 0))
+  (func $add (param i32)
+    (global.set $total (i32.add (global.get $total) (local.get 0)))
+    (i32.store (i32.const 8) (global.get $total)))
+  (func (export "run") (param i32) (result i32)
+    (local i32)
+    (block
+      (loop
+        (br_if 1 (i32.ge_s (local.get 1) (local.get 0)))
+        (call $tick)
+        (call $add (local.get 1))
+        (local.set 1 (i32.add (local.get 1) (i32.const 1)))
+        (br 0)))
+    (i32.load (i32.const 8)))
+)
+"""
+
+
+class TieredInstantiationTestCase(unittest.TestCase):
+    @unittest.skipUnless(is_platform_supported(), "native code not supported")
+    def test_tier_up(self):
+        """The state is kept when switching to native code"""
+        instance = instantiate(Module(tiered_src), target="tiered")
+        self.assertEqual("python", instance.tier)
+        self.assertEqual(10, instance.exports.apply(0, 5))
+        self.assertEqual(25, instance.exports.apply(1, 5))
+        self.assertEqual(7, instance.exports.loop(7))
+        self.assertEqual(2, instance.counters["apply"][0])
+        self.assertEqual(8, instance.counters["loop"][1])
+
+        instance.tier_up()
+        self.assertEqual("native", instance.tier)
+        self.assertEqual(2, instance.exports.counter.read())
+        self.assertEqual(bytes([2, 0, 0, 0]), instance.exports.memory[16:20])
+        self.assertEqual(36, instance.exports.apply(1, 6))
+        self.assertEqual(12, instance.exports.apply(0, 6))
+        self.assertEqual(4, instance.exports.counter.read())
+        self.assertEqual(bytes([4, 0, 0, 0]), instance.exports.memory[16:20])
+        self.assertEqual(1000, instance.exports.loop(1000))
+
+    @unittest.skipUnless(is_platform_supported(), "native code not supported")
+    def test_hot_module(self):
+        """Hot modules are compiled in the background"""
+        instance = instantiate(Module(tiered_src), target="tiered")
+        instance.check_period = 0
+        instance.threshold = 100
+        instance.exports.loop(200)
+        instance.exports.loop(1)
+        instance._thread.join()
+        self.assertEqual(5, instance.exports.loop(5))
+        self.assertEqual("native", instance.tier)
+
+    @unittest.skipUnless(is_platform_supported(), "native code not supported")
+    def test_tier_up_while_running(self):
+        """Running python code calls native code once it is compiled"""
+        self.check_tier_up_while_running(None)
+
+    @unittest.skipUnless(traps.is_supported(), "traps not supported")
+    def test_tier_up_while_running_with_traps(self):
+        self.check_tier_up_while_running("guard")
+
+    def check_tier_up_while_running(self, memory_checks):
+        tiers = []
+
+        def tick() -> None:
+            # Wait for the background compilation to finish:
+            if instance._thread:
+                instance._thread.join()
+            tiers.append(instance.tier)
+
+        instance = instantiate(
+            Module(tiered_run_src),
+            imports={"env": {"tick": tick}},
+            target="tiered",
+            memory_checks=memory_checks,
+        )
+        instance.check_period = 0
+        instance.threshold = 100
+        self.assertEqual(4498500, instance.exports.run(3000))
+        self.assertEqual("python", tiers[0])
+        self.assertEqual("mixed", tiers[-1])
+        self.assertEqual(4498500, instance.exports.total.read())
+        n_calls = sum(c[0] for c in instance.counters.values())
+        self.assertLess(n_calls, 3001)
+
+        self.assertEqual(4498545, instance.exports.run(10))
+        self.assertEqual("native", instance.tier)
+        self.assertEqual(4498545, instance.exports.total.read())
+
+    def test_python_only(self):
+        """Without native code, the module keeps running as python"""
+        instance = instantiate(Module(tiered_src), target="tiered")
+        instance._can_tier_up = False
+        instance.threshold = 1
+        self.assertEqual(3000, instance.exports.loop(3000))
+        self.assertEqual(3000, instance.exports.loop(3000))
+        self.assertEqual("python", instance.tier)
@@ -2,7 +2,15 @@ import io
 import unittest
 
 from ppci import api
-from ppci.wasm import ir_to_wasm, read_wasm, read_wat, wasm_to_ir
+from ppci.wasm import (
+    Module,
+    components,
+    ir_to_wasm,
+    read_wasm,
+    read_wat,
+    wasm_to_ir,
+)
+from ppci.wasm.binary.reader import BinaryDecodingError
 from ppci.wasm.util import sanitize_name
 
 from ..helper_util import examples_path
@@ -72,6 +80,78 @@ class WasmLoadAndSaveTestCase(unittest.TestCase):
         self.assertEqual(content1, content2)
 
 
+class WasmBinaryReaderTestCase(unittest.TestCase):
+    def test_lazy_function_bodies(self):
+        """Function bodies are only decoded when used."""
+        program_filename = examples_path / "wasm" / "program.wasm"
+        content = program_filename.read_bytes()
+        wasm_module = Module(content)
+        funcs = [d for d in wasm_module if isinstance(d, components.Func)]
+        self.assertTrue(funcs)
+        for func in funcs:
+            self.assertIsNotNone(func.encoded_instructions)
+        self.assertEqual(content, wasm_module.to_bytes())
+
+        for func in funcs:
+            self.assertIsInstance(func.instructions, list)
+            self.assertIsNone(func.encoded_instructions)
+        self.assertEqual(content, wasm_module.to_bytes())
+
+    def test_operands(self):
+        """Decode instructions with the various kinds of operands."""
+        wasm_module = Module(
+            """
+            (module
+              (memory 1)
+              (func $f (param i32) (result i64)
+                (local f32 f64)
+                f32.const 1.5
+                local.set 1
+                f64.const -2.25
+                local.set 2
+                block
+                  local.get 0
+                  br_table 0 0 0
+                end
+                i64.const -9223372036854775808
+                i64.const 624485
+                local.get 0
+                select
+                i32.const 0
+                i32.const 0
+                i32.const 4
+                memory.fill
+                i32.const 4
+                i64.load offset=8))
+            """
+        )
+        content = wasm_module.to_bytes()
+        wasm_module2 = Module(content)
+        func = wasm_module2.get_definitions_per_section()["func"][0]
+        args = {i.opcode: i.args for i in func.instructions}
+        self.assertEqual((1.5,), args["f32.const"])
+        self.assertEqual((-2.25,), args["f64.const"])
+        self.assertEqual(3, len(args["br_table"][0]))
+        self.assertEqual((624485,), args["i64.const"])
+        self.assertEqual((-(2**63),), func.instructions[8].args)
+        self.assertEqual("memory.fill", func.instructions[-3].opcode)
+
+        # Encode the decoded instructions again:
+        self.assertIsNone(func.encoded_instructions)
+        self.assertEqual(content, wasm_module2.to_bytes())
+
+    def test_invalid_body(self):
+        """Errors in function bodies are found when they are decoded."""
+        content = Module(
+            "(module (func $f (result i32) i32.const 1))"
+        ).to_bytes()
+        index = content.index(bytes([0x41, 0x01, 0x0B]))
+        content = content[:index] + b"\xff" + content[index + 1 :]
+        func = Module(content).get_definitions_per_section()["func"][0]
+        with self.assertRaises(BinaryDecodingError):
+            _ = func.instructions
+
+
 class NameNormalizationTestCase(unittest.TestCase):
     def test_sanitize_name(self):
         self.assertEqual("HelloA20World", sanitize_name("Hello World"))
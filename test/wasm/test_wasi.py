@@ -0,0 +1,89 @@
+"""Test the WASI api"""
+
+import io
+import unittest
+from unittest import mock
+
+from ppci.api import is_platform_supported
+from ppci.wasm import Module, instantiate
+from ppci.wasm.execution import wasi
+
+# Copy the input file to the output file with two iovecs, and write a
+# greeting before it:
+src = """
+(module
+  (import "wasi_unstable" "fd_read"
+    (func $fd_read (param i32 i32 i32 i32) (result i32)))
+  (import "wasi_unstable" "fd_write"
+    (func $fd_write (param i32 i32 i32 i32) (result i32)))
+  (memory (export "memory") 1)
+  (data (i32.const 16) "\\40\\00\\00\\00\\06\\00\\00\\00")
+  (data (i32.const 24) "\\46\\00\\00\\00\\06\\00\\00\\00")
+  (data (i32.const 64) "hello world\\n")
+  (data (i32.const 128) "\\00\\01\\00\\00\\04\\00\\00\\00")
+  (data (i32.const 136) "\\10\\01\\00\\00\\00\\10\\00\\00")
+  (func (export "greet") (param $fd i32) (result i32)
+    (drop (call $fd_write (local.get $fd) (i32.const 16) (i32.const 2)
+      (i32.const 8)))
+    (i32.load (i32.const 8)))
+  (func (export "copy") (param $in i32) (param $out i32) (result i32)
+    (local $n i32)
+    (drop (call $fd_read (local.get $in) (i32.const 128) (i32.const 2)
+      (i32.const 8)))
+    (local.set $n (i32.load (i32.const 8)))
+    (i32.store (i32.const 132) (i32.const 4))
+    (i32.store (i32.const 140) (i32.sub (local.get $n) (i32.const 4)))
+    (drop (call $fd_write (local.get $out) (i32.const 128) (i32.const 2)
+      (i32.const 8)))
+    (i32.load (i32.const 8)))
+  (func (export "bad_write") (param $fd i32) (result i32)
+    (i32.store (i32.const 20) (i32.const 0x10000))
+    (call $fd_write (local.get $fd) (i32.const 16) (i32.const 2)
+      (i32.const 8)))
+)
+"""
+
+
+class WasiTestCase(unittest.TestCase):
+    def test_python(self):
+        self.check_io("python")
+
+    @unittest.skipUnless(is_platform_supported(), "native code not supported")
+    def test_native(self):
+        self.check_io("native")
+
+    def check_io(self, target):
+        wasi_api = wasi.WasiApi([])
+        imports = {
+            "wasi_unstable": {
+                "fd_read": wasi_api.fd_read,
+                "fd_write": wasi_api.fd_write,
+            }
+        }
+        instance = instantiate(Module(src), imports=imports, target=target)
+        wasi_api._instance = instance
+        f_in = io.BytesIO(b"abcdefghij")
+        f_out = io.BytesIO()
+        wasi_api._available_fd[7] = f_in
+        wasi_api._available_fd[8] = f_out
+
+        self.assertEqual(12, instance.exports.greet(8))
+        self.assertEqual(10, instance.exports.copy(7, 8))
+        self.assertEqual(b"hello world\nabcdefghij", f_out.getvalue())
+        self.assertEqual(b"abcd", instance.exports.memory[256:260])
+        self.assertEqual(b"efghij", instance.exports.memory[272:278])
+
+        # Standard output is written right away:
+        with mock.patch.object(wasi, "write_fd", return_value=12) as write:
+            self.assertEqual(12, instance.exports.greet(1))
+        fd, buffers = write.call_args[0]
+        self.assertEqual(1, fd)
+        self.assertEqual(b"hello world\n", b"".join(buffers))
+
+        # Buffers outside of the memory are not accessed:
+        self.assertEqual(wasi.EFAULT, instance.exports.bad_write(8))
+        self.assertEqual(b"hello world\nabcdefghij", f_out.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -10,13 +10,34 @@ python -m pytest benchmark.py
 
 """
 
+import io
 import logging
 import os
+import tempfile
+import tracemalloc
 from glob import glob
 from pathlib import Path
 
-from ppci import api
+import pytest
+
+from ppci import api, irutils
+from ppci.arch.encoding import Instruction
+from ppci.arch.generic_instructions import Label
+from ppci.arch.riscv.rvc_instructions import CB
+from ppci.binutils.archive import get_archive
+from ppci.binutils.disasm import Disassembler
+from ppci.binutils.objectfile import ObjectFile
+from ppci.binutils.outstream import (
+    BinaryOutputStream,
+    DummyOutputStream,
+    FunctionOutputStream,
+)
+from ppci.codegen import CodeGenerator
 from ppci.lang.c import COptions
+from ppci.lang.python import ir_to_python
+from ppci.utils.reporting import DummyReportGenerator
+from ppci.wasm import Module, components, instantiate
+from ppci.wasm.execution import wasi
 
 this_path = Path(__file__).resolve().parent
 root_path = this_path.parent
@@ -30,6 +51,142 @@ def test_compile_8cc(benchmark):
     benchmark(compile_8cc)
 
 
+def test_codegen_serial(benchmark):
+    benchmark(generate_many_functions, None)
+
+
+def test_codegen_parallel(benchmark):
+    benchmark(generate_many_functions, os.cpu_count())
+
+
+def test_codegen_peak_memory(benchmark):
+    ir_module = create_large_module(1000)
+    peak = benchmark.pedantic(measure_peak_memory, (ir_module,), rounds=1)
+    benchmark.extra_info["peak_memory"] = peak
+
+
+def test_register_allocation(benchmark):
+    obj = benchmark(allocate_big_function, "coloring")
+    benchmark.extra_info["code_size"] = obj.byte_size
+
+
+def test_register_allocation_linear(benchmark):
+    obj = benchmark(allocate_big_function, "linear")
+    benchmark.extra_info["code_size"] = obj.byte_size
+
+
+def test_register_allocation_spilling(benchmark):
+    stats = benchmark(allocate_spilling_function, "avr")
+    benchmark.extra_info["spill_rounds"] = stats.spill_rounds
+    benchmark.extra_info["build_time"] = stats.build_time
+
+
+def test_scheduled_cycles(benchmark):
+    cycles = benchmark(generate_scheduled_kernel, "riscv", True)
+    benchmark.extra_info["cycles"] = cycles
+    benchmark.extra_info["unscheduled_cycles"] = generate_scheduled_kernel(
+        "riscv", False
+    )
+
+
+def test_codegen_small_files(benchmark):
+    benchmark(generate_small_files)
+
+
+def test_python_block_switch(benchmark):
+    run = compile_state_machine(16)
+    benchmark(run, 100000)
+
+
+def test_wasm_python_target(benchmark):
+    instance = instantiate(Module(wasm_samples), target="python")
+    benchmark(run_wasm_samples, instance)
+
+
+def test_wasm_tiered_target(benchmark):
+    benchmark(run_wasm_tiered, 20)
+
+
+def test_wasm_instantiate_cached(benchmark):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        benchmark(instantiate_cached, cache_dir)
+
+
+def test_wasm_binary_load(benchmark):
+    content = make_wasm_binary(3000)
+    benchmark(Module, content)
+
+
+def test_wasm_binary_decode(benchmark):
+    content = make_wasm_binary(3000)
+    benchmark(decode_wasm_binary, content)
+
+
+def test_wasm_memory_grow(benchmark):
+    benchmark(grow_wasm_memory, 256)
+
+
+def test_wasm_explicit_checks(benchmark):
+    instance = instantiate_checked("explicit")
+    benchmark(run_wasm_sum, instance, 2000)
+
+
+def test_wasm_guard_pages(benchmark):
+    instance = instantiate_checked("guard")
+    benchmark(run_wasm_sum, instance, 2000)
+
+
+def test_wasi_small_writes(benchmark):
+    benchmark(run_wasi_io, "small_writes", 20000)
+
+
+def test_wasi_copy_file(benchmark):
+    benchmark(run_wasi_io, "copy", 16 * 1024 * 1024)
+
+
+def test_archive_load_json(benchmark):
+    content = save_library(make_library(200), binary=False)
+    benchmark(load_library, content)
+
+
+def test_archive_load_binary(benchmark):
+    content = save_library(make_library(200), binary=True)
+    benchmark(load_library, content)
+
+
+def test_link_with_library(benchmark):
+    content = save_library(make_chained_library(1000), binary=True)
+    benchmark(link_with_library, content)
+
+
+def test_link_relaxation(benchmark):
+    obj = make_relaxable_jumps(20000)
+    benchmark(api.link, [obj])
+
+
+encode_archs = [
+    "arm",
+    "microblaze",
+    "mips",
+    "msp430",
+    "or1k",
+    "riscv",
+    "x86_64",
+    "xtensa",
+]
+
+
+@pytest.mark.parametrize("arch", encode_archs)
+def test_encode_instructions(benchmark, arch):
+    instructions = generate_instructions(arch)
+    benchmark(encode_instructions, instructions)
+
+
+def test_disassemble(benchmark):
+    data = make_code_image("or1k", 1000000)
+    benchmark(disassemble, data, "or1k")
+
+
 def compile_nos_for_riscv():
     """Compile nOS for riscv architecture."""
     logging.basicConfig(level=logging.INFO)
@@ -118,3 +275,517 @@ def compile_8cc():
             objs.append(api.cc(f, arch, coptions=coptions))
 
     # TODO: maybe link it?
+
+
+def many_functions_source(n_functions):
+    """Create c source code with the given amount of functions"""
+    functions = [
+        f"""
+        int f{i}(int a, int b) {{
+            int s = 0;
+            for (int j = 0; j < a; j++) {{
+                s += j * b + {i};
+                if (s > 1000) s -= a;
+            }}
+            return s;
+        }}
+        """
+        for i in range(n_functions)
+    ]
+    return "\n".join(functions)
+
+
+def generate_many_functions(jobs):
+    """Generate code for a module with a lot of functions.
+
+    Use the jobs argument to compare serial and parallel code generation.
+    """
+    source = io.StringIO(many_functions_source(200))
+    ir_module = api.c_to_ir(source, "x86_64")
+    api.optimize(ir_module, level=2)
+    api.ir_to_object([ir_module], "x86_64", jobs=jobs)
+
+
+def create_large_module(n_functions):
+    """Create an ir-module with the given amount of functions"""
+    source = io.StringIO(many_functions_source(n_functions))
+    ir_module = api.c_to_ir(source, "x86_64")
+    api.optimize(ir_module, level=2)
+    return ir_module
+
+
+def measure_peak_memory(ir_module):
+    """Generate an object file, and return the peak memory usage in bytes.
+
+    The memory use should not grow with the amount of functions, since
+    instructions are released after they are encoded.
+    """
+    tracemalloc.start()
+    try:
+        api.ir_to_object([ir_module], "x86_64")
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def allocate_big_function(regalloc):
+    """Generate code for a single function with many live variables.
+
+    The time is dominated by liveness analysis and register allocation.
+    Use the regalloc argument to compare the register allocators.
+    """
+    n_vars = 40
+    lines = ["int big(int a, int b) {"]
+    for i in range(n_vars):
+        lines.append(f"    int v{i} = a * {i} + b;")
+    for i in range(400):
+        x, y, z = i % n_vars, (i * 7) % n_vars, (i * 13) % n_vars
+        lines.append(f"    if (v{y} > {i}) v{x} += v{z}; else v{x} -= b;")
+    total = " + ".join(f"v{i}" for i in range(n_vars))
+    lines.append(f"    return {total};")
+    lines.append("}")
+    source = io.StringIO("\n".join(lines))
+    ir_module = api.c_to_ir(source, "x86_64")
+    return api.ir_to_object([ir_module], "x86_64", regalloc=regalloc)
+
+
+def allocate_spilling_function(arch):
+    """Generate code for a function which spills many registers.
+
+    Returns the register allocation statistics of the function.
+    """
+    n_vars = 12
+    variables = ", ".join(f"v{i}" for i in range(n_vars))
+    lines = ["module spill;", "function int big(int a, int b) {"]
+    lines.append(f"    var int {variables};")
+    for i in range(n_vars):
+        lines.append(f"    v{i} = a * {i} + b;")
+    for i in range(60):
+        x, y, z = i % n_vars, (i * 7) % n_vars, (i * 5) % n_vars
+        lines.append(
+            f"    if (v{y} > {i}) {{ v{x} = v{x} + v{z}; }}"
+            f" else {{ v{x} = v{x} - b; }}"
+        )
+    total = " + ".join(f"v{i}" for i in range(n_vars))
+    lines.append(f"    return {total};")
+    lines.append("}")
+    source = io.StringIO("\n".join(lines))
+    ir_module = api.c3_to_ir([source], [], arch)
+    api.optimize(ir_module, level=2)
+    code_generator = CodeGenerator(api.get_arch(arch), DummyReportGenerator())
+    code_generator.generate(ir_module, DummyOutputStream())
+    return code_generator.register_allocator.statistics["spill_big"]
+
+
+def generate_scheduled_kernel(arch, schedule):
+    """Generate code for a straight line kernel with many loads.
+
+    Returns the estimated number of cycles of the generated code on an
+    in-order pipeline. Use the schedule argument to compare the code
+    with and without instruction scheduling.
+    """
+    lines = ["int kernel(int *a, int *b, int *c) {", "    int s = 0;"]
+    for i in range(64):
+        lines.append(f"    s += a[{i}] * b[{i}] + c[{i}];")
+    lines.append("    return s;")
+    lines.append("}")
+    arch = api.get_arch(arch)
+    ir_module = api.c_to_ir(io.StringIO("\n".join(lines)), arch)
+    api.optimize(ir_module, level=2)
+    code_generator = CodeGenerator(
+        arch, DummyReportGenerator(), optimize_for="speed"
+    )
+    scheduler = code_generator.instruction_scheduler
+    if not schedule:
+        code_generator.instruction_selector.scheduler = None
+    items = []
+    code_generator.generate(ir_module, FunctionOutputStream(items.append))
+    instructions = [i for i in items if isinstance(i, Instruction)]
+    return scheduler.count_cycles(instructions)
+
+
+def generate_small_files():
+    """Generate code for many small modules, one at a time.
+
+    Each module gets its own code generator, like when compiling
+    separate source files. The time shows the startup cost of the
+    code generator.
+    """
+    arch = api.get_arch("riscv")
+    ir_modules = []
+    for i in range(50):
+        source = io.StringIO(f"int f{i}(int a) {{ return a * {i} + 1; }}")
+        ir_modules.append(api.c_to_ir(source, arch))
+    for ir_module in ir_modules:
+        api.ir_to_object([ir_module], arch)
+
+
+wasm_samples = """
+(module
+  (memory 1)
+  (func $fib (export "fib") (param $n i32) (result i32)
+    (if (result i32) (i32.lt_s (local.get $n) (i32.const 2))
+      (then (local.get $n))
+      (else (i32.add
+        (call $fib (i32.sub (local.get $n) (i32.const 1)))
+        (call $fib (i32.sub (local.get $n) (i32.const 2)))))))
+  (func (export "primes") (param $n i32) (result i32)
+    (local $i i32) (local $j i32) (local $count i32)
+    (local.set $i (i32.const 2))
+    (block $done
+      (loop $outer
+        (br_if $done (i32.ge_s (local.get $i) (local.get $n)))
+        (local.set $j (i32.const 2))
+        (block $composite
+          (loop $inner
+            (br_if $composite (i32.eqz
+              (i32.rem_s (local.get $i) (local.get $j))))
+            (local.set $j (i32.add (local.get $j) (i32.const 1)))
+            (br_if $inner (i32.le_s
+              (i32.mul (local.get $j) (local.get $j)) (local.get $i))))
+          (local.set $count (i32.add (local.get $count) (i32.const 1))))
+        (local.set $i (i32.add (local.get $i) (i32.const 1)))
+        (br $outer)))
+    (local.get $count))
+  (func (export "sum") (param $n i32) (result i32)
+    (local $i i32) (local $s i32)
+    (loop $fill
+      (i32.store (i32.shl (local.get $i) (i32.const 2)) (local.get $i))
+      (local.set $i (i32.add (local.get $i) (i32.const 1)))
+      (br_if $fill (i32.lt_s (local.get $i) (local.get $n))))
+    (local.set $i (i32.const 0))
+    (loop $add
+      (local.set $s (i32.add (local.get $s)
+        (i32.load (i32.shl (local.get $i) (i32.const 2)))))
+      (local.set $i (i32.add (local.get $i) (i32.const 1)))
+      (br_if $add (i32.lt_s (local.get $i) (local.get $n))))
+    (local.get $s))
+)
+"""
+
+
+def run_wasm_samples(instance):
+    """Run a few small programs on an instantiated wasm module"""
+    assert instance.exports.fib(15) == 610
+    assert instance.exports.primes(2000) == 302
+    assert instance.exports.sum(1000) == 499500
+
+
+def run_wasm_tiered(n_runs):
+    """Instantiate the wasm samples for tiered execution, and run them
+    a number of times.
+    """
+    instance = instantiate(Module(wasm_samples), target="tiered")
+    for _ in range(n_runs):
+        run_wasm_samples(instance)
+
+
+def instantiate_cached(cache_dir):
+    """Instantiate the wasm samples from a cache directory, compiling
+    them only the first time.
+    """
+    module = Module(wasm_samples)
+    for target in ("native", "python"):
+        if target == "python" or api.is_platform_supported():
+            instance = instantiate(module, target=target, cache_dir=cache_dir)
+            run_wasm_samples(instance)
+
+
+def grow_wasm_memory(n_pages):
+    """Grow the native memory of a wasm module one page at a time.
+
+    Each growth used to copy all of the memory, which took quadratic
+    time in the final size of the memory.
+    """
+    if not api.is_platform_supported():
+        return
+    module = Module(
+        """
+        (module
+          (memory 1)
+          (func (export "grow") (result i32)
+            (memory.grow (i32.const 1))))
+        """
+    )
+    instance = instantiate(module, target="native")
+    for _ in range(n_pages):
+        assert instance.exports.grow() >= 0
+
+
+def instantiate_checked(memory_checks):
+    """Instantiate the wasm samples as native code with the given memory
+    checks.
+
+    Compare explicit bounds checks with guard pages, which do not cost
+    anything per access.
+    """
+    if api.is_platform_supported():
+        return instantiate(
+            Module(wasm_samples), target="native", memory_checks=memory_checks
+        )
+
+
+def run_wasm_sum(instance, n_runs):
+    """Run the memory heavy sum sample a number of times"""
+    if instance is not None:
+        for _ in range(n_runs):
+            assert instance.exports.sum(16000) == 127992000
+
+
+wasi_io_src = """
+(module
+  (import "wasi_unstable" "fd_read"
+    (func $fd_read (param i32 i32 i32 i32) (result i32)))
+  (import "wasi_unstable" "fd_write"
+    (func $fd_write (param i32 i32 i32 i32) (result i32)))
+  (memory (export "memory") 2)
+  (data (i32.const 16) "\\40\\00\\00\\00\\0c\\00\\00\\00")
+  (data (i32.const 24) "\\00\\00\\01\\00\\00\\00\\01\\00")
+  (data (i32.const 64) "hello world\\n")
+  (func (export "small_writes") (param $fd i32) (param $n i32)
+    (loop $again
+      (drop (call $fd_write (local.get $fd) (i32.const 16) (i32.const 1)
+        (i32.const 8)))
+      (local.set $n (i32.sub (local.get $n) (i32.const 1)))
+      (br_if $again (local.get $n))))
+  (func (export "copy") (param $in i32) (param $out i32)
+    (loop $again
+      (drop (call $fd_read (local.get $in) (i32.const 24) (i32.const 1)
+        (i32.const 8)))
+      (i32.store (i32.const 28) (i32.load (i32.const 8)))
+      (drop (call $fd_write (local.get $out) (i32.const 24) (i32.const 1)
+        (i32.const 8)))
+      (i32.store (i32.const 28) (i32.const 0x10000))
+      (br_if $again (i32.load (i32.const 8)))))
+)
+"""
+
+
+def run_wasi_io(function, amount, target="python"):
+    """Write many small pieces of output or copy a large file with
+    WASI calls.
+    """
+    wasi_api = wasi.WasiApi([])
+    imports = {
+        "wasi_unstable": {
+            "fd_read": wasi_api.fd_read,
+            "fd_write": wasi_api.fd_write,
+        }
+    }
+    instance = instantiate(Module(wasi_io_src), imports=imports, target=target)
+    wasi_api._instance = instance
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, "input.bin")
+        with open(filename, "wb") as f:
+            f.write(bytes(amount if function == "copy" else 0))
+        with open(filename, "rb") as f_in, open(os.devnull, "wb") as f_out:
+            wasi_api._available_fd[7] = f_in
+            wasi_api._available_fd[8] = f_out
+            if function == "copy":
+                instance.exports.copy(7, 8)
+            else:
+                instance.exports.small_writes(8, amount)
+
+
+def make_wasm_binary(n_functions):
+    """Create a binary wasm module with many small functions"""
+    lines = ["(module", "(memory 1)"]
+    for k in range(n_functions):
+        lines.append(f'(func $f{k} (export "f{k}") (param i32) (result i32)')
+        lines.append(
+            f"""
+            (local i32 i64 f64)
+            block
+              loop
+                local.get 1
+                local.get 0
+                i32.ge_s
+                br_if 1
+                local.get 1
+                i32.load offset=4
+                i64.extend_i32_s
+                i64.const {k * 1000003}
+                i64.add
+                local.set 2
+                f64.const 1.5
+                local.get 2
+                f64.convert_i64_s
+                f64.mul
+                local.set 3
+                local.get 1
+                i32.const 1
+                i32.add
+                local.set 1
+                br 0
+              end
+            end
+            local.get 1)"""
+        )
+    lines.append(")")
+    return Module("\n".join(lines)).to_bytes()
+
+
+def decode_wasm_binary(content):
+    """Load a binary wasm module and decode all function bodies"""
+    wasm_module = Module(content)
+    for definition in wasm_module:
+        if isinstance(definition, components.Func):
+            _ = definition.instructions
+
+
+def make_library(n_objects):
+    """Create an archive with many copies of an object file with debug
+    information.
+    """
+    source = io.StringIO(
+        "\n".join(
+            f"int f{i}(int a, int b) {{ return a * b + {i}; }}"
+            for i in range(50)
+        )
+    )
+    obj = api.cc(source, "riscv", debug=True)
+    return api.archive([obj] * n_objects)
+
+
+def save_library(library, binary):
+    """Save an archive in the binary or json format"""
+    f = io.BytesIO() if binary else io.StringIO()
+    library.save(f)
+    content = f.getvalue()
+    return content if binary else content.encode("utf-8")
+
+
+def load_library(content):
+    """Load an archive and all of its object files"""
+    library = get_archive(io.BytesIO(content))
+    return list(library)
+
+
+def make_chained_library(n_objects):
+    """Create an archive in which each object file uses a function of the
+    next one, such that linking the first one requires all of them.
+    """
+    arch = api.get_arch("riscv")
+    objs = []
+    for i in range(n_objects):
+        obj = ObjectFile(arch)
+        obj.create_section("code").add_data(bytes(8))
+        obj.add_symbol(0, f"f{i}", "global", 0, "code", "func", 8)
+        if i + 1 < n_objects:
+            obj.add_symbol(1, f"f{i + 1}", "global", None, None, "func", 0)
+        objs.append(obj)
+    objs.reverse()
+    return api.archive(objs)
+
+
+def link_with_library(content):
+    """Link a call of the first function in a chained library"""
+    library = get_archive(io.BytesIO(content))
+    obj = ObjectFile(library.get_member(0).arch)
+    obj.create_section("code")
+    obj.add_symbol(0, "f0", "global", None, None, "func", 0)
+    return api.link([obj], libraries=[library])
+
+
+def make_relaxable_jumps(n_jumps):
+    """Create an object file with many jumps which can be relaxed"""
+    obj = ObjectFile(api.get_arch("riscv:rvc"))
+    stream = BinaryOutputStream(obj)
+    stream.select_section("code")
+    for i in range(n_jumps):
+        stream.emit(CB(f"l{i}"))
+        stream.emit(Label(f"l{i}"))
+    return obj
+
+
+def generate_instructions(arch):
+    """Generate the instructions of some functions for the given arch"""
+    functions = [
+        f"""
+        int f{i}(int *a, int n, char c) {{
+            int s = {i};
+            for (int j = 0; j < n; j++) {{
+                s += a[j] * c - (s >> 2);
+                if (s > {i * 100}) s -= a[j + 1];
+            }}
+            return s;
+        }}
+        """
+        for i in range(20)
+    ]
+    source = io.StringIO("\n".join(functions))
+    ir_module = api.c_to_ir(source, arch)
+    api.optimize(ir_module, level=2)
+    instructions = []
+    api.ir_to_stream(
+        ir_module, arch, FunctionOutputStream(instructions.append)
+    )
+    return instructions
+
+
+def encode_instructions(instructions):
+    """Encode the instructions, and return the total size in bytes"""
+    return sum(len(instruction.encode()) for instruction in instructions)
+
+
+def make_code_image(arch, size):
+    """Create an image of the given size with code for the given arch"""
+    source = io.StringIO(
+        """
+        int f(int *a, int n, char c) {
+            int s = 0;
+            for (int j = 0; j < n; j++) {
+                s += a[j] * c - (s >> 2);
+                if (s > 100) s -= a[j + 1];
+            }
+            return s;
+        }
+        """
+    )
+    obj = api.cc(source, arch)
+    code = bytes(obj.get_section("code").data)
+    return code * (size // len(code))
+
+
+def disassemble(data, arch):
+    """Disassemble the data, and return the number of instructions"""
+    instructions = []
+    disassembler = Disassembler(api.get_arch(arch))
+    disassembler.disasm(data, FunctionOutputStream(instructions.append))
+    return len(instructions)
+
+
+def compile_state_machine(n_states):
+    """Compile a loop over a number of states to python.
+
+    The loop can be entered at two states, so the python code switches
+    between the blocks of the states. Returns the python function.
+    """
+    lines = ["module m;", "global function i32 run(i32 n) {"]
+    lines.append("  entry: {")
+    lines.append("    i32 zero = 0;")
+    lines.append("    i32 one = 1;")
+    lines.append("    cjmp n < zero ? s0 : s1;")
+    lines.append("  }")
+    for k in range(n_states):
+        previous = (k + 1) % n_states
+        inputs = f"s{previous}: d{previous}"
+        if k < 2:
+            inputs = f"entry: zero, {inputs}"
+        lines.append(f"  s{k}: {{")
+        lines.append(f"    i32 c{k} = phi {inputs};")
+        lines.append(f"    i32 d{k} = c{k} + one;")
+        lines.append(f"    cjmp d{k} < n ? s{(k - 1) % n_states} : done;")
+        lines.append("  }")
+    inputs = ", ".join(f"s{k}: d{k}" for k in range(n_states))
+    lines.append("  done: {")
+    lines.append(f"    i32 r = phi {inputs};")
+    lines.append("    return r;")
+    lines.append("  }")
+    lines.append("}")
+    ir_module = irutils.read_module(io.StringIO("\n".join(lines)))
+    f = io.StringIO()
+    ir_to_python([ir_module], f)
+    namespace = {}
+    exec(f.getvalue(), namespace)
+    return namespace["run"]
@@ -50,7 +50,7 @@ with html_reporter(report_html) as reporter:
         objs, layout, use_runtime=True, reporter=reporter, debug=True
     )
     tlf_filename = this_path / "firmware.tlf"
-    with tlf_filename.open("w") as of:
+    with tlf_filename.open("wb") as of:
         obj.save(of)
     api.objcopy(obj, "flash", "bin", this_path / "code.bin")
     api.objcopy(obj, "ram", "bin", this_path / "data.bin")